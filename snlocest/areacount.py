@@ -0,0 +1,209 @@
+# coding: utf-8
+
+'''
+ユーザごとのエリアIDの出現数
+
+(user_id, area_id, count) を (user_id, area_id) の昇順に並べた構造化配列 (COUNT_DTYPE) であらわし、
+.npyに保存する。ファイルはメモリマップして読めるので、複数のファイルはユーザIDの範囲ごとに
+少しずつ読んでマージできる (merge_counts)。
+日ごとの配列は月ごと・年ごとにまとめておき、日付の範囲はなるべく大きな単位の組み合わせで集計する
+(decompose_date_range)。
+'''
+
+import datetime
+import gzip
+import numpy as np
+
+from snlocest.util.parse import parse_int_spans
+
+
+COUNT_DTYPE = np.dtype([('user_id', '<i8'), ('area_id', '<i4'), ('count', '<i4')])
+
+
+def count_pairs(users, areas, weights=None):
+    '''(user_id, area_id) の組の出現数を数えて、COUNT_DTYPEの配列を返す
+
+    Args:
+        users, areas: np.ndarray 組のユーザIDとエリアID
+        weights: np.ndarray (optional) 各組の出現数 (なければ1)
+    '''
+    users = np.asarray(users, dtype=np.int64)
+    areas = np.asarray(areas, dtype=np.int64)
+    order = np.lexsort((areas, users))
+    users, areas = users[order], areas[order]
+    # 同じ組が続く区間の先頭
+    starts = np.flatnonzero(np.r_[len(users) > 0, (users[1:] != users[:-1]) | (areas[1:] != areas[:-1])])
+    result = np.empty(len(starts), dtype=COUNT_DTYPE)
+    result['user_id'] = users[starts]
+    result['area_id'] = areas[starts]
+    if weights is None:
+        result['count'] = np.diff(np.r_[starts, len(users)])
+    else:
+        weights = np.asarray(weights, dtype=np.int64)[order]
+        result['count'] = np.add.reduceat(weights, starts) if len(starts) else weights[:0]
+    return result
+
+
+def _parse_matches_block(data):
+    '''改行で終わる行を連結したバイト列から、2列目と3列目の整数の配列を返す
+
+    区切り文字の位置からまとめてパースする。想定しない形式の行があればNoneを返す。
+    '''
+    buf = np.frombuffer(data, dtype=np.uint8)
+    newlines = np.flatnonzero(buf == ord('\n'))
+    line_starts = np.r_[0, newlines[:-1] + 1]
+    tabs = np.flatnonzero(buf == ord('\t'))
+    # 各行の最初のタブ
+    first = np.searchsorted(tabs, line_starts)
+    if len(first) and first[-1] + 1 >= len(tabs):
+        return None
+    tab1 = tabs[first]
+    tab2 = tabs[np.minimum(first + 1, len(tabs) - 1)]
+    # 3列目は次のタブか行末まで
+    tab3 = np.where(first + 2 < len(tabs), tabs[np.minimum(first + 2, len(tabs) - 1)], len(buf))
+    ends = np.minimum(tab3, newlines)
+    if ((tab1 >= newlines) | (tab2 >= newlines)).any():
+        return None
+    users = parse_int_spans(buf, tab1 + 1, tab2)
+    areas = parse_int_spans(buf, tab2 + 1, ends)
+    if users is None or areas is None:
+        return None
+    return users, areas
+
+
+def read_area_matches(infile, blocksize=1 << 24):
+    '''areamatcher.pyの出力 (status_id, user_id, area_id[, area_id, ...]) のバイナリのファイルから、
+    ユーザIDと最初のエリアIDの配列を返す (cut -f 2,3 と同じ)
+
+    blocksizeずつ読んで、ブロックごとにまとめてパースする。
+    '''
+    users = [np.array([], dtype=np.int64)]
+    areas = [np.array([], dtype=np.int64)]
+    rest = b''
+    while True:
+        block = infile.read(blocksize)
+        if not block:
+            if not rest:
+                break
+            block = b'\n'
+        data = rest + block
+        end = data.rfind(b'\n') + 1
+        data, rest = data[:end], data[end:]
+        parsed = _parse_matches_block(data)
+        if parsed is None:
+            # 数字以外があるなど、まとめてパースできないブロックは1行ずつパースする
+            # (途中で切れた最後の行など、3列ない行は数えない)
+            lines = [cols for cols in (line.split(b'\t', 3) for line in data.splitlines()) if len(cols) >= 3]
+            parsed = (np.array([int(cols[1]) for cols in lines], dtype=np.int64),
+                      np.array([int(cols[2]) for cols in lines], dtype=np.int64))
+        users.append(parsed[0])
+        areas.append(parsed[1])
+    return np.concatenate(users), np.concatenate(areas)
+
+
+def read_count_tsv(infile):
+    '''prepare_countarea.pyのTSV (count, user_id, area_id) のバイナリのファイルから、COUNT_DTYPEの配列を返す'''
+    data = np.loadtxt(infile, dtype=np.int64, delimiter='\t', ndmin=2).reshape(-1, 3)
+    return count_pairs(data[:, 1], data[:, 2], weights=data[:, 0])
+
+
+def save_counts(path, counts):
+    '''COUNT_DTYPEの配列を.npyの形式で保存する (pathの拡張子は.npyでなくてもよい)'''
+    with open(path, 'wb') as fp:
+        np.save(fp, np.asarray(counts, dtype=COUNT_DTYPE))
+
+
+def load_counts(path, mmap=True):
+    '''save_counts()で保存したファイルか、prepare_countarea.pyのTSV (.gzも可) を読み込む'''
+    with open(path, 'rb') as fp:
+        is_npy = fp.read(6) == b'\x93NUMPY'
+    if is_npy:
+        return np.load(path, mmap_mode='r' if mmap else None)
+    with (gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')) as fp:
+        return read_count_tsv(fp)
+
+
+def merge_counts(arrays, blocksize=1 << 20):
+    '''(user_id, area_id)の昇順のCOUNT_DTYPEの配列をマージして、同じ組の出現数を合計する
+
+    各配列から最大blocksize行ずつ読み、どの配列でも読み終わっているユーザIDの範囲だけをまとめて合計する
+    (k-way merge)。1度に読むのは各配列のblocksize行程度なので、メモリマップしたファイルなら
+    ファイルが大きくてもメモリは増えない。
+    Returns:
+        (user_id, area_id)の昇順のCOUNT_DTYPEの配列のイテレータ
+    '''
+    arrays = [a for a in arrays if len(a)]
+    positions = [0] * len(arrays)
+    while arrays:
+        # 各配列で今回読む範囲の次のユーザIDのうち最小のもの。これより小さいユーザIDは全部読める
+        bound = None
+        for a, p in zip(arrays, positions):
+            end = p + blocksize
+            if end < len(a):
+                user = a['user_id'][end]
+                bound = user if bound is None else min(bound, user)
+        if bound is not None:
+            # 1人のユーザがblocksize行より多いときも先に進むように、少なくとも最小のユーザIDまでは読む
+            bound = max(bound, min(a['user_id'][p] for a, p in zip(arrays, positions)) + 1)
+
+        parts = []
+        next_arrays = []
+        next_positions = []
+        for a, p in zip(arrays, positions):
+            end = len(a) if bound is None else p + np.searchsorted(a['user_id'][p:], bound, side='left')
+            parts.append(a[p:end])
+            if end < len(a):
+                next_arrays.append(a)
+                next_positions.append(end)
+        arrays, positions = next_arrays, next_positions
+
+        block = np.concatenate(parts)
+        if len(block):
+            yield count_pairs(block['user_id'], block['area_id'], weights=block['count'])
+
+
+def merge_count_files(paths, blocksize=1 << 20):
+    '''複数のファイル (load_counts()で読めるもの) をマージして、COUNT_DTYPEの配列を返す'''
+    blocks = list(merge_counts([load_counts(path) for path in paths], blocksize=blocksize))
+    return np.concatenate(blocks) if blocks else np.empty(0, dtype=COUNT_DTYPE)
+
+
+def _next_month(date):
+    return datetime.date(date.year + date.month // 12, date.month % 12 + 1, 1)
+
+
+def decompose_date_range(start, end):
+    '''日付の範囲 [start, end) を、年・月・日の単位の区間に分ける
+
+    なるべく大きな単位 (年 > 月 > 日) を使うので、区間の数は最小になる。
+    Returns:
+        ('year' | 'month' | 'day', 区間の最初の日付) のリスト (日付の昇順)
+
+    >>> decompose_date_range(datetime.date(2015, 12, 30), datetime.date(2017, 3, 2))  # doctest: +NORMALIZE_WHITESPACE
+    [('day', datetime.date(2015, 12, 30)), ('day', datetime.date(2015, 12, 31)),
+     ('year', datetime.date(2016, 1, 1)),
+     ('month', datetime.date(2017, 1, 1)), ('month', datetime.date(2017, 2, 1)),
+     ('day', datetime.date(2017, 3, 1))]
+    '''
+    parts = []
+    date = start
+    while date < end:
+        if date.month == 1 and date.day == 1 and datetime.date(date.year + 1, 1, 1) <= end:
+            parts.append(('year', date))
+            date = datetime.date(date.year + 1, 1, 1)
+        elif date.day == 1 and _next_month(date) <= end:
+            parts.append(('month', date))
+            date = _next_month(date)
+        else:
+            parts.append(('day', date))
+            date += datetime.timedelta(days=1)
+    return parts
+
+
+def write_count_tsv(counts, outfile):
+    '''prepare_countarea.pyのTSV (count, user_id, area_id) を書き出す
+
+    これまでの cut -f 2,3 | LC_ALL=C sort | uniq -c と同じく、"user_id\\tarea_id" の文字列の順に並べる。
+    '''
+    keys = ['{}\t{}'.format(u, a) for u, a in zip(counts['user_id'].tolist(), counts['area_id'].tolist())]
+    outfile.write(''.join('{}\t{}\n'.format(c, key) for key, c in sorted(zip(keys, counts['count'].tolist()))))
@@ -7,31 +7,128 @@ data/areadata以下のファイルをあらわすクラスたち
 import csv
 csv.field_size_limit(100000000)
 import gzip
+import hashlib
+import os
+import sys
 from collections import OrderedDict
+import numpy as np
+import shapely
 import shapely.wkt as wkt
+import shapely.wkb as wkb
+
+# shapely 2ならWKBの配列をまとめてデコードできる
+_SHAPELY2 = hasattr(shapely, 'from_wkb')
+
+
+def _file_hash(path):
+    '''ファイルの内容のSHA-1を返す'''
+    h = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
 
 
 class AreaData():
     '''エリアデータ
 
     area_id, name, MultiPolygon
+
+    WKTのパースは遅いので、読み込んだエリアデータはWKBにしてキャッシュ (path + '.cache.npz') に保存し、
+    次からはキャッシュから読み込む。キャッシュには元のファイルのサイズ、更新時刻、SHA-1を保存しておき、
+    サイズと更新時刻が一致するか、一致しなくても内容が同じならキャッシュを使う。
+    lazy=Trueなら、MultiPolygonはget_shape()で初めて使うときにデコードする。
+
+    Args:
+        path: str エリアデータのTSV (.gzで終わる場合はgzip圧縮されているとみなす)
+        cache: bool キャッシュを使うかどうか
+        lazy: bool MultiPolygonを使うときにデコードするかどうか
+        cache_path: str (optional) キャッシュのパス
     '''
-    def __init__(self, path='data/areadata/japan-gxml.tsv.gz'):
+    def __init__(self, path='data/areadata/japan-gxml.tsv.gz', cache=True, lazy=False, cache_path=None):
         self._data = OrderedDict()
+        # デコードしていないMultiPolygon area_id -> WKB (bytes) or WKT (str)
+        self._encoded = {}
+        self._lazy = lazy
+        if cache_path is None:
+            cache_path = path + '.cache.npz'
+        if cache and self._load_cache(path, cache_path):
+            return
         if path.endswith('.gz'):
             with gzip.open(path, 'rt', encoding='utf-8') as fp:
                 self._load_data(fp)
         else:
             with open(path, 'rt', encoding='utf-8') as fp:
                 self._load_data(fp)
+        if cache:
+            self._save_cache(path, cache_path)
 
     def _load_data(self, infile):
         for line in csv.reader(infile, delimiter='\t'):
             area_id = int(line[0])
             name = line[1]
-            polygon = wkt.loads(line[2])
+            if self._lazy:
+                self._encoded[area_id] = line[2]
+                polygon = None
+            else:
+                polygon = wkt.loads(line[2])
             self._data[area_id] = (name, polygon)
 
+    def _load_cache(self, path, cache_path):
+        '''キャッシュが元のファイルと一致すれば読み込んでTrueを返す'''
+        if not os.path.exists(cache_path):
+            return False
+        st = os.stat(path)
+        with np.load(cache_path) as data:
+            size, mtime_ns = data['source_stat'].tolist()
+            stat_changed = (size, mtime_ns) != (st.st_size, st.st_mtime_ns)
+            if stat_changed and str(data['source_hash']) != _file_hash(path):
+                return False
+            if stat_changed:
+                # 内容は同じ (touchしたなど) なので、次からハッシュを計算しなくてよいようにサイズと更新時刻を書き直す
+                self._write_cache(cache_path, dict({k: data[k] for k in data.files},
+                                                   source_stat=np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)))
+            area_ids = data['area_ids'].tolist()
+            names = data['names'].tolist()
+            offsets = data['offsets'].tolist()
+            buf = data['wkb'].tobytes()
+        blobs = [buf[offsets[i]:offsets[i+1]] for i in range(len(area_ids))]
+        if self._lazy:
+            self._encoded = dict(zip(area_ids, blobs))
+            shapes = [None] * len(area_ids)
+        elif _SHAPELY2:
+            shapes = shapely.from_wkb(np.array(blobs, dtype=object)).tolist()
+        else:
+            shapes = [wkb.loads(b) for b in blobs]
+        self._data = OrderedDict(zip(area_ids, zip(names, shapes)))
+        return True
+
+    def _save_cache(self, path, cache_path):
+        '''エリアデータをWKBにしてキャッシュに保存する。保存できなくてもエラーにはしない'''
+        st = os.stat(path)
+        area_ids = list(self._data)
+        blobs = [self.get_shape(a).wkb for a in area_ids]
+        offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in blobs], out=offsets[1:])
+        self._write_cache(cache_path, dict(
+            area_ids=np.array(area_ids, dtype=np.int64),
+            names=np.array([self._data[a][0] for a in area_ids], dtype=str),
+            offsets=offsets,
+            wkb=np.frombuffer(b''.join(blobs), dtype=np.uint8),
+            source_stat=np.array([st.st_size, st.st_mtime_ns], dtype=np.int64),
+            source_hash=np.array(_file_hash(path))))
+
+    @staticmethod
+    def _write_cache(cache_path, arrays):
+        '''配列をキャッシュに書き出す (一時ファイルに書いてから置き換える)。保存できなくてもエラーにはしない'''
+        temp_path = cache_path + '.tmp'
+        try:
+            with open(temp_path, 'wb') as fp:
+                np.savez(fp, **arrays)
+            os.replace(temp_path, cache_path)
+        except OSError as ex:
+            print('Failed to save the cache of the area data:', ex, file=sys.stderr)
+
     def get_coordinate(self, area_id):
         raise NotImplementedError()
 
@@ -41,7 +138,13 @@ class AreaData():
 
     def get_shape(self, area_id):
         '''Return an MultiPolygon of area_id'''
-        return self._data[int(area_id)][1]
+        area_id = int(area_id)
+        name, shape = self._data[area_id]
+        if shape is None:
+            encoded = self._encoded.pop(area_id)
+            shape = wkb.loads(encoded) if isinstance(encoded, bytes) else wkt.loads(encoded)
+            self._data[area_id] = (name, shape)
+        return shape
 
     def __iter__(self):
         '''Iterate all area_id which exists'''
@@ -49,8 +152,8 @@ class AreaData():
 
     def iter_areas(self):
         '''Return an iterator of (area_id, name, MultiPolygon)'''
-        for k, v in self._data.items():
-            yield k, v[0], v[1]
+        for k in list(self._data):
+            yield k, self._data[k][0], self.get_shape(k)
 
 
 class AreaCoordinateData():
@@ -0,0 +1,165 @@
+# coding: utf-8
+
+'''
+エリア照合のための格子状の索引
+
+エリアのある範囲を一定の解像度(度)の格子に分けて、各セルに
+    セル全体が1つのエリアの内部にある: そのエリアのindex (>= 0)
+    どのエリアとも重ならない: NO_AREA (-1)
+    エリアの境界を含む: -2 - (境界のセルの番号)
+を入れたint32の配列を作る。境界のセルには、セルと重なるPolygonの候補リストを持たせる。
+ほとんどの座標はエリアの内部のセルに入るので、配列を引くだけでエリアが決まり、
+境界のセルに入った座標だけ候補のPolygonとの厳密な判定をすればよい。
+
+索引はエリアデータのファイルのサイズと更新時刻、解像度とあわせて.npzに保存し、
+エリアデータが変わったときだけ作り直す。
+'''
+
+import os
+import numpy as np
+import shapely
+from shapely.geometry import box
+from shapely.prepared import prep
+
+from snlocest.graph import gather_rows
+
+
+NO_AREA = -1
+
+# shapely 2なら、セルの矩形とPolygonの関係をまとめて判定できる
+_SHAPELY2 = hasattr(shapely, 'contains_xy')
+
+
+def source_signature(path, resolution):
+    '''エリアデータのファイルと解像度から、索引を作り直すかどうかを判定する文字列を作る'''
+    st = os.stat(path)
+    return '{}:{}:{!r}'.format(st.st_size, st.st_mtime_ns, float(resolution))
+
+
+def _relate_boxes(polygon, x0, y0, x1, y1):
+    '''矩形 (x0, y0, x1, y1) の配列について、polygonの内部に含まれるか、polygonと重なるかを返す'''
+    if _SHAPELY2:
+        boxes = shapely.box(x0, y0, x1, y1)
+        return shapely.contains_properly(polygon, boxes), shapely.intersects(polygon, boxes)
+    prepared = prep(polygon)
+    boxes = [box(*b) for b in zip(x0.tolist(), y0.tolist(), x1.tolist(), y1.tolist())]
+    inside = np.array([prepared.contains_properly(b) for b in boxes], dtype=bool)
+    hit = np.array([prepared.intersects(b) for b in boxes], dtype=bool)
+    return inside, hit
+
+
+class AreaGrid():
+    '''エリア照合のための格子状の索引
+
+    cells: np.ndarray (ny, nx) int32 各セルの値
+    origin: (minx, miny) 格子の左下の座標
+    resolution: float セルの幅(度)
+    cand_indptr, cand_parts: 境界のセルkの候補のPolygonは cand_parts[cand_indptr[k]:cand_indptr[k+1]]
+    area_ids: np.ndarray 内部のセルの値 (エリアのindex) に対応するarea_id
+    '''
+    def __init__(self, cells, origin, resolution, cand_indptr, cand_parts, area_ids, source=''):
+        self.cells = cells
+        self.origin = (float(origin[0]), float(origin[1]))
+        self.resolution = float(resolution)
+        self.cand_indptr = cand_indptr
+        self.cand_parts = cand_parts
+        self.area_ids = area_ids
+        self.source = source
+
+    @classmethod
+    def build(cls, matcher, resolution=0.01, source=''):
+        '''BatchAreaMatcherのPolygonから索引を作る
+
+        Args:
+            matcher: snlocest.scripts.areamatcher.BatchAreaMatcher (parts, part_areas, area_ids, bounds を使う)
+            resolution: float セルの幅(度)
+        '''
+        res = float(resolution)
+        bounds = matcher.bounds
+        minx = np.floor(bounds[:, 0].min() / res) * res
+        miny = np.floor(bounds[:, 1].min() / res) * res
+        nx = int(np.ceil((bounds[:, 2].max() - minx) / res)) + 1
+        ny = int(np.ceil((bounds[:, 3].max() - miny) / res)) + 1
+
+        # Polygonごとに、bounding boxにかかるセルとの関係を調べる
+        cell_ids = []
+        part_ids = []
+        insides = []
+        for i, (part, b) in enumerate(zip(matcher.parts, bounds.tolist())):
+            # lookup()と同じ式でセルの番号を求める
+            ix0, iy0 = int(np.floor((b[0] - minx) / res)), int(np.floor((b[1] - miny) / res))
+            ix1, iy1 = int(np.floor((b[2] - minx) / res)), int(np.floor((b[3] - miny) / res))
+            gx, gy = np.meshgrid(np.arange(ix0, ix1 + 1), np.arange(iy0, iy1 + 1))
+            gx, gy = gx.ravel(), gy.ravel()
+            x0 = minx + gx * res
+            y0 = miny + gy * res
+            inside, hit = _relate_boxes(part, x0, y0, x0 + res, y0 + res)
+            cell_ids.append((gy * nx + gx)[hit])
+            part_ids.append(np.full(hit.sum(), i, dtype=np.int64))
+            insides.append(inside[hit])
+        cell_ids = np.concatenate(cell_ids) if cell_ids else np.array([], dtype=np.int64)
+        part_ids = np.concatenate(part_ids) if part_ids else np.array([], dtype=np.int64)
+        insides = np.concatenate(insides) if insides else np.array([], dtype=bool)
+
+        # セルごとにまとめる
+        order = np.lexsort((part_ids, cell_ids))
+        cell_ids, part_ids, insides = cell_ids[order], part_ids[order], insides[order]
+        n_hits = np.bincount(cell_ids, minlength=nx * ny)
+        cells = np.full(nx * ny, NO_AREA, dtype=np.int32)
+
+        # 1つのPolygonだけと重なり、その内部にあるセルはエリアの内部のセル
+        single = n_hits[cell_ids] == 1
+        interior = single & insides
+        cells[cell_ids[interior]] = matcher.part_areas[part_ids[interior]]
+
+        # それ以外の重なりのあるセルは境界のセル
+        border = ~interior
+        border_cells, counts = np.unique(cell_ids[border], return_counts=True)
+        cells[border_cells] = -2 - np.arange(len(border_cells))
+        cand_indptr = np.zeros(len(border_cells) + 1, dtype=np.int64)
+        np.cumsum(counts, out=cand_indptr[1:])
+        cand_parts = part_ids[border].astype(np.int32)
+
+        return cls(cells.reshape(ny, nx), (minx, miny), res, cand_indptr, cand_parts,
+                   np.asarray(matcher.area_ids, dtype=np.int64), source=source)
+
+    def lookup(self, x, y):
+        '''座標の配列 (x, y) が入るセルの値の配列を返す。格子の外はNO_AREA'''
+        ny, nx = self.cells.shape
+        gx = np.floor((np.asarray(x, dtype=np.float64) - self.origin[0]) / self.resolution)
+        gy = np.floor((np.asarray(y, dtype=np.float64) - self.origin[1]) / self.resolution)
+        valid = (gx >= 0) & (gx < nx) & (gy >= 0) & (gy < ny)
+        values = np.full(len(gx), NO_AREA, dtype=np.int32)
+        values[valid] = self.cells[gy[valid].astype(np.int64), gx[valid].astype(np.int64)]
+        return values
+
+    def candidates(self, values):
+        '''境界のセルの値の配列から、候補のPolygonを連結した配列とoffsetsを返す (gather_rows)'''
+        return gather_rows(self.cand_indptr, self.cand_parts, -2 - np.asarray(values, dtype=np.int64))
+
+    def save(self, path):
+        '''.npzの形式で保存する'''
+        with open(path, 'wb') as fp:
+            np.savez_compressed(fp, cells=self.cells, origin=np.array(self.origin),
+                                resolution=np.array(self.resolution),
+                                cand_indptr=self.cand_indptr, cand_parts=self.cand_parts,
+                                area_ids=self.area_ids, source=np.array(self.source))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['cells'], tuple(data['origin']), data['resolution'].item(),
+                       data['cand_indptr'], data['cand_parts'], data['area_ids'],
+                       source=str(data['source']))
+
+    @classmethod
+    def load_or_build(cls, path, areadata_path, matcher, resolution=0.01):
+        '''pathに保存した索引を読み込む。エリアデータか解像度が変わっていたら作り直して保存する'''
+        source = source_signature(areadata_path, resolution)
+        if os.path.exists(path):
+            grid = cls.load(path)
+            if grid.source == source and np.array_equal(grid.area_ids, matcher.area_ids):
+                return grid
+        grid = cls.build(matcher, resolution=resolution, source=source)
+        grid.save(path)
+        return grid
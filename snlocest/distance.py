@@ -10,15 +10,28 @@ This module provides cached geographic distance functions.
  - hubeny formula
 
 Usage:
-p1 = (lon, lat)
-p2 = (lon, lat)
+p1 = (lat, lon)
+p2 = (lat, lon)
 from snlocest.distance import distance
 distance(p1, p2) # this method is cached
+
+距離関数 (vincenty, hubeny) は座標を (lat, lon) として受け取る。
+AreaCoordinateDataの座標は (lon, lat) なので、エリア間の距離関数は (lat, lon) に並べ替えてから渡す。
+
+エリア間の距離は、すべての組を事前に計算した距離行列からも引ける。
+distance = build_area_distance_matrix(AreaCoordinateData(), path='data/areadata/area_distance.npy')
+distance(a1, a2)
 '''
 
+import hashlib
+import json
+import os.path
 from functools import lru_cache
+import numpy as np
 from geopy.distance import vincenty as _vincenty
 from .hubeny_distance import hubeny_distance as _hubeny
+from .hubeny_distance import hubeny_distance_pairwise as _hubeny_pairwise
+from .vincenty_distance import vincenty_distance_pairwise as _vincenty_pairwise
 
 
 CACHE_SIZE = 2 ** 19
@@ -31,7 +44,35 @@ def hubeny(p1, p2):
 def vincenty(p1, p2):
     return _vincenty(p1, p2).meters
 
-_meter_vincenty = lambda p1, p2: _vincenty(p1, p2).meters
+def _meter_vincenty(p1, p2):
+    return _vincenty(p1, p2).meters
+
+# すべての組の距離をまとめて計算できるベクトル化版があるdistfunc
+_PAIRWISE_FUNCS = {
+    hubeny: _hubeny_pairwise,
+    _hubeny: _hubeny_pairwise,
+    vincenty: _vincenty_pairwise,
+    _meter_vincenty: _vincenty_pairwise,
+}
+
+# 保存した距離行列のシグネチャに使う距離の名前 (同じ距離を計算するdistfuncは同じ名前)
+_METRIC_NAMES = {
+    hubeny: 'hubeny',
+    _hubeny: 'hubeny',
+    vincenty: 'vincenty',
+    _meter_vincenty: 'vincenty',
+}
+
+
+def _metric_name(distfunc):
+    if distfunc in _METRIC_NAMES:
+        return _METRIC_NAMES[distfunc]
+    return '{}.{}'.format(getattr(distfunc, '__module__', ''), getattr(distfunc, '__qualname__', repr(distfunc)))
+
+def _area_points(area_coord_data, area_ids):
+    '''エリアの座標 (lon, lat) を、距離関数に渡す (lat, lon) の配列にする'''
+    points = np.array([area_coord_data.get_point(a) for a in area_ids], dtype=np.float64).reshape(-1, 2)
+    return points[:, ::-1]
 
 def build_area_distance_func(area_coord_data, distfunc=_meter_vincenty):
     '''Build a cached distance function between area_ids.
@@ -42,17 +83,144 @@ def build_area_distance_func(area_coord_data, distfunc=_meter_vincenty):
     Args:
         area_coord_data: snlocest.areadata.AreaCoordinateData
         distfunc: Callable[[Tuple[float, float], Tuple[float, float]], float] (optional)
+            (lat, lon) の2点の距離を返す関数
     Returns:
         A distance function between area_ids
     '''
     @lru_cache(maxsize=CACHE_SIZE)
     def distance(a1, a2):
         '''エリアa1とa2のあいだの地理的な距離を返す'''
-        p1 = area_coord_data.get_point(a1)
-        p2 = area_coord_data.get_point(a2)
-        return distfunc(p1, p2)
+        lon1, lat1 = area_coord_data.get_point(a1)
+        lon2, lat2 = area_coord_data.get_point(a2)
+        return distfunc((lat1, lon1), (lat2, lon2))
     distance.areadata = area_coord_data
     distance.distfunc = distfunc
     return distance
 
+
+class AreaDistanceMatrix():
+    '''エリア間の距離行列
+
+    すべてのエリアの組の距離をfloat32の行列で持ち、
+    build_area_distance_func()が返す関数と同じように distance(a1, a2) で呼び出せる。
+    area_id -> 行番号 の対応は配列で引くので、距離は定数時間で求まる。
+    '''
+
+    def __init__(self, area_ids, matrix, areadata=None, distfunc=None):
+        self.area_ids = np.asarray(area_ids, dtype=np.int64)
+        # np.memmapのままだと要素アクセスが遅いので、ndarrayとして参照する
+        self.matrix = np.asarray(matrix)
+        self.areadata = areadata
+        self.distfunc = distfunc
+        # area_id -> 行番号（area_idは高々5桁なので、area_idをindexとした配列にする）
+        rows = np.full(self.area_ids.max() + 1 if len(self.area_ids) else 0, -1, dtype=np.int64)
+        rows[self.area_ids] = np.arange(len(self.area_ids))
+        self._rows = rows
+        self._row_list = rows.tolist()
+
+    def __call__(self, a1, a2):
+        '''エリアa1とa2のあいだの地理的な距離を返す'''
+        n = len(self._row_list)
+        # 負のindexはリストの後ろから引かれてしまうので、範囲を調べてから引く
+        if not (0 <= a1 < n and 0 <= a2 < n):
+            raise KeyError((a1, a2))
+        r1 = self._row_list[a1]
+        r2 = self._row_list[a2]
+        if r1 < 0 or r2 < 0:
+            raise KeyError((a1, a2))
+        return self.matrix.item(r1, r2)
+
+    def rows(self, area_ids):
+        '''area_idの配列を距離行列の行番号の配列にする'''
+        return self._rows[np.asarray(area_ids, dtype=np.int64)]
+
+    @classmethod
+    def compute(cls, area_coord_data, distfunc=_meter_vincenty):
+        '''area_coord_dataのすべてのエリアの組について距離を計算する
+
+        distfuncにベクトル化版があれば（hubeny, vincenty）、行列をまとめて計算する。
+        '''
+        area_ids = list(area_coord_data)
+        points = _area_points(area_coord_data, area_ids)
+        n = len(area_ids)
+        if distfunc in _PAIRWISE_FUNCS:
+            matrix = _PAIRWISE_FUNCS[distfunc](points, points).astype(np.float32)
+        else:
+            points = [tuple(p) for p in points.tolist()]
+            matrix = np.zeros((n, n), dtype=np.float32)
+            for i in range(n):
+                for j in range(i + 1, n):
+                    matrix[i, j] = matrix[j, i] = distfunc(points[i], points[j])
+        return cls(area_ids, matrix, areadata=area_coord_data, distfunc=distfunc)
+
+    @staticmethod
+    def _ids_path(path):
+        return os.path.splitext(path)[0] + '.ids.npy'
+
+    @staticmethod
+    def _signature_path(path):
+        return os.path.splitext(path)[0] + '.signature.json'
+
+    @staticmethod
+    def signature(area_coord_data, distfunc):
+        '''距離の種類とエリアの座標から、距離行列のシグネチャを作る
+
+        pointsは距離関数に渡す座標の順序。座標を (lon, lat) のまま渡していたときの距離行列は使わない。
+        '''
+        area_ids = list(area_coord_data)
+        points = _area_points(area_coord_data, area_ids)
+        h = hashlib.sha1(np.asarray(area_ids, dtype=np.int64).tobytes())
+        h.update(np.ascontiguousarray(points).tobytes())
+        return {'distfunc': _metric_name(distfunc), 'points': 'lat,lon', 'coordinates': h.hexdigest()}
+
+    def save(self, path):
+        '''距離行列をpath (.npy)に、area_idのリストを[path].ids.npyに、
+        シグネチャ (areadataとdistfuncがあれば) を[path].signature.jsonに保存する'''
+        np.save(path, self.matrix)
+        np.save(self._ids_path(path), self.area_ids)
+        if self.areadata is not None and self.distfunc is not None:
+            with open(self._signature_path(path), 'w') as fp:
+                json.dump(self.signature(self.areadata, self.distfunc), fp)
+
+    @classmethod
+    def load_signature(cls, path):
+        '''save()で保存したシグネチャを返す。なければNone'''
+        try:
+            with open(cls._signature_path(path)) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def load(cls, path, mmap=True, areadata=None, distfunc=None):
+        '''save()で保存した距離行列を読み込む。mmap=Trueならメモリマップする'''
+        matrix = np.load(path, mmap_mode='r' if mmap else None)
+        area_ids = np.load(cls._ids_path(path))
+        return cls(area_ids, matrix, areadata=areadata, distfunc=distfunc)
+
+
+def build_area_distance_matrix(area_coord_data, path=None, distfunc=_meter_vincenty):
+    '''Build a distance function between area_ids backed by a precomputed distance matrix.
+
+    build_area_distance_func()と同じように呼び出せる、エリア間の距離行列を返す。
+    pathに保存された距離行列があり、エリアとその座標、距離の種類 (distfunc) が一致すればメモリマップして使う。
+    なければすべてのエリアの組の距離を計算して、pathが与えられていれば保存する。
+
+    Args:
+        area_coord_data: snlocest.areadata.AreaCoordinateData
+        path: str (optional) 距離行列を保存する.npyファイルのパス
+        distfunc: Callable[[Tuple[float, float], Tuple[float, float]], float] (optional)
+    Returns:
+        AreaDistanceMatrix
+    '''
+    if path is not None and os.path.exists(path):
+        if AreaDistanceMatrix.load_signature(path) == AreaDistanceMatrix.signature(area_coord_data, distfunc):
+            distance = AreaDistanceMatrix.load(path, areadata=area_coord_data, distfunc=distfunc)
+            if np.array_equal(distance.area_ids, list(area_coord_data)):
+                return distance
+    distance = AreaDistanceMatrix.compute(area_coord_data, distfunc)
+    if path is not None:
+        distance.save(path)
+    return distance
+
 distance = vincenty
@@ -3,8 +3,11 @@
 '''
 ここのGraphはedgelistをstr, strとして読み込めるように作られている
 int, intだとしたら、もっとコンパクトになる
+（ノードIDが数値ならInt64CSRGraphでint64のまま読み込める）
 '''
 
+import os
+import os.path
 import csv
 import numpy as np
 from abc import ABCMeta, abstractmethod
@@ -17,12 +20,25 @@ from snlocest.largedict import LargeDict
 def load_dsv_by_pandas(filepath, delimiter, dtype):
     import pandas as pd
     df = pd.read_csv(filepath, sep=delimiter, dtype=dtype, header=None)
-    return df.as_matrix()
+    return df.values
 
 def load_dsv_by_numpy(filepath, delimiter, dtype):
     a = np.genfromtxt(filepath, dtype=dtype, delimiter=delimiter)
     return a
 
+def factorize_nodes(a):
+    '''ノードIDの配列を (各要素のindex, ソート済みのユニークなID) に変換する
+
+    np.uniqueは文字列の比較ソートになり遅いので、pandasがあればハッシュで番号を振る
+    '''
+    try:
+        import pandas as pd
+    except ImportError:
+        nodes, inverse = np.unique(a, return_inverse=True)
+        return inverse, nodes
+    inverse, nodes = pd.factorize(a, sort=True)
+    return inverse, np.asarray(nodes)
+
 def load_dsv(filepath, delimiter='\t', dtype=np.int64):
     try:
         import pandas as pd
@@ -68,6 +84,154 @@ def load_adj_matrix(edgefile, delimiter='\t', numbers=False):
     return coo, nodes, node_to_idx
 
 
+def load_int_adj_matrix(edgefile, delimiter='\t'):
+    '''Load adjacency matrix from edge list of integer node ids
+
+    TwitterのユーザIDのような数値のノードIDをint64のまま読み込む。
+    ノードIDの表はnp.uniqueで作るので、ノードごとのPythonのオブジェクトを作らない。
+
+    Args:
+        edgefile: file path to edge list (DSV format)
+        delimiter (optional): delimiter of edge list
+    Returns:
+        Adjacency matrix (scipy coo_matrix), Sorted array of node ids (int64)
+    '''
+    arr = load_dsv(edgefile, delimiter=delimiter, dtype=np.int64)
+    nodes, inverse = np.unique(arr[:, :2].ravel(), return_inverse=True)
+    V = len(nodes)
+    if V < np.iinfo(np.int32).max:
+        inverse = inverse.astype(np.int32)
+    inverse = inverse.reshape(-1, 2)
+    row = inverse[:, 0]
+    col = inverse[:, 1]
+    # 重複したエッジは足されるので、int8ではあふれることがある (load_adj_matrixと同じく、あふれない幅にする)
+    data = np.ones(len(row), dtype=np.int32)
+    coo = coo_matrix((data, (row, col)), shape=(V, V), copy=False)
+    return coo, nodes
+
+
+# save_csr_arrays()で保存する配列のファイル名
+CSR_ARRAYS = ['indptr', 'indices', 'data', 'nodes', 'labeled_nodes', 'labels']
+
+
+def _compact_index(a):
+    '''int32に収まるindexの配列はint32にする
+
+    scipyはint32に収まるindexをint32に変換するので、
+    int64のまま保存するとメモリマップした配列がコピーされてしまう。
+    '''
+    a = np.asarray(a)
+    if len(a) == 0 or a.max() < np.iinfo(np.int32).max:
+        return a.astype(np.int32, copy=False)
+    return a
+
+
+def save_csr_arrays(path, indptr, indices, data, nodes, labeled_nodes=None, labels=None):
+    '''CSRの配列とノードIDの表を、ディレクトリpath以下に.npyファイルとして保存する
+
+    Args:
+        path: 保存先のディレクトリ
+        indptr, indices, data: CSRの配列
+        nodes: index -> ノードID の表
+        labeled_nodes (optional): ラベル付きノードのノードID
+        labels (optional): labeled_nodesに対応するラベル
+    '''
+    os.makedirs(path, exist_ok=True)
+    arrays = {
+        'indptr': _compact_index(indptr),
+        'indices': _compact_index(indices),
+        'data': np.asarray(data),
+        'nodes': np.asarray(nodes),
+    }
+    if labeled_nodes is not None and labels is not None:
+        arrays['labeled_nodes'] = np.asarray(labeled_nodes)
+        arrays['labels'] = np.asarray(labels)
+    for name, a in arrays.items():
+        np.save(os.path.join(path, name + '.npy'), a)
+
+
+def load_csr_arrays(path, mmap=True):
+    '''save_csr_arrays()で保存した配列を読み込む
+
+    Args:
+        path: 保存したディレクトリ
+        mmap (optional): Trueならメモリマップする
+    Returns:
+        配列名 -> 配列 のdict（ラベルが保存されていなければlabeled_nodes, labelsは含まない）
+    '''
+    mmap_mode = 'r' if mmap else None
+    arrays = {}
+    for name in CSR_ARRAYS:
+        filepath = os.path.join(path, name + '.npy')
+        if os.path.exists(filepath):
+            arrays[name] = np.load(filepath, mmap_mode=mmap_mode)
+    return arrays
+
+
+def gather_rows(indptr, indices, rows):
+    '''CSRの複数の行の列indexをまとめて取り出す
+
+    Pythonのループを使わずに、rowsの各行のindices[indptr[r]:indptr[r+1]]を連結する。
+
+    Args:
+        indptr: CSRのindptr
+        indices: CSRのindices
+        rows: 取り出す行indexの配列
+    Returns:
+        (flat, offsets) のタプル。
+        rows[k]行目の列indexは flat[offsets[k]:offsets[k+1]] になる。
+    '''
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = indptr[rows]
+    counts = indptr[rows + 1] - starts
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    # flatのi番目の要素は、k = 行番号として indices[starts[k] + (i - offsets[k])]
+    pos = np.arange(offsets[-1], dtype=np.int64) - np.repeat(offsets[:-1] - starts, counts)
+    return indices[pos], offsets
+
+
+# follow_networks()で作るネットワークの種類
+FOLLOW_NETWORKS = ['mutual', 'linked', 'follower', 'followee']
+
+
+def follow_networks(adj, nodes):
+    '''フォローのエッジ (followee) の隣接行列Aから、4種類のネットワークをまとめて作る
+
+    mutual: A ∧ Aᵀ, linked: A ∨ Aᵀ, follower: Aᵀ, followee: A
+    重複したエッジは1本にし、各ネットワークはエッジのあるノードだけの表にする
+    (それぞれのエッジリストをload_int_adj_matrix()で読み込んだものと同じになる)。
+
+    Args:
+        adj: 隣接行列 (scipy sparse matrix)
+        nodes: index -> ノードID の表 (ソート済み)
+    Returns:
+        ネットワークの種類 -> (CSRの隣接行列, ノードIDの配列) のdict
+    '''
+    a = csr_matrix(adj, dtype=np.int32, copy=True)
+    a.sum_duplicates()
+    a.data[:] = 1
+    at = a.T.tocsr()
+    linked = a + at
+    linked.data[:] = 1
+    networks = {'mutual': a.multiply(at), 'linked': linked, 'follower': at, 'followee': a}
+    nodes = np.asarray(nodes)
+    result = {}
+    for name, m in networks.items():
+        m = csr_matrix(m, dtype=np.int32)
+        m.eliminate_zeros()
+        used = (np.diff(m.indptr) > 0) | (np.bincount(m.indices, minlength=m.shape[1]) > 0)
+        if not used.all():
+            idx = np.flatnonzero(used)
+            m = m[idx][:, idx]
+            m = csr_matrix(m)
+        else:
+            idx = slice(None)
+        m.sort_indices()
+        result[name] = (m, nodes[idx])
+    return result
+
+
 class Graph(metaclass=ABCMeta):
     @property
     @abstractmethod
@@ -147,7 +311,7 @@ class CSRGraph(Graph, SparseMatrixLike):
     '''Compressed Sparse Row Matrixでグラフを保存しているクラス
 
     pros: pandasのおかげで読み込みが早い
-    cons: neighborsが遅い 50us
+    cons: neighborsが遅い 2us（indexのままでよければneighbor_indices, neighbors_manyを使う）
     '''
 
     def __init__(self):
@@ -162,15 +326,31 @@ class CSRGraph(Graph, SparseMatrixLike):
 
     def _update_table(self):
         '''self._nodesとself._labeled_nodesをもとに、
-        self._nodesをすべてのノードを含むよう更新し、新しいself._node_to_idxを作る'''
-        set_nodes = set(self._nodes)
-        self._nodes.extend(n for n in self._labeled_nodes if n not in set_nodes)
-        self._node_to_idx = dict(zip(self._nodes, range(len(self._nodes))))
+        self._nodesをすべてのノードを含むよう更新し、self._node_to_idxを作る
 
-        n_nodes = self.num_nodes
-        a = self._adjmat.tocoo()
-        self._adjmat = csr_matrix((a.data, (a.row, a.col)), shape=(n_nodes, n_nodes), copy=False)
-        #self._adjmat = csr_matrix((a.data, a.indices, a.indptr), shape=(n_nodes, n_nodes), copy=False)
+        新しいノードは隣接ノードのないノードとして末尾に追加する。
+        open()でメモリマップした配列をコピーしないよう、新しいノードがなければ何もせず、
+        あってもindptrを伸ばすだけにする。
+        '''
+        if len(self._node_to_idx) != len(self._nodes):
+            # nodesがセットされたので作り直す
+            self._node_to_idx = dict(zip(self._nodes, range(len(self._nodes))))
+        new_nodes = [n for n in dict.fromkeys(self._labeled_nodes) if n not in self._node_to_idx]
+        if new_nodes:
+            V = len(self._nodes)
+            self._nodes.extend(new_nodes)
+            self._node_to_idx.update(zip(new_nodes, range(V, V + len(new_nodes))))
+
+        n_nodes = len(self._nodes)
+        a = self._adjmat
+        if a.shape == (n_nodes, n_nodes):
+            return
+        if a.shape[0] <= n_nodes and a.shape[1] <= n_nodes:
+            indptr = np.concatenate([a.indptr, np.repeat(a.indptr[-1], n_nodes - a.shape[0])])
+            self._adjmat = csr_matrix((a.data, a.indices, indptr), shape=(n_nodes, n_nodes), copy=False)
+        else:
+            a = a.tocoo()
+            self._adjmat = csr_matrix((a.data, (a.row, a.col)), shape=(n_nodes, n_nodes), copy=False)
 
     def load_edgelist(self, filename, delimiter='\t'):
         adj, nodes, node_to_idx = load_adj_matrix(filename, delimiter=delimiter)
@@ -219,6 +399,7 @@ class CSRGraph(Graph, SparseMatrixLike):
     @nodes.setter
     def nodes(self, value):
         self._nodes = value
+        self._node_to_idx = {}
         # self._node_to_idxは_nodesと_labeled_nodesがセットされたときに更新する
         self._update_table()
 
@@ -228,15 +409,30 @@ class CSRGraph(Graph, SparseMatrixLike):
 
     def neighbors(self, n):
         '''Return a list of the neighbors of node n'''
+        nodes = self._nodes
+        return [nodes[i] for i in self.neighbor_indices(n).tolist()]
+
+    def neighbor_indices(self, n):
+        '''ノードnの隣接ノードのindexの配列を返す
+
+        indicesのviewを返すのでコピーしない。
+        '''
         try:
-            i = self._node_to_idx[n]
-        except ValueError:
-            if i < self.num_nodes:
-                return []
+            i = self.to_nodeidx(n)
+        except KeyError:
             raise IndexError("node [%s] is not in this graph" % n)
-        neighbors = self.getrow(i)
-        #return self.vto_nodename(neighbors)
-        return [self.to_nodename(n) for n in neighbors]
+        return self.getrow(i)
+
+    def neighbors_many(self, rows):
+        '''複数のノードの隣接ノードのindexをまとめて返す
+
+        Args:
+            rows: ノードのindexの配列
+        Returns:
+            (flat, offsets) のタプル。
+            rows[k]の隣接ノードのindexは flat[offsets[k]:offsets[k+1]] になる。
+        '''
+        return gather_rows(self._adjmat.indptr, self._adjmat.indices, rows)
 
     def getrow(self, i):
         '''node_idではなくindexを受け取り、indexのまま返す
@@ -253,6 +449,242 @@ class CSRGraph(Graph, SparseMatrixLike):
     def shape(self):
         return self._adjmat.shape
 
+    def save(self, path):
+        '''グラフをディレクトリpath以下に.npyファイルとして保存する
+
+        CSRGraph.open(path)で読み込める。
+        '''
+        save_csr_arrays(path, self._adjmat.indptr, self._adjmat.indices, self._adjmat.data,
+                        self._nodes, self._labeled_nodes, self._labels)
+        return self
+
+    @classmethod
+    def open(cls, path, mmap=True):
+        '''save()で保存したグラフを読み込む
+
+        ノードIDがint64で保存されていればInt64CSRGraphを返す。
+        mmap=Trueなら配列をメモリマップするので、読み込みが一瞬で終わり、
+        同じグラフを開いた複数のプロセスがページキャッシュを共有できる。
+        '''
+        arrays = load_csr_arrays(path, mmap=mmap)
+        nodes = arrays['nodes']
+        Graph = Int64CSRGraph if nodes.dtype.kind in 'iu' else CSRGraph
+        graph = Graph()
+        V = len(nodes)
+        graph._adjmat = csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                   shape=(V, V), copy=False)
+        graph._set_tables(nodes, arrays.get('labeled_nodes'), arrays.get('labels'))
+        return graph
+
+    def _set_tables(self, nodes, labeled_nodes, labels):
+        '''open()で読み込んだノードIDの表とラベルをセットする'''
+        self._nodes = nodes.tolist()
+        self._node_to_idx = dict(zip(self._nodes, range(len(self._nodes))))
+        if labeled_nodes is not None:
+            self._labeled_nodes = labeled_nodes
+            self._labels = labels
+
+    @property
+    def indptr(self):
+        '''CSRのindptr (長さ |V| + 1)'''
+        return self._adjmat.indptr
+
+    @property
+    def indices(self):
+        '''CSRのindices (長さ |E|)'''
+        return self._adjmat.indices
+
+
+class Int64CSRGraph(CSRGraph):
+    '''ノードIDをint64として扱うCSRGraph
+
+    ノードIDの表はソート済みのint64の配列なので、
+    to_nodenameは配列の参照、to_nodeidxはsearchsortedで引く。
+    pros: 読み込みが早く、ノードIDの表がコンパクト
+    cons: ノードIDが数値でなければ使えない
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self._nodes = np.array([], dtype=np.int64)
+        self._labeled_nodes = np.array([], dtype=np.int64)
+
+    def _update_table(self):
+        '''self._nodesとself._labeled_nodesをもとに、
+        self._nodesをすべてのノードを含むソート済みの配列に更新し、隣接行列のindexを付け替える'''
+        nodes = np.union1d(self._nodes, self._labeled_nodes)
+        n_nodes = len(nodes)
+        if n_nodes == len(self._nodes) and self._adjmat.shape == (n_nodes, n_nodes):
+            return
+        a = self._adjmat
+        # 元のノードIDの表もソート済みなので、付け替えてもindexの順序は変わらない
+        remap = np.searchsorted(nodes, self._nodes)
+        if a.shape != (len(self._nodes), len(self._nodes)):
+            a = a.tocoo()
+            self._adjmat = csr_matrix((a.data, (remap[a.row], remap[a.col])), shape=(n_nodes, n_nodes))
+        else:
+            # 新しいノードは隣接ノードのない行として差し込む
+            counts = np.zeros(n_nodes, dtype=a.indptr.dtype)
+            counts[remap] = np.diff(a.indptr)
+            indptr = np.zeros(n_nodes + 1, dtype=a.indptr.dtype)
+            np.cumsum(counts, out=indptr[1:])
+            if len(remap) == 0 or remap[-1] == len(remap) - 1:
+                # 新しいノードがすべて末尾なら、indicesはメモリマップしたまま使う
+                indices = a.indices
+            else:
+                indices = remap[a.indices].astype(a.indices.dtype)
+            self._adjmat = csr_matrix((a.data, indices, indptr), shape=(n_nodes, n_nodes), copy=False)
+        self._nodes = nodes
+
+    def load_edgelist(self, filename, delimiter='\t'):
+        adj, nodes = load_int_adj_matrix(filename, delimiter=delimiter)
+        self._adjmat = adj.tocsr()
+        self.nodes = nodes
+        return self
+
+    @classmethod
+    def from_csr(cls, adj, nodes):
+        '''隣接行列とソート済みのノードIDの表からグラフを作る'''
+        graph = cls()
+        graph._adjmat = csr_matrix(adj)
+        graph.nodes = np.asarray(nodes, dtype=np.int64)
+        return graph
+
+    def load_labellist(self, filename, delimiter='\t'):
+        labeled_nodes, labels = load_labellist(filename)
+        self._labels = labels
+        self.labeled_nodes = labeled_nodes.astype(np.int64)
+        return self
+
+    def _set_tables(self, nodes, labeled_nodes, labels):
+        # ノードIDの表もメモリマップしたまま使う
+        self._nodes = nodes
+        if labeled_nodes is not None:
+            self._labeled_nodes = labeled_nodes
+            self._labels = labels
+
+    def to_nodeidx(self, a):
+        return int(self.vto_nodeidx([a])[0])
+
+    def to_nodename(self, a):
+        return self._nodes[a]
+
+    def vto_nodeidx(self, x):
+        x = np.asarray(x).astype(np.int64)
+        idx = np.searchsorted(self._nodes, x)
+        found = idx < len(self._nodes)
+        found[found] = self._nodes[idx[found]] == x[found]
+        if not np.all(found):
+            raise KeyError(x[~found][0])
+        return idx
+
+    def vto_nodename(self, x):
+        return self._nodes[np.asarray(x, dtype=np.int64)]
+
+    @property
+    def num_nodes(self):
+        return len(self._nodes)
+
+    def neighbors(self, n):
+        '''Return an array of the neighbors of node n'''
+        return self._nodes[self.neighbor_indices(n)]
+
+
+class ArrayCSRGraph(SparseMatrixLike):
+    '''隣接ノードのindexをint32のCSRの配列で保存しているクラス
+
+    SpMatLikeDOLGraphと同じSparseMatrixLikeのインタフェースで使える。
+    CSRの配列は読み込み時に一度だけ作り、ラベル付きノードが増えても作り直さない
+    （グラフにないラベル付きノードは、隣接ノードのない末尾のノードとして追加する）。
+    pros: getrowがindicesのスライスを返すだけなので早い。読み込みも早い
+    cons: ノードIDからindexへの変換にdictを使う
+    '''
+
+    def __init__(self):
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._indices = np.array([], dtype=np.int32)
+        self._nodes = np.array([], dtype=str) # translation table of index to node
+        self._node_to_idx = {} # translation table of node to index
+        self._labeled_nodes = []
+        self._labels = []
+
+    def load_edgelist(self, filename, delimiter='\t'):
+        arr = load_dsv(filename, delimiter=delimiter, dtype=str)
+        inverse, nodes = factorize_nodes(arr[:, :2].ravel())
+        inverse = inverse.reshape(-1, 2)
+        V = len(nodes)
+        # DictOfListGraphと同じく、隣接ノードはファイルに出てきた順に並べる
+        order = np.argsort(inverse[:, 0], kind='mergesort')
+        self._indices = inverse[order, 1].astype(np.int32)
+        self._indptr = np.zeros(V + 1, dtype=np.int64)
+        np.cumsum(np.bincount(inverse[:, 0], minlength=V), out=self._indptr[1:])
+        self._nodes = nodes.astype(str)
+        self._node_to_idx = dict(zip(self._nodes.tolist(), range(V)))
+        self._add_nodes(self._labeled_nodes)
+        return self
+
+    def load_labellist(self, filename, delimiter='\t'):
+        labeled_nodes, labels = load_labellist(filename)
+        self._labeled_nodes = labeled_nodes
+        self._labels = labels
+        self._add_nodes(labeled_nodes)
+        return self
+
+    def _add_nodes(self, nodes):
+        '''グラフにないノードを、隣接ノードのないノードとして末尾に追加する'''
+        new_nodes = [n for n in dict.fromkeys(nodes) if n not in self._node_to_idx]
+        if not new_nodes:
+            return
+        V = len(self._nodes)
+        self._node_to_idx.update(zip(new_nodes, range(V, V + len(new_nodes))))
+        self._nodes = np.concatenate([self._nodes, np.array(new_nodes, dtype=str)])
+        self._indptr = np.concatenate([self._indptr, np.repeat(self._indptr[-1], len(new_nodes))])
+
+    def to_nodeidx(self, a):
+        return self._node_to_idx[a]
+
+    def to_nodename(self, a):
+        return self._nodes[a]
+
+    def vto_nodeidx(self, x):
+        return [self._node_to_idx[a] for a in x]
+
+    def vto_nodename(self, x):
+        return self._nodes[np.asarray(x, dtype=np.int64)]
+
+    def getrow(self, i):
+        '''indexを受け取り、隣接ノードのindexの配列(indicesのview)を返す'''
+        return self._indices[self._indptr[i]:self._indptr[i+1]]
+
+    def neighbors_many(self, rows):
+        '''複数のノードの隣接ノードのindexをまとめて返す (flat, offsets)'''
+        return gather_rows(self._indptr, self._indices, rows)
+
+    @property
+    def shape(self):
+        V = len(self._nodes)
+        return (V, V)
+
+    @property
+    def nodes(self):
+        return self._nodes
+
+    @property
+    def num_nodes(self):
+        return len(self._nodes)
+
+    @property
+    def num_edges(self):
+        return len(self._indices)
+
+    @property
+    def labeled_nodes(self):
+        return self._labeled_nodes
+
+    @property
+    def labels(self):
+        return self._labels
+
 
 class DictOfListGraph(Graph):
     '''Dict of list でグラフを保存しているクラス
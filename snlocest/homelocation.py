@@ -0,0 +1,161 @@
+# coding: utf-8
+
+'''
+ユーザごとのエリアIDの出現数から、多数決で居住地を決める
+
+ユーザごとに、最もツイート数が多いエリア (area_id)、そのツイート数 (count)、総ツイート数 (total) を求める。
+最多のエリアが複数あるときは、エリアIDが最小のものを選ぶ。
+
+入力の読み方によって3つの方法がある。
+    majority_frame: pandasのDataFrameでまとめて求める (入力がメモリにのること)
+    iter_majority_sorted: ユーザごとにまとまった (ソートされた) 行を順に読み、ユーザごとに求める (メモリは一定)
+    majority_chunked: 行をchunkごとに読み、chunkごとの途中結果をまとめる (ソートされていなくてよい。メモリはユーザ数に比例)
+'''
+
+import numpy as np
+
+
+def majority_frame(df):
+    '''user_id, count, area_id の列のあるDataFrameから、user_idをindexとしてarea_id, count, totalの列のあるDataFrameを返す'''
+    # 安定ソートで、同じツイート数ならエリアIDの小さいほうが後 (keep='last'で残る) になるようにする
+    sorted = df.sort_values(by=['count', 'area_id'], ascending=[True, False], kind='mergesort')
+    result = sorted.drop_duplicates('user_id', keep='last')
+    result = result.set_index('user_id')
+    result['total'] = df.groupby('user_id')['count'].sum()
+    return result
+
+
+def iter_majority_sorted(lines):
+    '''user_id, count, area_id のTSVの行から、(user_id, area_id, count, total) をユーザごとに返す
+
+    同じユーザの行は続いていること (agg_count.pyの出力をソートしたものなど)。
+    user_idとarea_idは入力の文字列のまま返す。
+    '''
+    current = None
+    for line in lines:
+        user_id, count, area_id = line.rstrip('\n').split('\t')
+        count = int(count)
+        if user_id != current:
+            if current is not None:
+                yield current, best_area, best_count, total
+            current, best_area, best_count, total = user_id, area_id, count, 0
+        elif count > best_count or (count == best_count and int(area_id) < int(best_area)):
+            best_area, best_count = area_id, count
+        total += count
+    if current is not None:
+        yield current, best_area, best_count, total
+
+
+def _reduce_majority(users, areas, counts, totals):
+    '''(user_id, area_id, count, total) の配列を、ユーザごとに最多のエリアと総ツイート数の配列にまとめる'''
+    order = np.lexsort((areas, -counts, users))
+    users = users[order]
+    starts = np.flatnonzero(np.r_[len(users) > 0, users[1:] != users[:-1]])
+    return (users[starts], areas[order][starts], counts[order][starts],
+            np.add.reduceat(totals[order], starts) if len(starts) else totals[:0])
+
+
+def majority_chunked(chunks):
+    '''(user_id, area_id, count) の配列の組のイテレータから、ユーザごとの (user_id, area_id, count, total) の配列を返す
+
+    chunkごとにユーザでまとめた途中結果を作り、途中結果がたまったらまとめる。
+    同じ (user_id, area_id) の組は1つのchunkにしかないこと (agg_count.pyの出力など)。
+    Returns:
+        user_idの昇順の (user_id, area_id, count, total) の配列
+    '''
+    empty = np.array([], dtype=np.int64)
+    merged = (empty, empty, empty, empty)
+    partials = []
+    partial_size = 0
+    for users, areas, counts in chunks:
+        users = np.asarray(users, dtype=np.int64)
+        areas = np.asarray(areas, dtype=np.int64)
+        counts = np.asarray(counts, dtype=np.int64)
+        partial = _reduce_majority(users, areas, counts, counts)
+        partials.append(partial)
+        partial_size += len(partial[0])
+        # 途中結果がまとめたものより大きくなったらまとめる
+        if partial_size >= len(merged[0]):
+            merged = _reduce_majority(*[np.concatenate(cols) for cols in zip(merged, *partials)])
+            partials = []
+            partial_size = 0
+    if partials:
+        merged = _reduce_majority(*[np.concatenate(cols) for cols in zip(merged, *partials)])
+    return merged
+
+
+# ユーザごとの居住地の表 (user_id, 最多のエリア, そのツイート数, 総ツイート数)
+HOME_DTYPE = np.dtype([('user_id', '<i8'), ('area_id', '<i4'), ('count', '<i4'), ('total', '<i8')])
+
+
+def home_table(users, areas, counts, totals):
+    '''(user_id, area_id, count, total) の配列からHOME_DTYPEの表を作る'''
+    table = np.empty(len(users), dtype=HOME_DTYPE)
+    table['user_id'] = users
+    table['area_id'] = areas
+    table['count'] = counts
+    table['total'] = totals
+    return table
+
+
+def home_table_sorted(lines, chunksize=1 << 20):
+    '''iter_majority_sorted()の結果を、入力と同じユーザの順のHOME_DTYPEの表にする'''
+    tables = [np.empty(0, dtype=HOME_DTYPE)]
+    rows = []
+    for user_id, area_id, count, total in iter_majority_sorted(lines):
+        rows.append((int(user_id), int(area_id), count, total))
+        if len(rows) >= chunksize:
+            tables.append(np.array(rows, dtype=HOME_DTYPE))
+            rows = []
+    tables.append(np.array(rows, dtype=HOME_DTYPE))
+    return np.concatenate(tables)
+
+
+def save_home_table(path, table):
+    '''HOME_DTYPEの表を.npyの形式で保存する (pathの拡張子は.npyでなくてもよい)'''
+    with open(path, 'wb') as fp:
+        np.save(fp, np.asarray(table, dtype=HOME_DTYPE))
+
+
+def load_home_table(path, mmap=True):
+    return np.load(path, mmap_mode='r' if mmap else None)
+
+
+def threshold_mask(table, min_majoritynum=1, min_totalnum=1):
+    '''最多のエリアのツイート数がmin_majoritynum以上、総ツイート数がmin_totalnum以上のユーザのマスク'''
+    mask = np.ones(len(table), dtype=bool)
+    if min_majoritynum:
+        mask &= table['count'] >= min_majoritynum
+    if min_totalnum:
+        mask &= table['total'] >= min_totalnum
+    return mask
+
+
+def write_home_table(table, outfile, mask=None, blocksize=100000):
+    '''表を user_id, area_id, count, total のTSV (decidehomelocation.pyの出力) で書き出す'''
+    if mask is not None:
+        table = table[mask]
+    for i in range(0, len(table), blocksize):
+        block = table[i:i + blocksize]
+        outfile.write(''.join('{}\t{}\t{}\t{}\n'.format(*row) for row in zip(
+            block['user_id'].tolist(), block['area_id'].tolist(), block['count'].tolist(), block['total'].tolist())))
+
+
+def homelocation_filename(prefix, min_majoritynum, min_totalnum):
+    '''しきい値ごとの居住地のファイル名 (geotweet.SelectMajorityHomeLocationの出力と同じ)'''
+    return '{}_MinMajorityNum-{}_MinTotalNum-{}.tsv'.format(prefix, min_majoritynum, min_totalnum)
+
+
+def materialize_thresholds(table, thresholds, outfiles):
+    '''1つの表から、しきい値 (min_majoritynum, min_totalnum) ごとの居住地をまとめて書き出す
+
+    Args:
+        table: HOME_DTYPEの表
+        thresholds: (min_majoritynum, min_totalnum) のリスト
+        outfiles: thresholdsと同じ順の出力先のファイルオブジェクトのリスト
+    '''
+    # 比較は列ごとに1度だけ行い、組み合わせはマスクの積で作る
+    majority_masks = {m: table['count'] >= m for m, _ in thresholds}
+    total_masks = {t: table['total'] >= t for _, t in thresholds}
+    for (m, t), outfile in zip(thresholds, outfiles):
+        write_home_table(table, outfile, mask=majority_masks[m] & total_masks[t])
@@ -8,6 +8,7 @@ Fig.1 の式を実装した。
 '''
 
 import math
+import numpy as np
 
 A = 6378137.000
 B = 6356752.314245
@@ -52,6 +53,50 @@ def hubeny_distance_radian(lat1, lon1, lat2, lon2):
     tmp2 = (dx * n * math.cos(mu_y)) ** 2
     return math.sqrt(tmp1 + tmp2)
 
+
+def hubeny_distance_array(lat1, lon1, lat2, lon2):
+    '''
+    hubeny_distance_radian()のNumPy版
+    引数の配列をbroadcastして、要素ごとの地球上での距離を計算して返す [m]
+    Args:
+        lat1: 緯度 y1 の配列 [radian]
+        lon1: 経度 x1 の配列 [radian]
+        lat2: 緯度 y2 の配列 [radian]
+        lon2: 経度 x2 の配列 [radian]
+    Returns:
+        距離の配列
+    '''
+    lat1 = np.asarray(lat1, dtype=np.float64)
+    lon1 = np.asarray(lon1, dtype=np.float64)
+    lat2 = np.asarray(lat2, dtype=np.float64)
+    lon2 = np.asarray(lon2, dtype=np.float64)
+    dx = lon1 - lon2
+    dy = lat1 - lat2
+    mu_y = (lat1 + lat2) / 2
+
+    w = np.sqrt(1 - E2 * np.sin(mu_y)**2)
+    m = M_NUR / w**3
+    n = A / w
+
+    tmp1 = (dy * m) ** 2
+    tmp2 = (dx * n * np.cos(mu_y)) ** 2
+    return np.sqrt(tmp1 + tmp2)
+
+
+def hubeny_distance_pairwise(c1, c2):
+    '''
+    2つの座標の集合のすべての組の距離を計算して返す [m]
+    Args:
+        c1: M個の coordinate (lat, lon) の配列 (M x 2) [degree]
+        c2: N個の coordinate (lat, lon) の配列 (N x 2) [degree]
+    Returns:
+        c1[i]とc2[j]の距離を(i, j)要素とする M x N の行列
+    '''
+    c1 = np.radians(np.asarray(c1, dtype=np.float64).reshape(-1, 2))
+    c2 = np.radians(np.asarray(c2, dtype=np.float64).reshape(-1, 2))
+    return hubeny_distance_array(c1[:, 0, np.newaxis], c1[:, 1, np.newaxis],
+                                 c2[np.newaxis, :, 0], c2[np.newaxis, :, 1])
+
 if __name__ == '__main__':
     c1 = (36.10056, 140.09111)
     c2 = (35.65500, 139.74472)
@@ -0,0 +1,162 @@
+# coding: utf-8
+
+'''
+IDのリストでエッジリストなどのTSVの行を絞り込む (scripts/edgefilter.py, scripts/seedfilter.py)
+
+行の1列目 (または2列目) のIDがリストに含まれる行を残す (include)、または含まれない行を残す (exclude)。
+複数の条件をまとめて1度に調べられる (すべての条件を満たす行を残す)。
+
+IDのリストはソートしたint64の配列にしておき、入力はブロックごとに読んで、IDの列をまとめてパースして
+np.searchsortedで調べる。残す行はバイト列のマスクでまとめて書き出す。
+整数としてパースできない行があるブロックは、1行ずつ文字列のまま調べる。
+'''
+
+from collections import namedtuple
+
+import numpy as np
+
+from snlocest.util.parse import parse_int_spans
+
+
+# 条件: ids (IdSet) に column 列目 (0始まり) のIDが含まれる (include=True) / 含まれない (include=False)
+IdFilter = namedtuple('IdFilter', ['ids', 'column', 'include'])
+
+
+class IdSet(object):
+    '''IDの集合。整数のIDはソートした配列で調べる
+
+    Attributes:
+        strings: frozenset of bytes 文字列 (バイト列) のままのID
+        array: np.ndarray ソートしたint64のID。整数 (先頭の0などがない10進数) でないIDがあればNone
+    '''
+
+    def __init__(self, ids):
+        self.strings = frozenset(ids)
+        try:
+            values = [int(i) for i in self.strings]
+        except ValueError:
+            values = None
+        if values is not None and all(str(v).encode() == i for v, i in zip(values, self.strings)) \
+                and all(0 <= v < 1 << 63 for v in values):
+            self.array = np.unique(np.array(values, dtype=np.int64))
+        else:
+            self.array = None
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __contains__(self, id):
+        return id in self.strings
+
+    def contains(self, values):
+        '''int64の配列の各要素が含まれるかのbool配列'''
+        idx = np.searchsorted(self.array, values)
+        return self.array[np.minimum(idx, len(self.array) - 1)] == values if len(self.array) else idx < 0
+
+
+def load_ids(infile):
+    '''1列目がIDのTSV (バイナリのファイル) からIdSetを作る'''
+    return IdSet(line.rstrip(b'\r\n').split(b'\t', 1)[0] for line in infile if line.strip(b'\r\n'))
+
+
+def _column_spans(buf, line_starts, newlines, tabs, column):
+    '''各行のcolumn列目の区間 [starts, ends) を返す。列がない行があればNone
+
+    newlinesは各行の末尾 (改行と、CRLFならその\rを除いた位置)
+    '''
+    first = np.searchsorted(tabs, line_starts)
+    if column == 0:
+        starts = line_starts
+    else:
+        idx = first + column - 1
+        if len(idx) and idx[-1] >= len(tabs):
+            return None
+        starts = tabs[idx] + 1
+        if (starts > newlines).any():
+            return None
+    if len(tabs) == 0:
+        # タブのないブロック (1列だけのIDリストなど) は行末まで
+        return starts, newlines
+    idx = first + column
+    ends = np.where(idx < len(tabs), tabs[np.minimum(idx, len(tabs) - 1)], len(buf))
+    return starts, np.minimum(ends, newlines)
+
+
+def _canonical(buf, starts, ends):
+    '''区間が先頭に0のない数字か (IdSet.arrayと同じく、01 と 1 を区別するため)'''
+    return not ((ends - starts > 1) & (buf[np.minimum(starts, len(buf) - 1)] == ord('0'))).any()
+
+
+def _block_mask(buf, line_starts, newlines, filters):
+    '''各行を残すかのbool配列を返す。まとめてパースできなければNone'''
+    if any(f.ids.array is None for f in filters):
+        return None
+    tabs = np.flatnonzero(buf == ord('\t'))
+    keep = np.ones(len(line_starts), dtype=bool)
+    values = {}
+    for f in filters:
+        if f.column not in values:
+            spans = _column_spans(buf, line_starts, newlines, tabs, f.column)
+            values[f.column] = None if spans is None or not _canonical(buf, *spans) else parse_int_spans(buf, *spans)
+        if values[f.column] is None:
+            return None
+        found = f.ids.contains(values[f.column])
+        keep &= found if f.include else ~found
+    return keep
+
+
+def _line_matches(line, filters):
+    '''改行を除いた1行がfiltersの条件をすべて満たすか'''
+    cols = line.split(b'\t')
+    for f in filters:
+        id = cols[f.column] if f.column < len(cols) else None
+        if (id in f.ids) != f.include:
+            return False
+    return True
+
+
+def filter_lines(infile, outfile, filters, blocksize=1 << 24):
+    '''バイナリのファイルinfileの行のうち、filtersの条件をすべて満たす行をoutfileに書き出す
+
+    Args:
+        infile, outfile: バイナリのファイル
+        filters: IdFilterのリスト
+    Returns:
+        (入力の行数, 出力の行数)
+    '''
+    n_in = n_out = 0
+    rest = b''
+    while True:
+        block = infile.read(blocksize)
+        if not block:
+            if not rest:
+                break
+            block = b'\n'
+        data = rest + block
+        end = data.rfind(b'\n') + 1
+        data, rest = data[:end], data[end:]
+        if not data:
+            continue
+        buf = np.frombuffer(data, dtype=np.uint8)
+        newlines = np.flatnonzero(buf == ord('\n'))
+        line_starts = np.r_[0, newlines[:-1] + 1]
+        # CRLFの行は\rを除いて調べ、1行ずつ調べるときと同じく\rを除いて書き出す
+        crlf = (newlines > line_starts) & (buf[newlines - 1] == ord('\r'))
+        line_ends = newlines - crlf
+        keep = _block_mask(buf, line_starts, line_ends, filters)
+        if keep is None:
+            # 数字以外のIDがあるなど、まとめてパースできないブロックは1行ずつ調べる
+            lines = [line.rstrip(b'\r') for line in data.split(b'\n') if line.strip(b'\r')]
+            kept = [line + b'\n' for line in lines if _line_matches(line, filters)]
+            outfile.write(b''.join(kept))
+            n_in += len(lines)
+            n_out += len(kept)
+            continue
+        # 空行は出力しない
+        keep &= line_ends > line_starts
+        mask = np.repeat(keep, newlines - line_starts + 1)
+        mask[newlines[crlf] - 1] = False
+        outfile.write(buf[mask].tobytes())
+        n_in += int((line_ends > line_starts).sum())
+        n_out += int(keep.sum())
+    return n_in, n_out
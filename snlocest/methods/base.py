@@ -1,7 +1,8 @@
 # coding: utf-8
 
+import multiprocessing
 from abc import ABCMeta, abstractmethod
-from collections import Counter
+from collections import Counter, namedtuple
 from typing import List, Any, Tuple
 import numpy as np
 
@@ -20,6 +21,19 @@ handler.setFormatter(
 logger.addHandler(handler)
 
 
+# ラベルの配列でラベルなしをあらわす値
+# select()はエリアID 0 を推定できなかったことをあらわす値として扱うので、0を使う
+UNLABELED = 0
+
+# 推定対象ノードの隣接ノードの情報をまとめたもの
+#   degree: 各ノードの次数
+#   label_degree: 各ノードのラベル付きの隣接ノード数
+#   neighbors: 隣接ノードのノードIDを連結した配列
+#   labels: 隣接ノードのラベルを連結した配列（ラベルなしはUNLABELED）
+#   offsets: k番目のノードの隣接ノードは neighbors[offsets[k]:offsets[k+1]]
+Neighborhood = namedtuple('Neighborhood', ['degree', 'label_degree', 'neighbors', 'labels', 'offsets'])
+
+
 class Labels(metaclass=ABCMeta):
     '''reference typing用クラス
     '''
@@ -71,8 +85,57 @@ class NetworkBasedMethod(BaseEstimator, ClassifierMixin, metaclass=ABCMeta):
         self._labels = labels
         logger.info('train with %d labels', len(self._labels))
         self._area_prob = Counter(y) # 変数名に反して、確率ではなく出現回数。出現回数の総数で割ると確率になる。
+
+        if self._can_batch():
+            # 隣接ノードをまとめて引けるネットワークなら、長さ|V|のラベルの配列も作っておく
+            self._label_array = np.full(self.network.shape[0], UNLABELED, dtype=np.int64)
+            self._label_array[np.asarray(x, dtype=np.int64)] = y
         return self
 
+    def predict_heldout(self, x, n_jobs=1):
+        '''fit()したラベルのうち、xのノードのラベルを除いて（ラベルなしにして）xを推定する
+
+        K分割交差検証で、すべてのラベルで1回だけfit()して、各分割のテストデータを推定するのに使う。
+        エリア出現回数は作り直さずに、除いたラベルの分だけ差分で更新する (_update_area_counts)。
+        推定が終わったらラベルを元に戻す。
+        Args:
+            x: Iterable[int] Node set to estimate
+            n_jobs: int 並列数 (NeighborsBasedMethod.predict)
+        Returns:
+            List[int] Array of area_id
+        '''
+        heldout = [(u, self._labels.pop(u)) for u in x if u in self._labels]
+        delta = Counter()
+        for _, l in heldout:
+            delta[l] -= 1
+        nodes = np.array([u for u, _ in heldout], dtype=np.int64)
+        self._area_prob.update(delta)
+        if self._can_batch():
+            self._label_array[nodes] = UNLABELED
+        self._update_area_counts(delta)
+        try:
+            if n_jobs != 1:
+                return self.predict(x, n_jobs=n_jobs)
+            return self.predict(x)
+        finally:
+            self._labels.update(heldout)
+            restore = Counter({a: -c for a, c in delta.items()})
+            self._area_prob.update(restore)
+            if self._can_batch():
+                self._label_array[nodes] = [l for _, l in heldout]
+            self._update_area_counts(restore)
+
+    def _update_area_counts(self, delta):
+        '''エリア出現回数 (_area_prob) が delta (area_id -> 増減) だけ変わったときに呼ばれる
+
+        エリア出現回数から事前計算しているものがある手法はこれをオーバーライドする。
+        '''
+        pass
+
+    def _can_batch(self):
+        '''networkから複数のノードの隣接ノードをまとめて引けるかどうか (CSRGraph.neighbors_many)'''
+        return hasattr(self.network, 'neighbors_many')
+
     @abstractmethod
     def predict(self, x):
         raise NotImplementedError()
@@ -109,14 +172,113 @@ class NeighborsBasedMethod(NetworkBasedMethod):
         '''
         raise NotImplementedError()
 
-    def predict(self, x):
+    def select_batch(self, nodes, neighborhood):
+        '''複数のノードについてまとめてselect()をする
+
+        ベクトル化した推定ができる手法はこれをオーバーライドする。
+        デフォルトでは1ノードずつselect()を呼ぶ。
+        Args:
+            nodes: np.ndarray 推定対象のノードIDの配列
+            neighborhood: Neighborhood nodesの隣接ノードの情報
+        Returns:
+            (推定したarea_idのリスト, select()が返したその他の情報のリスト)
+        '''
+        predicted = []
+        results = []
+        labels = neighborhood.labels.tolist()
+        offsets = neighborhood.offsets.tolist()
+        for i, node in enumerate(nodes.tolist()):
+            # ラベルなしはNoneではなくUNLABELED(0)になっているが、select()では同じように扱われる
+            locations = labels[offsets[i]:offsets[i+1]]
+            result = self.select(node, locations)
+            predicted.append(result[0])
+            results.append(result[1:])
+            if i % 10000 == 0:
+                logger.debug('Inferred %s nodes out of %s', i, len(nodes))
+        return predicted, results
+
+    def _neighborhood(self, nodes):
+        '''nodesの隣接ノードの次数、ラベル付きの次数、ラベルをまとめて計算する'''
+        flat, offsets = self.network.neighbors_many(nodes)
+        labels = self._label_array[flat]
+        degree = np.diff(offsets)
+        segments = np.repeat(np.arange(len(nodes)), degree)
+        label_degree = np.bincount(segments, weights=labels != UNLABELED,
+                                   minlength=len(nodes)).astype(np.int64)
+        return Neighborhood(degree, label_degree, flat, labels, offsets)
+
+    def predict(self, x, n_jobs=1):
         '''xに含まれるノードのラベルを推定をする
 
+        networkから隣接ノードをまとめて引けるなら、隣接ノードのラベルをまとめて引いてselect_batch()で推定する。
+        n_jobs > 1 なら、xを分割してプロセスプールで並列に推定する (predict_parallel)。
         Args:
             x: Iterable[int] Node set to estimate
+            n_jobs: int 並列数。-1ならCPU数
         Returns:
             List[int] Array of area_id
         '''
+        if n_jobs != 1:
+            return self.predict_parallel(x, n_jobs=n_jobs)
+        predicted, results = self._predict_nodes(x)
+        # 推定したときに得たその他の情報(推定に使った投票数とか)をクラスに保存する
+        self.results = results
+        return predicted
+
+    def predict_parallel(self, x, n_jobs=-1, chunksize=None):
+        '''xを分割して、forkしたプロセスプールで並列に推定する
+
+        推定器（グラフのCSRの配列やラベルの配列）はfork時に子プロセスへコピーオンライトで共有され、
+        pickleして送るのは分割したノードIDの配列と推定結果だけになる。
+        CSRGraph.open()でメモリマップしたグラフなら、ページキャッシュも共有される。
+        推定結果とresultsはxと同じ順に並べて返す。
+        forkできない環境では1プロセスで推定する。
+        Args:
+            x: Iterable[int] Node set to estimate
+            n_jobs: int プロセス数。-1ならCPU数
+            chunksize: int 1回に推定するノード数 (default: 各プロセスに4回ずつ割り当てる数)
+        Returns:
+            List[int] Array of area_id
+        '''
+        global _parallel_estimator
+        nodes = np.asarray(x, dtype=np.int64)
+        if n_jobs < 0:
+            n_jobs = multiprocessing.cpu_count()
+        try:
+            context = multiprocessing.get_context('fork')
+        except ValueError:
+            context = None
+        if context is None or n_jobs <= 1 or len(nodes) <= 1:
+            return self.predict(nodes)
+
+        if chunksize is None:
+            chunksize = max(1, -(-len(nodes) // (n_jobs * 4)))
+        chunks = [nodes[i:i + chunksize] for i in range(0, len(nodes), chunksize)]
+        logger.debug('Infer %d nodes with %d processes', len(nodes), n_jobs)
+
+        # 子プロセスはfork時のこのグローバル変数から推定器を参照する
+        _parallel_estimator = self
+        try:
+            with context.Pool(n_jobs) as pool:
+                # mapは入力の順に結果を返す
+                chunk_results = pool.map(_predict_chunk, chunks)
+        finally:
+            _parallel_estimator = None
+
+        predicted = []
+        results = []
+        for p, r in chunk_results:
+            predicted.extend(p)
+            results.extend(r)
+        self.results = results
+        return predicted
+
+    def _predict_nodes(self, x):
+        '''xに含まれるノードを推定して、(推定したarea_idのリスト, select()が返したその他の情報のリスト) を返す'''
+        if self._can_batch():
+            nodes = np.asarray(x, dtype=np.int64)
+            return self.select_batch(nodes, self._neighborhood(nodes))
+
         predicted = [] #array('I')
         results = []
 
@@ -131,7 +293,11 @@ class NeighborsBasedMethod(NetworkBasedMethod):
             results.append(result[1:])
             if i % 10000 == 0:
                 logger.debug('Inferred %s nodes out of %s', i, len(x))
+        return predicted, results
 
-        # 推定したときに得たその他の情報(推定に使った投票数とか)をクラスに保存する
-        self.results = results
-        return predicted
+
+# predict_parallel()でforkした子プロセスが使う推定器
+_parallel_estimator = None
+
+def _predict_chunk(nodes):
+    return _parallel_estimator._predict_nodes(nodes)
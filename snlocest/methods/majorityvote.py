@@ -2,7 +2,9 @@
 
 import sys
 from collections import Counter
-from .base import NeighborsBasedMethod
+import numpy as np
+from scipy.sparse import csr_matrix
+from .base import NeighborsBasedMethod, UNLABELED
 
 
 class MajorityVote(NeighborsBasedMethod):
@@ -25,6 +27,137 @@ class MajorityVote(NeighborsBasedMethod):
         self.max_friends = max_friends
         self.min_votes = min_votes
 
+    def fit(self, x, y):
+        super().fit(x, y)
+        if self._can_batch():
+            self._fit_label_matrix(x, y)
+        return self
+
+    def _fit_label_matrix(self, x, y):
+        '''ノードxエリアのone-hotなラベル行列Lを作る
+
+        Lの列はエリアID昇順に並べる。
+        '''
+        self._areas = np.array(sorted(self._area_prob), dtype=np.int64)
+        y = np.asarray(y, dtype=np.int64)
+        cols = np.searchsorted(self._areas, y)
+        V = self.network.shape[0]
+        self._label_matrix = csr_matrix(
+            (np.ones(len(y), dtype=np.int64), (np.asarray(x, dtype=np.int64), cols)),
+            shape=(V, len(self._areas)))
+        self._rank_areas()
+
+    def _rank_areas(self):
+        '''_sort_results()と同じ順（エリア出現回数降順、エリアID昇順）でエリアの順位を付ける
+
+        _area_rank[列番号] はそのエリアの順位。投票数が同じエリアは順位が小さいほうが選ばれる。
+        '''
+        counts = np.array([self._area_prob[a] for a in self._areas.tolist()], dtype=np.int64)
+        order = np.lexsort((self._areas, -counts))
+        self._ranked_areas = self._areas[order]
+        self._area_rank = np.empty(len(order), dtype=np.int64)
+        self._area_rank[order] = np.arange(len(order))
+
+    def _update_area_counts(self, delta):
+        if self._can_batch():
+            self._rank_areas()
+
+    def select_batch(self, nodes, neighborhood):
+        '''隣接行列Aとラベル行列Lの積 A @ L でまとめて多数決をする
+
+        A @ L の各行は隣接ノードの各エリアへの投票数になる。
+        （ラベルなしの隣接ノードは、Lに行があっても（predict_heldout()）Aの値を0にして数えない）
+        投票数 * |エリア数| + (|エリア数| - 1 - エリアの順位) の行ごとの最大値から、
+        select()と同じ順（投票数、エリア出現回数、エリアID）で選んだエリアが求まる。
+        '''
+        n_areas = len(self._ranked_areas)
+        if not n_areas:
+            return super().select_batch(nodes, neighborhood)
+        adj = csr_matrix(
+            ((neighborhood.labels != UNLABELED).astype(np.int64), neighborhood.neighbors, neighborhood.offsets),
+            shape=(len(nodes), self.network.shape[0]))
+        votes = (adj * self._label_matrix).tocsr()
+        votes.sum_duplicates()
+        votes.data = votes.data * n_areas + (n_areas - 1 - self._area_rank[votes.indices])
+        best = np.asarray(votes.max(axis=1).todense()).ravel()
+
+        vote_count = best // n_areas
+        areas = np.where(vote_count > 0, self._ranked_areas[n_areas - 1 - best % n_areas], 0)
+        predicted = areas.tolist()
+        results = list(zip(neighborhood.degree.tolist(),
+                           neighborhood.label_degree.tolist(),
+                           vote_count.tolist()))
+        return predicted, results
+
+    def loo_predict(self, x):
+        '''学習データのノードxを1つずつ除いて学習したときと同じ結果になるように推定する (Leave-one-out)
+
+        fit()は1回だけで、推定対象のノードu自身の寄与を取り除いて多数決をする。
+        - uが自分自身の隣接ノードなら (自己ループ)、uのラベルへの投票を除く
+        - エリア出現回数 (_area_prob) から uのラベルの1回分を除く
+        uが学習データになければ predict() と同じになる。
+        Args:
+            x: Iterable[int] Node set to estimate
+        Returns:
+            List[int] Array of area_id
+        '''
+        if self._can_batch() and len(self._ranked_areas):
+            predicted, results = self._loo_select_batch(np.asarray(x, dtype=np.int64))
+            self.results = results
+            return predicted
+
+        predicted = []
+        results = []
+        labels = self._labels
+        for node in x:
+            label = labels.get(node)
+            locations = [labels[n] if n in labels and n != node else None
+                         for n in self.network.getrow(node)]
+            if label is not None:
+                self._area_prob[label] -= 1
+            try:
+                result = self.select(node, locations)
+            finally:
+                if label is not None:
+                    self._area_prob[label] += 1
+            predicted.append(result[0])
+            results.append(result[1:])
+        self.results = results
+        return predicted
+
+    def _loo_select_batch(self, nodes):
+        '''loo_predict()をまとめて計算する
+
+        (ノード, エリア) ごとの投票数を数えて、select()と同じ順
+        （投票数降順、uを除いたエリア出現回数降順、エリアID昇順）で各ノードの先頭を選ぶ。
+        '''
+        neighborhood = self._neighborhood(nodes)
+        segments = np.repeat(np.arange(len(nodes)), neighborhood.degree)
+        # 自分自身への辺のラベルは使わない
+        valid = (neighborhood.labels != UNLABELED) & (neighborhood.neighbors != nodes[segments])
+        label_degree = np.bincount(segments[valid], minlength=len(nodes))
+
+        areas = self._areas
+        area_counts = np.array([self._area_prob[a] for a in areas.tolist()], dtype=np.int64)
+        n_areas = len(areas)
+        keys, votes = np.unique(segments[valid] * n_areas
+                                + np.searchsorted(areas, neighborhood.labels[valid]),
+                                return_counts=True)
+        seg = keys // n_areas
+        col = keys % n_areas
+        # 推定対象のノードのラベルのエリアは、出現回数を1減らす
+        counts = area_counts[col] - (areas[col] == self._label_array[nodes[seg]])
+
+        order = np.lexsort((col, -counts, -votes, seg))
+        first = order[np.concatenate([[True], np.diff(seg[order]) != 0])] if len(order) else order
+
+        predicted = np.zeros(len(nodes), dtype=np.int64)
+        vote_count = np.zeros(len(nodes), dtype=np.int64)
+        predicted[seg[first]] = areas[col[first]]
+        vote_count[seg[first]] = votes[first]
+        results = list(zip(neighborhood.degree.tolist(), label_degree.tolist(), vote_count.tolist()))
+        return predicted.tolist(), results
+
     def _is_ok_num_friends(self, num_friends):
         '''友人数による推定するかどうかのフィルタ
 
@@ -8,7 +8,7 @@ from collections import defaultdict, Counter
 import numpy as np
 from scipy.optimize import curve_fit
 
-from .base import NeighborsBasedMethod
+from .base import NeighborsBasedMethod, UNLABELED
 
 import logging
 logger = logging.getLogger(__name__)
@@ -145,9 +145,116 @@ class OptimizedProbabilityModel(NaiveProbabilityModel):
             score += log(1 - p) * self._area_prob[l]
         return score
 
-    #def fit(self, X, y):
-    #    super().fit(X, y)
-    #    return self
+    # select_batch()で一度に展開する (ノード, 候補エリア, 隣接ノードのエリア) の組の数の上限
+    batch_pairs = 1 << 22
+
+    def fit(self, X, y):
+        super().fit(X, y)
+        if self._can_batch():
+            self._fit_score_matrix()
+        return self
+
+    def _fit_score_matrix(self):
+        r'''学習データのエリア間の尤度の計算に使う行列を作る
+
+        _areas: 学習データに出現するエリアID（昇順）
+        _area_counts: _areasの各エリアの出現回数 c(a)
+        _log1mp: [i, j] = log(1 - p(dist(a_i, a_j)))
+        _score_matrix: [i, j] = log(p(dist(a_i, a_j))) - _log1mp[i, j]
+        _gamma: [i] = log(gamma_l(a_i)) = \sum_j c(a_j)log[1 - p(dist(a_i, a_j))]
+        '''
+        self._areas = np.array(sorted(self._area_prob), dtype=np.int64)
+        self._area_counts = np.array([self._area_prob[a] for a in self._areas.tolist()], dtype=np.float64)
+        p = self._probability(self._area_distances(self._areas))
+        self._log1mp = np.log(1 - p)
+        self._score_matrix = np.log(p) - self._log1mp
+        self._gamma = self._log1mp.dot(self._area_counts)
+
+    def _update_area_counts(self, delta):
+        '''gamma_lはエリア出現回数の線形関数なので、差分 log(1 - p) @ delta だけ更新する'''
+        # 1ノードずつの推定でメモしたgamma_lは古くなる
+        self._gamma_model = {}
+        if not self._can_batch():
+            return
+        d = np.zeros(len(self._areas), dtype=np.float64)
+        for a, c in delta.items():
+            d[np.searchsorted(self._areas, a)] += c
+        self._area_counts += d
+        self._gamma += self._log1mp.dot(d)
+
+    def _area_distances(self, areas):
+        '''areas x areas の距離行列を返す。distfuncが距離行列(AreaDistanceMatrix)ならそこから切り出す'''
+        if hasattr(self.distfunc, 'rows'):
+            rows = self.distfunc.rows(areas)
+            return np.asarray(self.distfunc.matrix[np.ix_(rows, rows)], dtype=np.float64)
+        areas = areas.tolist()
+        return np.array([[self.distfunc(a1, a2) for a2 in areas] for a1 in areas], dtype=np.float64)
+
+    def select_batch(self, nodes, neighborhood):
+        '''事前計算した行列からまとめて尤度を計算して推定する
+
+        各ノードの隣接ノードのエリアごとの出現回数を数えて、
+        候補エリア（隣接ノードのエリア）ごとに _score_matrix の行を出現回数で重み付けして足す。
+        select()と同じく、尤度降順、エリア出現回数降順、エリアID昇順で選ぶ。
+        '''
+        n_areas = len(self._areas)
+        if not n_areas:
+            return super().select_batch(nodes, neighborhood)
+
+        # 隣接ノードの (ノード, エリア) ごとの出現回数
+        labeled = neighborhood.labels != UNLABELED
+        segments = np.repeat(np.arange(len(nodes)), neighborhood.degree)[labeled]
+        cols = np.searchsorted(self._areas, neighborhood.labels[labeled])
+        keys, counts = np.unique(segments * n_areas + cols, return_counts=True)
+        seg = keys // n_areas
+        col = keys % n_areas
+
+        # ノードごとの候補エリアの数 m と、(ノード, 候補エリア) の組の尤度
+        m = np.bincount(seg, minlength=len(nodes))
+        starts = np.concatenate([[0], np.cumsum(m)])
+        score1 = np.zeros(len(keys), dtype=np.float64)
+        # m^2個の組を展開するので、組の数がbatch_pairsを超えないようにノードを区切る
+        pairs = np.cumsum(m * m)
+        lo = 0
+        while lo < len(nodes):
+            hi = max(np.searchsorted(pairs, (pairs[lo - 1] if lo else 0) + self.batch_pairs, side='right'), lo + 1)
+            self._add_scores(score1, col, counts, m[lo:hi], starts[lo], starts[hi])
+            lo = hi
+        gamma = self._gamma[col]
+        total = score1 + gamma
+
+        # ノードごとに、尤度降順、エリア出現回数降順、エリアID昇順で先頭の組を選ぶ
+        order = np.lexsort((col, -self._area_counts[col], -total, seg))
+        first = order[np.concatenate([[True], np.diff(seg[order]) != 0])] if len(order) else order
+        best_nodes = seg[first]
+
+        areas = np.zeros(len(nodes), dtype=np.int64)
+        scores = np.zeros((len(nodes), 3), dtype=np.float64)
+        areas[best_nodes] = self._areas[col[first]]
+        scores[best_nodes] = np.column_stack([total[first], score1[first], gamma[first]])
+
+        predicted = areas.tolist()
+        results = [(d, l) + tuple(s) for d, l, s in zip(neighborhood.degree.tolist(),
+                                                         neighborhood.label_degree.tolist(),
+                                                         scores.tolist())]
+        # ラベル付きの隣接ノードがなければscoreは int の 0 (select()と同じ)
+        results = [r if r[1] else (r[0], 0, 0, 0, 0) for r in results]
+        return predicted, results
+
+    def _add_scores(self, score1, col, counts, m, start, end):
+        r'''score1[start:end] に、候補エリアごとの \sum_b c_b * _score_matrix[a, b] を足す
+
+        (ノード, 候補エリアa) ごとに同じノードの隣接ノードのエリアbをm個ずつ展開して足す。
+        '''
+        if start == end:
+            return
+        # 各組の展開元 (候補エリアのindex) と 展開先 (同じノードの隣接ノードのエリアのindex)
+        reps = np.repeat(m, m)
+        src = np.repeat(np.arange(start, end), reps)
+        seg_start = np.repeat(np.repeat(np.cumsum(m) - m, m), reps) + start
+        dst = seg_start + (np.arange(len(src)) - np.repeat(np.cumsum(reps) - reps, reps))
+        weights = counts[dst] * self._score_matrix[col[src], col[dst]]
+        score1[start:end] += np.bincount(src - start, weights=weights, minlength=end - start)
 
     def _compute_likelihoods(self, node, friends_areas):
         scores = [(a,) + self._likelihood(a, friends_areas) for a in sorted(set(friends_areas))]
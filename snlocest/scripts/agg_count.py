@@ -4,33 +4,36 @@
 複数の入力ファイルのcountを集計する
 
 input:
-count, user_id, area_id
+prepare_countarea.pyの出力 (.npy、またはcount, user_id, area_idのTSV (.gzも可))
 
 output:
-user_id, count, area_id
+user_id, count, area_id (user_id, area_idの昇順)
+--npyを付けると、(user_id, area_id, count) の配列を.npyの形式で出力する (snlocest.areacount)
 
+入力はメモリマップして、ユーザIDの範囲ごとに少しずつマージする (snlocest.areacount.merge_counts)。
 '''
 
-import csv
-from collections import defaultdict
-from snlocest.argparse import GzipFileType
+import sys
+from snlocest.areacount import load_counts, merge_counts, merge_count_files, save_counts
 
 
 def parse_args():
     import argparse
     parser = argparse.ArgumentParser(description='各ユーザのエリアを集計する')
-    parser.add_argument('infiles', nargs='+', type=GzipFileType('rt', encoding='utf-8'))
+    parser.add_argument('infiles', nargs='+')
+    parser.add_argument('--outfile', help='出力ファイル名 (default: 標準出力)')
+    parser.add_argument('--npy', action='store_true', default=False, help='.npyの形式で出力する (--outfileが必要)')
     return parser.parse_args()
 
 if __name__ == '__main__':
     args = parse_args()
-    count = defaultdict(int)
-    for infile in args.infiles:
-        for line in csv.reader(infile, delimiter='\t'):
-            key = (line[1], line[2])
-            count[key] += int(line[0])
-
-    for k, v in count.items():
-        user_id = k[0]
-        area_id = k[1]
-        print(user_id, v, area_id, sep='\t')
+    if args.npy:
+        if not args.outfile:
+            sys.exit('--npy requires --outfile')
+        save_counts(args.outfile, merge_count_files(args.infiles))
+    else:
+        outfile = open(args.outfile, 'w') if args.outfile else sys.stdout
+        for block in merge_counts([load_counts(path) for path in args.infiles]):
+            outfile.write(''.join('{}\t{}\t{}\n'.format(u, c, a) for u, a, c in zip(
+                block['user_id'].tolist(), block['area_id'].tolist(), block['count'].tolist())))
+        outfile.close()
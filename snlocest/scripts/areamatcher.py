@@ -1,7 +1,12 @@
 # coding: utf-8
 
 '''
-rtreeを使ってエリア照合をする
+座標のエリア照合をする
+
+デフォルトでは座標をchunksizeずつまとめて照合する (BatchAreaMatcher)。
+--gridを付けると、格子状の索引で境界付近の座標だけ厳密に照合する (GridAreaMatcher)。
+--rtreeを付けると、1点ずつrtreeで照合する (RtreeAreaMatcher)。
+--workersを付けると、forkしたプロセスで並列に照合して、入力の順に出力する。
 
 input
 gxml: gxmlparser.py の出力
@@ -20,14 +25,25 @@ import sys
 import csv
 csv.field_size_limit(100000000000)
 import collections
+import itertools
+import multiprocessing
 
+import numpy as np
+import shapely
 from shapely.geometry import Polygon, Point
+from shapely.prepared import prep
+from shapely.strtree import STRtree
 import shapely.wkt as wkt
 from rtree import index
 
+# shapely 2はSTRtreeで点の配列をまとめて検索でき、prepared geometryでcontains_xyができる
+# shapely 1.x (conda.freeze.yamlでは1.5.16) ではshapely.vectorizedを使う (shapely 2では非推奨なので使わない)
+_SHAPELY2 = hasattr(shapely, 'contains_xy')
+
 from snlocest.util.time import record_time
 from snlocest.argparse import GzipFileType
 from snlocest.areadata import AreaData
+from snlocest.areagrid import AreaGrid
 
 
 Area = collections.namedtuple('Area', ['area_id', 'polygon'])
@@ -60,14 +76,226 @@ class RtreeAreaMatcher():
             result.sort(key=lambda x: (x.polygon.area, x.area_id))
         return [r.area_id for r in result]
 
+    def contains_many(self, x, y):
+        '''各点(x, y)についてcontains()をして、点の順に返す (BatchAreaMatcher.contains_manyと同じ)'''
+        return [self.contains(a, b) for a, b in zip(np.asarray(x).tolist(), np.asarray(y).tolist())]
+
+class BatchAreaMatcher():
+    '''座標の配列をまとめてエリア照合する
+
+    1. 各点の候補を、エリアのPolygonのbounding boxとの交差でまとめて求める
+       (shapely 2ならSTRtreeのbulk query、それ以外は経度でソートした点をsearchsortedで切り出す)
+       島のあるエリアのbounding boxは大きくなるので、MultiPolygonはPolygonごとに分けて索引する
+    2. Polygonごとに、候補の点をprepared geometryでまとめてcontains判定する
+    '''
+    def __init__(self, itr):
+        '''(id, Polygon)を返すイテレータから作る'''
+        area_ids = []
+        area_sizes = []
+        self.parts = [] # MultiPolygonを分けたPolygon
+        part_areas = [] # 各Polygonのエリアのindex
+        for i, (area_id, polygon) in enumerate(itr):
+            area_ids.append(area_id)
+            area_sizes.append(polygon.area)
+            for part in getattr(polygon, 'geoms', [polygon]):
+                if part.is_empty:
+                    continue
+                self.parts.append(part)
+                part_areas.append(i)
+        self.area_ids = np.array(area_ids, dtype=np.int64)
+        self.area_sizes = np.array(area_sizes, dtype=np.float64)
+        self.part_areas = np.array(part_areas, dtype=np.int64)
+        self.bounds = np.array([p.bounds for p in self.parts], dtype=np.float64).reshape(-1, 4)
+        if _SHAPELY2:
+            for part in self.parts:
+                shapely.prepare(part)
+            self._tree = STRtree(self.parts)
+
+    def _candidates(self, x, y):
+        '''bounding boxが点を含む (点のindex, Polygonのindex) の組を、Polygonのindex順に返す'''
+        if _SHAPELY2:
+            pts, parts = self._tree.query(shapely.points(x, y))
+            order = np.argsort(parts, kind='mergesort')
+            return pts[order], parts[order]
+        order = np.argsort(x, kind='mergesort')
+        sx = x[order]
+        pts = []
+        parts = []
+        for i, (minx, miny, maxx, maxy) in enumerate(self.bounds.tolist()):
+            lo = np.searchsorted(sx, minx, side='left')
+            hi = np.searchsorted(sx, maxx, side='right')
+            p = order[lo:hi]
+            p = p[(y[p] >= miny) & (y[p] <= maxy)]
+            pts.append(p)
+            parts.append(np.full(len(p), i, dtype=np.int64))
+        if not pts:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        return np.concatenate(pts), np.concatenate(parts)
+
+    def contains_many(self, x, y):
+        '''各点(x, y)を含むエリアのarea_idのリストを、点の順に返す
+
+        2つ以上のPolygonとマッチした場合は、面積の小さいほうのエリアから順に並べる。
+        (RtreeAreaMatcher.contains()と同じ)
+        '''
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        pts, parts = self._candidates(x, y)
+        return self._match(x, y, pts, parts)
+
+    def _match(self, x, y, pts, parts):
+        '''候補の (点のindex, Polygonのindex) の組を、Polygonのindex順に受け取り、
+        各点を含むエリアのarea_idのリストを点の順に返す
+        '''
+        # Polygonごとにまとめてcontains判定する
+        hit = np.zeros(len(pts), dtype=bool)
+        bounds = np.flatnonzero(np.diff(parts)) + 1
+        for start, end in zip(np.r_[0, bounds].tolist(), np.r_[bounds, len(parts)].tolist()):
+            if start == end:
+                continue
+            p = pts[start:end]
+            hit[start:end] = _contains_xy(self.parts[parts[start]], x[p], y[p])
+        pts, areas = pts[hit], self.part_areas[parts[hit]]
+
+        # 点の順、面積の小さい順、area_id順に並べる
+        order = np.lexsort((self.area_ids[areas], self.area_sizes[areas], pts))
+        pts, area_ids = pts[order], self.area_ids[areas[order]].tolist()
+        offsets = np.searchsorted(pts, np.arange(len(x) + 1)).tolist()
+        return [area_ids[offsets[i]:offsets[i+1]] for i in range(len(x))]
+
+
+class GridAreaMatcher():
+    '''格子状の索引 (snlocest.areagrid.AreaGrid) を使ってエリア照合する
+
+    エリアの内部のセルに入る点は配列を引くだけでエリアが決まる。
+    境界のセルに入る点だけ、セルの候補のPolygonとBatchAreaMatcherで厳密に判定する。
+    '''
+    def __init__(self, grid, matcher):
+        self.grid = grid
+        self.matcher = matcher
+
+    def contains_many(self, x, y):
+        '''各点(x, y)を含むエリアのarea_idのリストを、点の順に返す (BatchAreaMatcher.contains_manyと同じ)'''
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        values = self.grid.lookup(x, y)
+
+        # 境界のセルの点と候補のPolygonの組を、Polygonのindex順にして厳密に判定する
+        border = np.flatnonzero(values <= -2)
+        parts, offsets = self.grid.candidates(values[border])
+        pts = np.repeat(border, np.diff(offsets))
+        order = np.argsort(parts, kind='mergesort')
+        results = self.matcher._match(x, y, pts[order], parts[order].astype(np.int64))
+
+        interior = np.flatnonzero(values >= 0)
+        for i, area_id in zip(interior.tolist(), self.grid.area_ids[values[interior]].tolist()):
+            results[i] = [area_id]
+        return results
+
+
+def _contains_xy(polygon, x, y):
+    '''polygonが各点(x, y)を含むかのbool配列'''
+    if _SHAPELY2:
+        return shapely.contains_xy(polygon, x, y)
+    from shapely.vectorized import contains
+    return contains(prep(polygon), x, y)
+
+
+def iter_chunks(infile, chunksize):
+    '''入力の行をchunksize行ずつのリストにして返す'''
+    while True:
+        lines = list(itertools.islice(infile, chunksize))
+        if not lines:
+            return
+        yield lines
+
+
+def match_lines(areadb, lines):
+    '''入力のTSVの行のリストをエリア照合して、出力する行を連結した文字列を返す'''
+    # Tweet JSONをTSVにしたものが入力なので、coordinatesを持っていないツイートが存在するのでスキップする
+    chunk = [cols for cols in csv.reader(lines, delimiter='\t') if cols[2] != 'None']
+    if not chunk:
+        return ''
+    coords = np.array([(cols[2], cols[3]) for cols in chunk], dtype=np.float64)
+    output = []
+    for cols, results in zip(chunk, areadb.contains_many(coords[:, 0], coords[:, 1])):
+        if results:
+            # status_id, user_id, area_id[, area_id, ...]
+            output.append('\t'.join([cols[0], cols[1]] + [str(r) for r in results]) + '\n')
+    return ''.join(output)
+
+
+def imap_ordered(pool, func, iterable, max_pending):
+    '''pool.imapと同じく入力の順に結果を返すが、処理中の入力をmax_pending個までにする
+
+    pool.imapは入力を先に全部読んでしまうので、入力が大きいとメモリが増え続ける。
+    '''
+    pending = collections.deque()
+    for item in iterable:
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(func, (item,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+def match_stream(areadb, infile, outfile, chunksize=100000, workers=1):
+    '''infileの行をchunksize行ずつエリア照合して、outfileに入力の順に書き出す
+
+    workers > 1 なら、forkしたプロセスプールで並列に照合する。
+    照合に使う索引はfork時に子プロセスへコピーオンライトで共有され、
+    pickleして送るのは入力の行と出力の文字列だけになる。
+    処理中のchunkはworkers * 2個までにする。forkできない環境では1プロセスで照合する。
+    Args:
+        workers: int プロセス数。-1ならCPU数
+    '''
+    global _worker_matcher
+    if workers < 0:
+        workers = multiprocessing.cpu_count()
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError:
+        context = None
+    chunks = iter_chunks(infile, chunksize)
+    if context is None or workers <= 1:
+        for lines in chunks:
+            outfile.write(match_lines(areadb, lines))
+        return
+
+    # 子プロセスはfork時のこのグローバル変数から索引を参照する
+    _worker_matcher = areadb
+    try:
+        with context.Pool(workers) as pool:
+            for text in imap_ordered(pool, _match_lines_worker, chunks, workers * 2):
+                outfile.write(text)
+    finally:
+        _worker_matcher = None
+
+
+# match_stream()でforkした子プロセスが使う索引
+_worker_matcher = None
+
+def _match_lines_worker(lines):
+    return match_lines(_worker_matcher, lines)
+
+
+def gen_areas(areadata):
+    for area_id, name, polygon in areadata.iter_areas():
+        yield area_id, polygon
+
+
 @record_time
 def prepare_database(args):
-    areadata = AreaData()
-    def gen(areadata):
-        for area_id, name, polygon in areadata.iter_areas():
-            yield area_id, polygon
-    db = RtreeAreaMatcher()
-    db.insert_from_iterator(gen(areadata))
+    areadata = AreaData(args.gxml.name)
+    if args.rtree:
+        db = RtreeAreaMatcher()
+        db.insert_from_iterator(gen_areas(areadata))
+        return db
+    db = BatchAreaMatcher(gen_areas(areadata))
+    if args.grid:
+        # エリアデータか解像度が変わったときだけ索引を作り直す
+        grid = AreaGrid.load_or_build(args.grid, args.gxml.name, db, resolution=args.grid_resolution)
+        return GridAreaMatcher(grid, db)
     return db
 
 
@@ -77,19 +305,19 @@ def parse_args():
     parser.add_argument('--infile', type=GzipFileType('rt', encoding='utf-8'), default=sys.stdin)
     parser.add_argument('--gxml', required=True, type=GzipFileType(mode='rt', encoding='utf-8'),
                         help='gxmlファイルのTSV (.gzで終わる場合はgzip圧縮されているとみなす)')
+    parser.add_argument('--chunksize', type=int, default=100000, help='まとめて照合する入力の行数')
+    parser.add_argument('--rtree', action='store_true', default=False,
+                        help='1点ずつrtreeで照合する (RtreeAreaMatcher)')
+    parser.add_argument('--grid', help='格子状の索引(.npz)のパス。なければ作って保存する (GridAreaMatcher)')
+    parser.add_argument('--grid-resolution', type=float, default=0.01, help='格子のセルの幅(度) (default: 0.01)')
+    parser.add_argument('--workers', type=int, default=1, help='照合するプロセス数。-1ならCPU数 (default: 1)')
     return parser.parse_args()
 
 
 @record_time
 def main(areadb):
     # 入力されたlat, longのエリアを探す
-    for cols in csv.reader(args.infile, delimiter='\t'):
-        # Tweet JSONをTSVにしたものが入力なので、coordinatesを持っていないツイートが存在するのでスキップする
-        if cols[2] != 'None':
-            results = areadb.contains(float(cols[2]), float(cols[3]))
-            if results:
-                # status_id, user_id, area_id[, area_id, ...]
-                print(cols[0], cols[1], *results, sep='\t')
+    match_stream(areadb, args.infile, sys.stdout, chunksize=args.chunksize, workers=args.workers)
 
 if __name__ == '__main__':
     args = parse_args()
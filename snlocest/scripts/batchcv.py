@@ -0,0 +1,131 @@
+# coding: utf-8
+
+'''
+複数の推定手法の交差検証を1プロセスでまとめて実行する
+
+グラフとラベルは1回だけ読み込み、エリア間の距離関数は手法のあいだで共有する。
+各手法はすべてのラベルで1回だけ学習して、
+K分割交差検証では各分割のテストデータのラベルを除いて推定し (predict_heldout)、
+Leave-one-outではloocv.pyの--fastと同じく推定する（loo_predict()があればそれを使う）。
+
+出力はkfoldcv.pyと同じ形式で、
+    K分割交差検証: {outputdir}/{method}/result_{i}.tsv
+    Leave-one-out: {outputdir}/{method}.tsv
+'''
+
+import os
+import os.path
+import sys
+import numpy as np
+from sklearn.model_selection import KFold
+import snlocest.util as util
+from snlocest.util.command import METHOD_MAP, snlocest_graph
+from snlocest.methods import GeometricMedian, ProbabilityModel, NearestNeighbor
+from snlocest.areadata import AreaCoordinateData
+from snlocest.distance import build_area_distance_func, build_area_distance_matrix
+
+
+def build_methods(graph, method_names, distance_matrix=None):
+    '''手法名のリストから、同じgraphとエリア間の距離関数を共有する推定器のリストを作る
+
+    Returns:
+        List[Tuple[str, NeighborsBasedMethod]]
+    '''
+    distance = None
+    methods = []
+    for name in method_names:
+        Method = METHOD_MAP[name]
+        params = {'network': graph}
+        if Method == GeometricMedian or Method == ProbabilityModel or Method == NearestNeighbor:
+            if distance is None:
+                coord_data = AreaCoordinateData()
+                if distance_matrix:
+                    distance = build_area_distance_matrix(coord_data, path=distance_matrix)
+                else:
+                    distance = build_area_distance_func(coord_data)
+            params['distfunc'] = distance
+        methods.append((name, Method(**params)))
+    return methods
+
+
+def write_result(path, nodes, predictions, graph, info=None):
+    '''推定結果をpathに書き出す。途中で失敗しても不完全なファイルが残らないように一時ファイルから置き換える'''
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as fp:
+        util.write_result(nodes, predictions, graph, info=info, outfile=fp)
+    os.replace(temp_path, path)
+
+
+def kfold(graph, x, y, methods, output_path, n_splits=10, random_state=100, n_jobs=1):
+    '''すべての手法についてK分割交差検証をする
+
+    Args:
+        methods: List[Tuple[str, NeighborsBasedMethod]] build_methods()の返り値
+        output_path: Callable[[str, int], str] (手法名, 分割番号) から出力先のパスを返す関数
+    '''
+    x = np.asarray(x)
+    y = np.asarray(y)
+    cv = KFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+    splits = list(cv.split(x))
+    for name, clf in methods:
+        clf.fit(x, y)
+        for i, (train, test) in enumerate(splits):
+            predicted = clf.predict_heldout(x[test], n_jobs=n_jobs)
+            path = output_path(name, i)
+            write_result(path, x[test], predicted, graph)
+            print('Saved at:', path, file=sys.stderr)
+
+
+def loo(graph, x, y, methods, output_path, n_jobs=1, extra_info=False):
+    '''すべての手法についてLeave-one-out交差検証をする (loocv.pyの--fastと同じ)
+
+    Args:
+        methods: List[Tuple[str, NeighborsBasedMethod]] build_methods()の返り値
+        output_path: Callable[[str], str] 手法名から出力先のパスを返す関数
+    '''
+    for name, clf in methods:
+        clf.fit(x, y)
+        if hasattr(clf, 'loo_predict'):
+            predicted = clf.loo_predict(x)
+        else:
+            predicted = clf.predict(x, n_jobs=n_jobs)
+        path = output_path(name)
+        write_result(path, x, predicted, graph, info=clf.results if extra_info else None)
+        print('Saved at:', path, file=sys.stderr)
+
+
+def main(args):
+    graph, x, y = util.load_dataset(args.edgefile, args.labelfile, args.graph)
+    methods = build_methods(graph, args.methods, distance_matrix=args.distance_matrix)
+    if args.loo:
+        output_path = lambda name: os.path.join(args.outputdir, '{}.tsv'.format(name))
+        loo(graph, x, y, methods, output_path, n_jobs=args.n_jobs, extra_info=args.extra)
+    else:
+        random_state = args.random_state if args.random_state is not None else 100
+        output_path = lambda name, i: os.path.join(args.outputdir, name, 'result_{}.tsv'.format(i))
+        kfold(graph, x, y, methods, output_path,
+              n_splits=args.n_splits, random_state=random_state, n_jobs=args.n_jobs)
+
+
+def parse_args():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('edgefile')
+    parser.add_argument('labelfile')
+    parser.add_argument('outputdir')
+    parser.add_argument('--methods', nargs='+', choices=sorted(METHOD_MAP), default=['mv', 'gm', 'pm', 'rn'])
+    parser.add_argument('--loo', action='store_true', default=False, help='K分割ではなくLeave-one-out交差検証をする')
+    parser.add_argument('--n-jobs', type=int, default=1, help='The number of CPUs to use for prediction')
+    parser.add_argument('--n-splits', type=int, default=10, help='K-fold')
+    parser.add_argument('--random-state', type=int)
+    parser.add_argument('--extra', action='store_true', default=False, help='推定時の他の情報を出力するかどうか(Leave-one-outのみ)')
+    parser.add_argument('--distance-matrix', help='エリア間の距離行列(.npy)のパス。なければ計算して保存する')
+    parser.add_argument('--graph', type=snlocest_graph, default=None,
+                        help='グラフを読み込むクラス [array, csr, int, dol] (default: array。'
+                             'edgefileがcompilegraph.pyで変換したディレクトリなら保存したクラス)')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
@@ -0,0 +1,43 @@
+# coding: utf-8
+
+'''
+フォローのエッジリスト (MasterFollowEdgelist) を1度だけ読み込んで、
+mutual, linked, follower, followee のネットワークをまとめてCSRGraphの.npyファイルのディレクトリに変換する
+
+それぞれのネットワークのエッジリストを作ってからcompilegraph.py --int-idsで変換したものと同じになる。
+隣接行列Aに対して、mutual = A ∧ Aᵀ, linked = A ∨ Aᵀ, follower = Aᵀ, followee = A (snlocest.graph.follow_networks)
+
+input:
+edgelist: src_id, dst_id (src_idがdst_idをフォローしている。.gzも可)
+
+output:
+--mutual, --linked, --follower, --followee で指定したディレクトリ (指定したものだけ作る)
+'''
+
+import sys
+from snlocest.graph import FOLLOW_NETWORKS, Int64CSRGraph, follow_networks, load_int_adj_matrix
+
+
+def parse_args():
+    import argparse
+    parser = argparse.ArgumentParser(description='フォローのエッジリストから4種類のネットワークをまとめて作る')
+    parser.add_argument('edgefile', help='エッジリスト')
+    for name in FOLLOW_NETWORKS:
+        parser.add_argument('--' + name, help='{}のネットワークの出力先のディレクトリ'.format(name))
+    parser.add_argument('--labelfile', help='ラベルリスト（指定するとラベルも保存する）')
+    return parser.parse_args()
+
+def main(args):
+    outputs = {name: getattr(args, name) for name in FOLLOW_NETWORKS if getattr(args, name)}
+    adj, nodes = load_int_adj_matrix(args.edgefile)
+    for name, (m, network_nodes) in follow_networks(adj, nodes).items():
+        if name not in outputs:
+            continue
+        graph = Int64CSRGraph.from_csr(m, network_nodes)
+        if args.labelfile:
+            graph.load_labellist(args.labelfile)
+        graph.save(outputs[name])
+        print('Saved at:', outputs[name], file=sys.stderr)
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,40 @@
+# coding: utf-8
+
+'''
+エッジリストとラベルリストを読み込んで、CSRGraphの.npyファイルのディレクトリに変換する
+
+変換したディレクトリはloocv.py, kfoldcv.pyなどのedgefileとして渡せる。
+毎回エッジリストをパースする代わりに、メモリマップして一瞬で読み込める。
+
+input:
+edgelist: src_id, dst_id
+labelfile: node_id, label
+
+output:
+indptr.npy, indices.npy, data.npy, nodes.npy, labeled_nodes.npy, labels.npy
+'''
+
+import sys
+from snlocest.graph import CSRGraph, Int64CSRGraph
+
+
+def parse_args():
+    import argparse
+    parser = argparse.ArgumentParser(description='エッジリストをCSRGraphの.npyファイルに変換する')
+    parser.add_argument('edgefile', help='エッジリスト')
+    parser.add_argument('outputdir', help='出力先のディレクトリ')
+    parser.add_argument('--labelfile', help='ラベルリスト（指定するとラベルも保存する）')
+    parser.add_argument('--int-ids', action='store_true', default=True,
+                        help='ノードIDをint64として読み込む（デフォルト）')
+    parser.add_argument('--str-ids', dest='int_ids', action='store_false',
+                        help='ノードIDを文字列として読み込む（ノードIDが数値でないとき）')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    Graph = Int64CSRGraph if args.int_ids else CSRGraph
+    graph = Graph().load_edgelist(args.edgefile)
+    if args.labelfile:
+        graph.load_labellist(args.labelfile)
+    graph.save(args.outputdir)
+    print('Saved at:', args.outputdir, file=sys.stderr)
@@ -3,16 +3,25 @@
 '''
 ユーザごとのエリアIDから、居住地を決める
 多数決で決める（ユーザごとに、最もツイート数が多いエリアを選択する）
+最多のエリアが複数あるときは、エリアIDが最小のものを選ぶ (snlocest.homelocation)
 
-要：入力ファイルがメモリにのること
+--mode memory (デフォルト): 入力ファイルがメモリにのること
+--mode stream: 同じユーザの行が続いていること (agg_count.pyの出力をソートしたもの)。メモリは一定
+--mode chunked: --chunksize行ずつ読む。ソートされていなくてよい。メモリはユーザ数に比例
+    agg_count.py --npy の出力 (.npy) も読める
+--tableを付けると、TSVではなく、しきい値で絞り込む前のユーザごとの居住地の表 (.npy) を出力する
+    表からはmaterialize_homelocation.pyで複数のしきい値の居住地をまとめて出力できる
 
 
 input: agg_count.py
 user_id, count, area_id
-（ソートされていること）
+（--mode streamではソートされていること）
 
+output:
+user_id, area_id, count, total
 
-最多のツイートがあるエリアでの最小ツイート数 
+
+最多のツイートがあるエリアでの最小ツイート数
 NumOfTweetsAtMajorityArea := 5
 
 最小総ツイート数
@@ -20,7 +29,11 @@ NumOfTweetsAtMajorityArea := 5
 
 
 import sys
+import numpy as np
 import pandas as pd
+from snlocest.areacount import load_counts
+from snlocest.homelocation import (majority_frame, iter_majority_sorted, majority_chunked,
+                                   home_table, home_table_sorted, save_home_table, threshold_mask, write_home_table)
 
 
 def load_data(infile):
@@ -28,10 +41,7 @@ def load_data(infile):
     return df
 
 def process(df, args):
-    sorted = df.sort_values(by='count')
-    result = sorted.drop_duplicates('user_id', keep='last')
-    result = result.set_index('user_id')
-    result['total'] = df.groupby('user_id')['count'].sum()
+    result = majority_frame(df)
 
     if args.min_majoritynum:
         result = result[result['count'] >= args.min_majoritynum]
@@ -41,6 +51,30 @@ def process(df, args):
 
     result.to_csv(args.outfile, sep='\t', columns=['area_id', 'count', 'total'], header=False)
 
+def process_stream(lines, args, outfile):
+    for user_id, area_id, count, total in iter_majority_sorted(lines):
+        if args.min_majoritynum and count < args.min_majoritynum:
+            continue
+        if args.min_totalnum and total < args.min_totalnum:
+            continue
+        outfile.write('{}\t{}\t{}\t{}\n'.format(user_id, area_id, count, total))
+
+def iter_chunks(infile, chunksize):
+    '''(user_id, area_id, count) の配列の組をchunksize行ずつ返す'''
+    if isinstance(infile, str) and infile.endswith('.npy'):
+        counts = load_counts(infile)
+        for i in range(0, len(counts), chunksize):
+            chunk = counts[i:i + chunksize]
+            yield chunk['user_id'], chunk['area_id'], chunk['count']
+        return
+    reader = pd.read_csv(infile, sep='\t', names=['user_id', 'count', 'area_id'], dtype=np.int64, chunksize=chunksize)
+    for df in reader:
+        yield df['user_id'].values, df['area_id'].values, df['count'].values
+
+def process_chunked(chunks, args, outfile):
+    table = home_table(*majority_chunked(chunks))
+    write_home_table(table, outfile, mask=threshold_mask(table, args.min_majoritynum, args.min_totalnum))
+
 def parse_args():
     import argparse
     parser = argparse.ArgumentParser(description='ユーザごとのエリアIDを処理する')
@@ -48,9 +82,33 @@ def parse_args():
     parser.add_argument('--outfile', default=sys.stdout)
     parser.add_argument('--min-majoritynum', default=1, type=int, help='最多のツイートがあるエリアでの最小ツイート数')
     parser.add_argument('--min-totalnum', default=1, type=int, help='最小総ツイート数')
+    parser.add_argument('--mode', choices=['memory', 'stream', 'chunked'], default='memory',
+                        help='memory: まとめて読む, stream: ユーザごとにソートされた入力を順に読む, chunked: chunkごとに読む')
+    parser.add_argument('--chunksize', type=int, default=1000000, help='--mode chunkedで1度に読む行数')
+    parser.add_argument('--table', help='居住地の表 (.npy) の出力先。--mode streamかchunkedのとき')
     return parser.parse_args()
 
 if __name__ == '__main__':
     args = parse_args()
-    df = load_data(args.infile)
-    process(df, args)
+    if isinstance(args.infile, str) and args.infile.endswith('.npy') and args.mode != 'chunked':
+        sys.exit('.npy input requires --mode chunked')
+    if args.table:
+        if args.mode == 'memory':
+            sys.exit('--table requires --mode stream or chunked')
+        infile = open(args.infile) if isinstance(args.infile, str) and not args.infile.endswith('.npy') else args.infile
+        if args.mode == 'stream':
+            table = home_table_sorted(infile)
+        else:
+            table = home_table(*majority_chunked(iter_chunks(infile, args.chunksize)))
+        save_home_table(args.table, table)
+    elif args.mode == 'memory':
+        df = load_data(args.infile)
+        process(df, args)
+    else:
+        infile = open(args.infile) if isinstance(args.infile, str) and not args.infile.endswith('.npy') else args.infile
+        outfile = open(args.outfile, 'w') if isinstance(args.outfile, str) else args.outfile
+        if args.mode == 'stream':
+            process_stream(infile, args, outfile)
+        else:
+            process_chunked(iter_chunks(infile, args.chunksize), args, outfile)
+        outfile.close()
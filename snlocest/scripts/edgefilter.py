@@ -11,19 +11,26 @@ idlist
 
 python edgefilter.py [edgelist] -e [exclusionfile]
 exclusionfile: data/network/active_unknown.txt
+
+--and-exclude, --and-include で条件を追加すると、すべての条件を満たす行を1度に取り出す
+python edgefilter.py [edgelist] -e [exclusionfile] --and-include [seedfile]
+
+--bothを付けると、両端 (1カラム目と2カラム目) のIDを調べる
+
+絞り込みはsnlocest.idfilterでブロックごとにまとめて行う
 '''
 
 import sys
-import csv
+from snlocest.idfilter import IdFilter, load_ids, filter_lines
 
 def parse_args():
     import argparse
     parser = argparse.ArgumentParser(
         description='除外IDから出るエッジを消す')
     parser.add_argument('edgefile', help='エッジリスト', nargs='?',
-                        default=sys.stdin, type=argparse.FileType('r'))
+                        default=sys.stdin.buffer, type=argparse.FileType('rb'))
     parser.add_argument('idlist', help='',
-                        type=argparse.FileType('r'))
+                        type=argparse.FileType('rb'))
 
     group = parser.add_mutually_exclusive_group()
     group.add_argument('-e', '--exclude', action='store_true',
@@ -31,27 +38,35 @@ def parse_args():
     group.add_argument('-i', '--include', action='store_true',
                        help='動作：抽出する')
 
+    parser.add_argument('--and-exclude', action='append', default=[], type=argparse.FileType('rb'),
+                        help='このIDリストに含まれるIDの行も除外する (複数指定可)')
+    parser.add_argument('--and-include', action='append', default=[], type=argparse.FileType('rb'),
+                        help='このIDリストに含まれるIDの行だけを抽出する (複数指定可)')
+
     parser.add_argument('-r', '--reverse', default=False, action='store_true',
                         help='IDを調べる向きを逆にする (default: 左側; 1カラム目)')
+    parser.add_argument('--both', default=False, action='store_true',
+                        help='両端のIDを調べる')
     return parser.parse_args()
 
+def make_filters(args):
+    '''(IdSet, 抽出するか) の組と調べる列から、IdFilterのリストを作る'''
+    # 調べる列番号
+    columns = [0, 1] if args.both else [0 if not args.reverse else 1]
+    lists = []
+    if args.exclude or args.include:
+        lists.append((load_ids(args.idlist), args.include))
+    lists += [(load_ids(f), False) for f in args.and_exclude]
+    lists += [(load_ids(f), True) for f in args.and_include]
+    return [IdFilter(ids, column, include) for ids, include in lists for column in columns]
+
 def _main():
     args = parse_args()
-
-    # IDリストをつくる
-    ids = {col[0] for col in csv.reader(args.idlist, delimiter='\t')}
-
-    # 調べる列番号
-    num = 0 if not args.reverse else 1
-
-    if args.exclude:
-        for col in csv.reader(args.edgefile, delimiter='\t'):
-            if col[num] not in ids:
-                print(*col, sep='\t', file=sys.stdout)
-    elif args.include:
-        for col in csv.reader(args.edgefile, delimiter='\t'):
-            if col[num] in ids:
-                print(*col, sep='\t', file=sys.stdout)
+    if not (args.exclude or args.include):
+        # これまでどおり、-e も -i もなければ何も出力しない
+        return
+    filter_lines(args.edgefile, sys.stdout.buffer, make_filters(args))
+    sys.stdout.flush()
 
 if __name__ == '__main__':
     _main()
@@ -1,12 +1,32 @@
 # coding: utf-8
 
+'''
+Tweetsオブジェクトから使う情報を取り出す
+
+input: 1行に1つのTweet JSON (gzip -dc | cut -f 2 の出力)
+output: status_id, user_id, lon, lat, place_id, created_at のTSV
+
+--fastを付けると、入力をバイト列のまま大きなブロックで読み、
+orjsonがあればorjsonで（なければjsonで）パースして、出力もまとめて書き出す。
+--pair IN OUTを付けると、gzip -dc IN | cut -f 2 | extweets > OUT と同じ処理を--fastで行う。
+複数の--pairは--workersのプロセスで並列に処理する。
+どのモードでも出力はこれまでと同じになる。
+フィルタ (snlocest.tweetfilter) で取り除いたツイートの数は、理由ごとにstderrに出力する。
+'''
+
 import sys
+import codecs
+import os
+import gzip
 import json
-from snlocest.tweetfilter import tweet_filter
+import multiprocessing
+from collections import Counter
+from snlocest.tweetfilter import TweetFilter, tweet_filter
 
-# sys.stdinがerrorsを指定しても利用しないため、UnicodeDecodeError起きるので、対処
-import codecs
-sys.stdin = codecs.getreader(sys.stdin.encoding)(sys.stdin.detach(), errors='ignore')
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 def parse_args():
@@ -17,9 +37,17 @@ def parse_args():
                         default=sys.stdin)
     parser.add_argument('--outfile', type=argparse.FileType('w', encoding='utf-8'),
                         default=sys.stdout)
+    parser.add_argument('--fast', action='store_true', default=False,
+                        help='バイト列のままブロックで読み、orjsonがあれば使ってパースする')
+    parser.add_argument('--cut', action='store_true', default=False,
+                        help='--fastで、入力の各行の2列目をTweet JSONとする (cut -f 2)')
+    parser.add_argument('--pair', nargs=2, action='append', metavar=('IN', 'OUT'),
+                        help='gzip -dc IN | cut -f 2 | extweets > OUT と同じ処理をする (.gzで終わるOUTはgzip圧縮する)')
+    parser.add_argument('--workers', type=int, default=1, help='--pairを処理するプロセス数。-1ならCPU数 (default: 1)')
     return parser.parse_args()
 
-def print_extract(tweet, outfile):
+def format_extract(tweet):
+    '''tweetから取り出した情報のTSVの行(改行なし)を返す。取り出せなければNoneを返す'''
     try:
         user_id = tweet['user']['id_str']
         created_at = tweet['created_at']
@@ -36,10 +64,13 @@ def print_extract(tweet, outfile):
     except (KeyError, TypeError) as ex:
         print(ex, file=sys.stderr)
         print(tweet, file=sys.stderr)
-        pass
-    else:
-        print(status_id, user_id, lon, lat, place_id, created_at,
-              file=outfile, sep='\t')
+        return None
+    return '\t'.join([str(status_id), str(user_id), str(lon), str(lat), str(place_id), str(created_at)])
+
+def print_extract(tweet, outfile):
+    line = format_extract(tweet)
+    if line is not None:
+        print(line, file=outfile)
 
 def parse_tweet(infile):
     for line in infile:
@@ -52,7 +83,123 @@ def parse_tweet(infile):
             # 文字コードが変なときでも落ちる
             pass
 
+
+# 標準入力のcodecsのreaderは、str.splitlines()と同じく\n以外の文字でも行を分ける (UTF-8でのバイト列)
+_LINE_BREAKS = (b'\r', b'\x0b', b'\x0c', b'\x1c', b'\x1d', b'\x1e', b'\xc2\x85', b'\xe2\x80\xa8', b'\xe2\x80\xa9')
+
+def _has_line_breaks(data):
+    return any(c in data for c in _LINE_BREAKS)
+
+def iter_blocks(infile, blocksize=1 << 24):
+    '''バイナリのファイルをblocksizeずつ読み、改行で分けた行(改行なし)のリストを返す'''
+    rest = b''
+    while True:
+        block = infile.read(blocksize)
+        if not block:
+            break
+        lines = (rest + block).split(b'\n')
+        rest = lines.pop()
+        yield lines
+    if rest:
+        yield [rest]
+
+def _loads(line):
+    '''バイト列の1行をparse_tweet()と同じようにパースする。パースできなければValueError'''
+    if orjson is not None:
+        try:
+            return orjson.loads(line)
+        except ValueError:
+            # orjsonが受け付けない行（UTF-8として不正なバイト、NaNなど）はjsonでパースする
+            pass
+    return json.loads(line.decode('utf-8', 'ignore').rstrip())
+
+def extract_lines(lines, cut=False, accept=tweet_filter):
+    '''バイト列の行のリストからparse_tweet(), tweet_filter, print_extract()と同じ出力を作り、UTF-8で返す
+
+    Args:
+        cut: bool 各行の2列目をTweet JSONとする (cut -f 2)
+        accept: Callable[[dict], bool] ツイートのフィルタ (TweetFilterなど)
+    '''
+    output = []
+    # ほとんどのブロックには\n以外の改行がないので、まとめて調べておく
+    check = _has_line_breaks(b'\n'.join(lines))
+    for line in lines:
+        if cut and b'\t' in line:
+            line = line.split(b'\t', 2)[1]
+        if line.endswith(b'\r'):
+            line = line[:-1]
+        if check and _has_line_breaks(line):
+            # 1行が複数の行に分かれるので、標準入力から読んだときと同じように分けてパースする
+            tweets = parse_tweet(line.decode('utf-8', 'ignore').splitlines())
+        else:
+            try:
+                tweets = [_loads(line)]
+            except ValueError:
+                # Ignore broken JSON
+                continue
+        for tweet in tweets:
+            if accept(tweet):
+                extracted = format_extract(tweet)
+                if extracted is not None:
+                    output.append(extracted)
+    if not output:
+        return b''
+    output.append('')
+    return '\n'.join(output).encode('utf-8')
+
+def extract_stream(infile, outfile, cut=False, accept=tweet_filter):
+    '''バイナリのinfileからTweet JSONを読み、取り出した情報をバイナリのoutfileに書き出す'''
+    for lines in iter_blocks(infile):
+        outfile.write(extract_lines(lines, cut=cut, accept=accept))
+
+def extract_file(pair):
+    '''gzip -dc IN | cut -f 2 | extweets > OUT と同じ処理をして、(OUT, 取り除いたツイートの理由ごとの数) を返す
+
+    途中で失敗しても不完全なファイルが残らないように一時ファイルから置き換える。
+    '''
+    inpath, outpath = pair
+    accept = TweetFilter()
+    temp_path = outpath + '.tmp'
+    with (gzip.open(inpath, 'rb') if inpath.endswith('.gz') else open(inpath, 'rb')) as infile, \
+         (gzip.open(temp_path, 'wb', compresslevel=6) if outpath.endswith('.gz') else open(temp_path, 'wb')) as outfile:
+        extract_stream(infile, outfile, cut=True, accept=accept)
+    os.replace(temp_path, outpath)
+    return outpath, accept.counts
+
+def extract_files(pairs, workers=1):
+    '''(IN, OUT)のリストをworkersのプロセスで並列にextract_file()して、取り除いたツイートの理由ごとの数を返す'''
+    if workers < 0:
+        workers = multiprocessing.cpu_count()
+    total = Counter()
+    if workers <= 1 or len(pairs) <= 1:
+        results = map(extract_file, pairs)
+        for path, counts in results:
+            print('Saved at:', path, file=sys.stderr)
+            total.update(counts)
+        return total
+    with multiprocessing.Pool(min(workers, len(pairs))) as pool:
+        for path, counts in pool.imap_unordered(extract_file, pairs):
+            print('Saved at:', path, file=sys.stderr)
+            total.update(counts)
+    return total
+
+def print_reject_counts(counts):
+    print('Rejected tweets:', ', '.join('{}={}'.format(k, v) for k, v in sorted(counts.items())), file=sys.stderr)
+
 if __name__ == '__main__':
+    # sys.stdinがerrorsを指定しても利用しないため、UnicodeDecodeError起きるので、対処
+    sys.stdin = codecs.getreader(sys.stdin.encoding)(sys.stdin.detach(), errors='ignore')
     args = parse_args()
-    for tweet in filter(tweet_filter, parse_tweet(args.infile)):
-        print_extract(tweet, outfile=args.outfile)
+    accept = TweetFilter()
+    if args.pair:
+        accept.counts = extract_files(args.pair, workers=args.workers)
+    elif args.fast:
+        # codecsのreaderやTextIOWrapperの下のバイナリのファイルを使う
+        infile = args.infile.stream if hasattr(args.infile, 'stream') else args.infile.buffer
+        args.outfile.flush()
+        extract_stream(infile, args.outfile.buffer, cut=args.cut, accept=accept)
+        args.outfile.buffer.flush()
+    else:
+        for tweet in filter(accept, parse_tweet(args.infile)):
+            print_extract(tweet, outfile=args.outfile)
+    print_reject_counts(accept.counts)
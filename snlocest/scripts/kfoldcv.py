@@ -11,19 +11,17 @@ import os.path
 import numpy as np
 from sklearn.model_selection import KFold
 import snlocest.util as util
-from snlocest.graph import SpMatLikeDOLGraph
 from snlocest.methods import MajorityVote
-from snlocest.util.command import snlocest_method
+from snlocest.util.command import snlocest_method, snlocest_graph
 from snlocest.methods import GeometricMedian, ProbabilityModel
 from snlocest.areadata import AreaCoordinateData
-from snlocest.distance import build_area_distance_func
+from snlocest.distance import build_area_distance_func, build_area_distance_matrix
 
 
-def predict(clf, graph, x, y, train, test):
-    x_train, y_train = x[train], y[train]
-    x_test, y_test = x[test], y[test]
-    clf.fit(x_train, y_train)
-    predicted = clf.predict(x_test)
+def predict(clf, graph, x, y, train, test, n_jobs=1):
+    '''すべてのラベルでfit()済みのclfで、testのラベルを除いて推定する'''
+    x_test = x[test]
+    predicted = clf.predict_heldout(x_test, n_jobs=n_jobs)
     return x_test, predicted
 
 def main(args):
@@ -36,16 +34,21 @@ def main(args):
         args.n_jobs (optional)
         args.random_state (default: 100)
         args.nth (optional)
+        args.distance_matrix (optional)
+        args.graph (optional)
     '''
-    #n_jobs = getattr(args, 'n_jobs', 1)
+    n_jobs = getattr(args, 'n_jobs', 1)
     random_state = args.random_state if args.random_state is not None else 100
     n_splits = args.n_splits
     Method = args.method
 
-    graph, x, y = util.load_dataset(args.edgefile, args.labelfile, SpMatLikeDOLGraph)
+    graph, x, y = util.load_dataset(args.edgefile, args.labelfile, getattr(args, 'graph', None))
 
     coord_data = AreaCoordinateData()
-    distance = build_area_distance_func(coord_data)
+    if getattr(args, 'distance_matrix', None):
+        distance = build_area_distance_matrix(coord_data, path=args.distance_matrix)
+    else:
+        distance = build_area_distance_func(coord_data)
 
     params = {'network': graph}
     if Method == GeometricMedian or Method == ProbabilityModel:
@@ -60,9 +63,11 @@ def main(args):
 
     x = np.asarray(x)
     y = np.asarray(y)
+    # 学習はすべてのラベルで1回だけにして、各分割ではテストデータのラベルを除いて推定する
+    clf.fit(x, y)
     if args.nth is None:
         for i, (train, test) in enumerate(cv.split(x)):
-            x_test, predicted = predict(clf, graph, x, y, train, test)
+            x_test, predicted = predict(clf, graph, x, y, train, test, n_jobs=n_jobs)
             output_path = os.path.join(args.outputdir, 'result_{}.tsv'.format(i))
             with open(output_path, 'w') as fp:
                 util.write_result(x_test, predicted, graph, outfile=fp)
@@ -72,7 +77,7 @@ def main(args):
         for i, (train, test) in enumerate(cv.split(x)):
             if i != args.nth:
                 continue
-            x_test, predicted = predict(clf, graph, x, y, train, test)
+            x_test, predicted = predict(clf, graph, x, y, train, test, n_jobs=n_jobs)
             util.write_result(x_test, predicted, graph, outfile=sys.stdout)
 
 
@@ -82,9 +87,13 @@ def parse_args():
     parser.add_argument('edgefile')
     parser.add_argument('labelfile')
     parser.add_argument('method', type=snlocest_method)
-    parser.add_argument('--n-jobs', type=int, default=1, help='The number of CPUs to use')
+    parser.add_argument('--n-jobs', type=int, default=1, help='The number of CPUs to use for prediction')
     parser.add_argument('--n-splits', type=int, default=10, help='K-fold')
     parser.add_argument('--random-state', type=int)
+    parser.add_argument('--distance-matrix', help='エリア間の距離行列(.npy)のパス。なければ計算して保存する')
+    parser.add_argument('--graph', type=snlocest_graph, default=None,
+                        help='グラフを読み込むクラス [array, csr, int, dol] (default: array。'
+                             'edgefileがcompilegraph.pyで変換したディレクトリなら保存したクラス)')
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('--outputdir')
     group.add_argument('--nth', type=int, help='If this parameter is given, only the nth test set is predicted.')
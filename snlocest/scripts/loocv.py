@@ -6,20 +6,27 @@ Leave-one-out交差検証をする
 
 from sklearn.model_selection import LeaveOneOut, cross_val_predict
 from snlocest.util import load_dataset, write_result
-from snlocest.graph import SpMatLikeDOLGraph
-from snlocest.util.command import snlocest_method
+from snlocest.util.command import snlocest_method, snlocest_graph
 from snlocest.methods import GeometricMedian, ProbabilityModel, NearestNeighbor
 from snlocest.areadata import AreaCoordinateData
-from snlocest.distance import build_area_distance_func
+from snlocest.distance import build_area_distance_func, build_area_distance_matrix
 
 
+def build_distance(distance_matrix=None):
+    '''エリア間の距離関数を作る。distance_matrixが与えられたら事前計算した距離行列を使う'''
+    coord_data = AreaCoordinateData()
+    if distance_matrix:
+        return build_area_distance_matrix(coord_data, path=distance_matrix)
+    return build_area_distance_func(coord_data)
 
-def fast(edgefile, labelfile, Method, extra_info=False):
+def fast(edgefile, labelfile, Method, njobs=1, extra_info=False, distance_matrix=None, Graph=None):
     # 学習1回なので早い。ただし、推定手法が推定対象のノードのラベル情報をみないときのみ正しい結果になる。
-    graph, x, y = load_dataset(edgefile, labelfile, SpMatLikeDOLGraph)
+    # loo_predict()がある手法(MajorityVote)は、推定対象のノードのラベルを除くので正しい結果になる。
+    # njobs > 1 なら、推定をプロセスプールで並列にする
+    # (loo_predict()がある手法は配列でまとめて推定するので並列にしない。njobsは使わない)
+    graph, x, y = load_dataset(edgefile, labelfile, Graph)
 
-    coord_data = AreaCoordinateData()
-    distance = build_area_distance_func(coord_data)
+    distance = build_distance(distance_matrix)
 
     params = {'network': graph}
     if Method == GeometricMedian or Method == ProbabilityModel or Method == NearestNeighbor:
@@ -27,27 +34,35 @@ def fast(edgefile, labelfile, Method, extra_info=False):
 
     clf = Method(**params)
     clf.fit(x, y)
-    predictions = clf.predict(x)
+    if hasattr(clf, 'loo_predict'):
+        predictions = clf.loo_predict(x)
+    else:
+        predictions = clf.predict(x, n_jobs=njobs)
     if not extra_info:
         write_result(x, predictions, graph)
     else:
         info = clf.results
         write_result(x, predictions, graph, info=info)
 
-def main(edgefile, labelfile, Method, njobs=1, extra_info=False):
+def main(edgefile, labelfile, Method, njobs=1, extra_info=False, distance_matrix=None, Graph=None):
     #TODO methodのparameterを受け取れるようにする
-    graph, x, y = load_dataset(edgefile, labelfile, SpMatLikeDOLGraph)
+    graph, x, y = load_dataset(edgefile, labelfile, Graph)
 
-    coord_data = AreaCoordinateData()
-    distance = build_area_distance_func(coord_data)
+    distance = build_distance(distance_matrix)
 
     params = {'network': graph}
     if Method == GeometricMedian or Method == ProbabilityModel or Method == NearestNeighbor:
         params['distfunc'] = distance
 
     clf = Method(**params)
-    loo = LeaveOneOut()
-    predictions = cross_val_predict(clf, x, y, cv=loo, n_jobs=njobs, pre_dispatch='2*n_jobs')
+    if hasattr(clf, 'loo_predict'):
+        # 推定対象のノード自身の寄与を除いて推定できる手法は、学習1回で正確なLeave-one-outになる
+        # (このときnjobsは使わない)
+        clf.fit(x, y)
+        predictions = clf.loo_predict(x)
+    else:
+        loo = LeaveOneOut()
+        predictions = cross_val_predict(clf, x, y, cv=loo, n_jobs=njobs, pre_dispatch='2*n_jobs')
     if not extra_info:
         write_result(x, predictions, graph)
     else:
@@ -60,15 +75,23 @@ def parse_args():
     parser.add_argument('edgefile')
     parser.add_argument('labelfile')
     parser.add_argument('method', type=snlocest_method)
-    parser.add_argument('--n-jobs', type=int, default=1, help='The number of CPUs to use')
-    parser.add_argument('--fast', action='store_true', default=False, help='並列化しない')
+    parser.add_argument('--n-jobs', type=int, default=1,
+                        help='The number of CPUs to use (loo_predict()がある手法 (MajorityVote) では使わない)')
+    parser.add_argument('--fast', action='store_true', default=False,
+                        help='学習を1回だけにする。--n-jobsは推定の並列数になる (loo_predict()がある手法を除く)')
     parser.add_argument('--extra', action='store_true', default=False, help='推定時の他の情報を出力するかどうか(default: False)')
+    parser.add_argument('--distance-matrix', help='エリア間の距離行列(.npy)のパス。なければ計算して保存する')
+    parser.add_argument('--graph', type=snlocest_graph, default=None,
+                        help='グラフを読み込むクラス [array, csr, int, dol] (default: array。'
+                             'edgefileがcompilegraph.pyで変換したディレクトリなら保存したクラス)')
     return parser.parse_args()
 
 if __name__ == '__main__':
     args = parse_args()
     if args.fast:
-        fast(args.edgefile, args.labelfile, args.method, extra_info=args.extra)
+        fast(args.edgefile, args.labelfile, args.method, njobs=args.n_jobs, extra_info=args.extra,
+             distance_matrix=args.distance_matrix, Graph=args.graph)
     else:
         # 並列数を増やしても早くならない気がする。推定時間よりオーバーヘッドが大きい
-        main(args.edgefile, args.labelfile, args.method, njobs=args.n_jobs)
+        main(args.edgefile, args.labelfile, args.method, njobs=args.n_jobs,
+             distance_matrix=args.distance_matrix, Graph=args.graph)
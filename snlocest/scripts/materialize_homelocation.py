@@ -0,0 +1,41 @@
+# coding: utf-8
+
+'''
+居住地の表 (decidehomelocation.py --table の出力) から、複数のしきい値の居住地をまとめて出力する
+
+しきい値は --min-majoritynum と --min-totalnum の値のすべての組み合わせ。
+出力のファイル名は {prefix}_MinMajorityNum-{m}_MinTotalNum-{t}.tsv で、
+内容は decidehomelocation.py の出力と同じ (user_id, area_id, count, total)。
+'''
+
+import os
+import sys
+from snlocest.homelocation import load_home_table, homelocation_filename, materialize_thresholds
+
+
+def main(args):
+    table = load_home_table(args.table, mmap=False)
+    thresholds = [(m, t) for m in args.min_majoritynum for t in args.min_totalnum]
+    paths = [os.path.join(args.output_dir, homelocation_filename(args.prefix, m, t)) for m, t in thresholds]
+    outfiles = [open(path, 'w') for path in paths]
+    try:
+        materialize_thresholds(table, thresholds, outfiles)
+    finally:
+        for outfile in outfiles:
+            outfile.close()
+    return paths
+
+
+def parse_args():
+    import argparse
+    parser = argparse.ArgumentParser(description='居住地の表から複数のしきい値の居住地を出力する')
+    parser.add_argument('table', help='decidehomelocation.py --table の出力')
+    parser.add_argument('--min-majoritynum', nargs='+', type=int, default=[1], help='最多のツイートがあるエリアでの最小ツイート数')
+    parser.add_argument('--min-totalnum', nargs='+', type=int, default=[1], help='最小総ツイート数')
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--prefix', default='homelocation')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    for path in main(parse_args()):
+        print(path, file=sys.stderr)
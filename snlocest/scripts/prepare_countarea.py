@@ -4,25 +4,35 @@
 ユーザごとにエリアIDの出現数を数える
 
 input:
-エリアIDの付いたツイートデータ
-status_id, user_id, area_id
+エリアIDの付いたツイートデータ (areamatcher.pyの出力。.gzも可)
+status_id, user_id, area_id[, area_id, ...]
+（エリアIDが複数あるときは最初のエリアIDを使う）
 
 output:
-
+count, user_id, area_id のTSV ("user_id\tarea_id" の文字列の順)
+--npyを付けると、(user_id, area_id, count) の配列を.npyの形式で出力する (snlocest.areacount)
 '''
 
-from subprocess import run
+import gzip
+from snlocest.areacount import read_area_matches, count_pairs, save_counts, write_count_tsv
 
 
 def main(args):
-    awk = '''BEGIN{OFS="\t"}{print $1,$2,$3}'''
-    run("cat {} | cut -f 2,3 | LC_ALL=C sort | LC_ALL=C uniq -c | awk '{}' > {}".format(args.infile, awk, args.outfile), shell=True, check=True)
+    with (gzip.open(args.infile, 'rb') if args.infile.endswith('.gz') else open(args.infile, 'rb')) as fp:
+        users, areas = read_area_matches(fp)
+    counts = count_pairs(users, areas)
+    if args.npy:
+        save_counts(args.outfile, counts)
+    else:
+        with open(args.outfile, 'w') as fp:
+            write_count_tsv(counts, fp)
 
 def parse_args():
     import argparse
     parser = argparse.ArgumentParser(description='ユーザごとにエリアIDの出現数を数える')
     parser.add_argument('--infile', help='ユーザIDとエリアIDの組のTSV', default='/dev/stdin')
     parser.add_argument('--outfile', help='出力ファイル名', default='/dev/stdout')
+    parser.add_argument('--npy', action='store_true', default=False, help='.npyの形式で出力する')
     return parser.parse_args()
 
 if __name__ == '__main__':
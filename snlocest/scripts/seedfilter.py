@@ -11,31 +11,37 @@ src_id, dst_id
 
 userfile: data/geo-datasets/groundtruth_2014.tsv
     1列目がuser_idのTSV
+
+--exclude で、このリストに含まれるユーザのエッジも同時に除外できる (snlocest.idfilter)
 '''
 
 import sys
-import csv
+from snlocest.idfilter import IdFilter, load_ids, filter_lines
 
 def parse_args():
     import argparse
     parser = argparse.ArgumentParser(
         description='ユーザリストに含まれるユーザ同士のエッジを出力する')
     parser.add_argument('edgefile', help='エッジリスト',
-                        type=argparse.FileType('r', encoding='utf-8'), nargs='?', default=sys.stdin)
+                        type=argparse.FileType('rb'), nargs='?', default=sys.stdin.buffer)
     parser.add_argument('userlist', help='ユーザリスト',
-                        type=argparse.FileType('r', encoding='utf-8'))
+                        type=argparse.FileType('rb'))
+    parser.add_argument('--exclude', action='append', default=[], type=argparse.FileType('rb'),
+                        help='除外するユーザのリスト (複数指定可)')
     return parser.parse_args()
 
+def make_filters(args):
+    ids = load_ids(args.userlist)
+    filters = [IdFilter(ids, 0, True), IdFilter(ids, 1, True)]
+    for f in args.exclude:
+        excluded = load_ids(f)
+        filters += [IdFilter(excluded, 0, False), IdFilter(excluded, 1, False)]
+    return filters
+
 def _main():
     args = parse_args()
-
-    ids = {col[0] for col in csv.reader(args.userlist, delimiter='\t')}
-
-    for col in csv.reader(args.edgefile, delimiter='\t'):
-        if col[0] in ids and col[1] in ids:
-            print(*col, sep='\t', file=sys.stdout)
-        #else:
-        #    print('Exclude:', *col, sep='\t', file=sys.stderr)
+    filter_lines(args.edgefile, sys.stdout.buffer, make_filters(args))
+    sys.stdout.flush()
 
 if __name__ == '__main__':
     _main()
@@ -0,0 +1,104 @@
+# coding: utf-8
+
+import argparse
+import gzip
+import shutil
+import subprocess
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from snlocest.areacount import COUNT_DTYPE, count_pairs, load_counts, merge_counts, read_area_matches, save_counts
+import snlocest.scripts.prepare_countarea as prepare_countarea
+
+
+def make_matches(seed, n=3000):
+    '''areamatcher.pyの出力と同じ形式の行'''
+    rnd = np.random.RandomState(seed)
+    users = rnd.choice([5, 12, 100, 123, 1234, 98765432101234567, 1234567890123456789], n)
+    areas = rnd.choice([1101, 13101, 13102, 27100, 9], n)
+    lines = []
+    for i, (u, a) in enumerate(zip(users.tolist(), areas.tolist())):
+        extra = '\t40100' if i % 5 == 0 else ''
+        lines.append('{}\t{}\t{}{}\n'.format(10 ** 17 + i, u, a, extra))
+    return lines, Counter(zip(users.tolist(), areas.tolist()))
+
+
+@pytest.mark.skipif('shutil.which("sort") is None or shutil.which("awk") is None')
+def test_prepare_countarea(tmpdir):
+    lines, _ = make_matches(0)
+    infile = tmpdir.join('matches.tsv')
+    infile.write(''.join(lines))
+
+    # これまでのシェルのパイプラインと同じ出力になる
+    awk = '''BEGIN{OFS="\t"}{print $1,$2,$3}'''
+    expected = subprocess.run("cat {} | cut -f 2,3 | LC_ALL=C sort | LC_ALL=C uniq -c | awk '{}'".format(infile, awk),
+                              shell=True, check=True, stdout=subprocess.PIPE).stdout
+    outfile = tmpdir.join('count.tsv')
+    prepare_countarea.main(argparse.Namespace(infile=str(infile), outfile=str(outfile), npy=False))
+    assert outfile.read_binary() == expected
+
+    # .gzの入力と.npyの出力
+    gzfile = str(tmpdir.join('matches.tsv.gz'))
+    with gzip.open(gzfile, 'wt') as fp:
+        fp.write(''.join(lines))
+    npyfile = str(tmpdir.join('count'))
+    prepare_countarea.main(argparse.Namespace(infile=gzfile, outfile=npyfile, npy=True))
+    counts = load_counts(npyfile)
+    assert np.array_equal(counts, load_counts(str(outfile)))
+    assert counts.dtype == COUNT_DTYPE
+
+
+def test_read_area_matches_truncated(tmpdir):
+    lines, counter = make_matches(1, n=100)
+    infile = tmpdir.join('matches.tsv')
+    # 書き込みが途中で止まった最後の行と空行は読み飛ばす
+    infile.write(''.join(lines) + '\n' + '{}\t{}'.format(10 ** 17, 5))
+    with open(str(infile), 'rb') as fp:
+        users, areas = read_area_matches(fp, blocksize=1000)
+    assert Counter(zip(users.tolist(), areas.tolist())) == counter
+
+
+def test_merge_counts(tmpdir):
+    arrays = []
+    expected = Counter()
+    for seed in range(4):
+        _, c = make_matches(seed, n=500 * (seed + 1))
+        users, areas = zip(*c.keys())
+        counts = count_pairs(users, areas, weights=list(c.values()))
+        path = str(tmpdir.join('count_{}.npy'.format(seed)))
+        save_counts(path, counts)
+        arrays.append(load_counts(path))
+        expected.update(c)
+    arrays.append(np.empty(0, dtype=COUNT_DTYPE))
+
+    for blocksize in [1, 2, 3, 1000]:
+        blocks = list(merge_counts(arrays, blocksize=blocksize))
+        merged = np.concatenate(blocks)
+        keys = list(zip(merged['user_id'].tolist(), merged['area_id'].tolist()))
+        assert keys == sorted(expected)
+        assert dict(zip(keys, merged['count'].tolist())) == expected
+
+
+def test_decompose_date_range():
+    import datetime
+    from snlocest.areacount import decompose_date_range
+    for start, end in [(datetime.date(2015, 12, 30), datetime.date(2017, 3, 2)),
+                       (datetime.date(2016, 1, 1), datetime.date(2016, 1, 1)),
+                       (datetime.date(2016, 2, 1), datetime.date(2016, 3, 1)),
+                       (datetime.date(2016, 1, 15), datetime.date(2018, 1, 1))]:
+        parts = decompose_date_range(start, end)
+        # 区間をつなげると元の範囲の日付になる
+        days = []
+        for (unit, date), (_, next_date) in zip(parts, parts[1:] + [(None, end)]):
+            if unit == 'year':
+                assert (date.month, date.day, next_date) == (1, 1, datetime.date(date.year + 1, 1, 1))
+            elif unit == 'month':
+                assert date.day == 1 and next_date.day == 1 and 28 <= (next_date - date).days <= 31
+            else:
+                assert (next_date - date).days == 1
+            days.extend(date + datetime.timedelta(days=i) for i in range((next_date - date).days))
+        assert days == [start + datetime.timedelta(days=i) for i in range((end - start).days)]
+    assert [unit for unit, _ in decompose_date_range(datetime.date(2016, 1, 15), datetime.date(2018, 1, 1))] == \
+        ['day'] * 17 + ['month'] * 11 + ['year']
@@ -17,3 +17,52 @@ def test_AreaCoordinateData_iter():
         for line, area in zip(fp, areas):
             area_id = int(line.rstrip().split('\t')[0])
             assert area_id == area
+
+
+@pytest.fixture
+def gxmltsv(tmpdir):
+    from shapely.geometry import MultiPolygon, Point
+    path = tmpdir.join('gxml.tsv')
+    shapes = {}
+    lines = []
+    for i in range(20):
+        shape = MultiPolygon([Point(130 + i, 35).buffer(0.3), Point(130 + i, 36).buffer(0.2)])
+        shapes[1000 + i] = shape
+        lines.append('{}\t市{}\t{}\n'.format(1000 + i, i, shape.wkt))
+    path.write_text(''.join(lines), encoding='utf-8')
+    return str(path), shapes
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_AreaData_cache(gxmltsv, lazy, monkeypatch):
+    import snlocest.areadata as areadata
+    path, shapes = gxmltsv
+    first = areadata.AreaData(path)
+    assert os.path.exists(path + '.cache.npz')
+
+    # 2回目はWKTをパースせずにキャッシュから読み込む
+    with monkeypatch.context() as m:
+        m.setattr(areadata.wkt, 'loads', None)
+        cached = areadata.AreaData(path, lazy=lazy)
+        assert list(cached) == list(first) == list(shapes)
+        for (a, name, shape), (b, name2, shape2) in zip(cached.iter_areas(), first.iter_areas()):
+            assert (a, name) == (b, name2)
+            assert shape.equals_exact(shape2, 0) and shape.equals_exact(shapes[a], 0)
+        assert cached.get_areaname(1003) == '市3'
+
+    # 元のファイルが変わったらキャッシュを作り直す
+    with open(path, 'a', encoding='utf-8') as fp:
+        fp.write('2000\t新しい市\t{}\n'.format(shapes[1000].wkt))
+    updated = areadata.AreaData(path, lazy=lazy)
+    assert list(updated)[-1] == 2000
+    assert updated.get_shape(2000).equals_exact(shapes[1000], 0)
+
+    # 内容が同じで更新時刻だけが変わったら (touch)、ハッシュが一致すれば使い、サイズと更新時刻を書き直す
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    with monkeypatch.context() as m:
+        m.setattr(areadata.wkt, 'loads', None)
+        assert list(areadata.AreaData(path, lazy=lazy)) == list(updated)
+        # 次はハッシュも計算しない
+        m.setattr(areadata, '_file_hash', None)
+        assert list(areadata.AreaData(path, lazy=lazy)) == list(updated)
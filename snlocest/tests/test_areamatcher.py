@@ -0,0 +1,115 @@
+# coding: utf-8
+
+import io
+import numpy as np
+import pytest
+from shapely.geometry import Point
+from shapely.ops import unary_union
+
+import snlocest.scripts.areamatcher as matcher
+
+
+@pytest.fixture
+def areas():
+    rnd = np.random.RandomState(0)
+    areas = []
+    for i in range(30):
+        # 2つの円を合わせたPolygonまたはMultiPolygon。エリアどうしは重なることがある
+        circles = [Point(*rnd.uniform(130, 140, 2)).buffer(rnd.uniform(0.2, 2.0)) for _ in range(2)]
+        areas.append((1000 + i, unary_union(circles)))
+    return areas
+
+
+def use_shapely2(shapely2, monkeypatch):
+    '''shapely2=Falseならshapely 1.xの経路 (shapely.vectorized) を使う'''
+    if shapely2 and not matcher._SHAPELY2:
+        pytest.skip('shapely 2 is not installed')
+    if not shapely2:
+        pytest.importorskip('shapely.vectorized')
+    monkeypatch.setattr(matcher, '_SHAPELY2', shapely2)
+
+
+# shapely 2でshapely 1.xの経路を試すと、shapely.vectorizedの非推奨の警告が出る
+SHAPELY_VERSIONS = [
+    True,
+    pytest.param(False, marks=pytest.mark.filterwarnings('ignore:.*shapely.vectorized:DeprecationWarning')),
+]
+
+
+@pytest.mark.parametrize('shapely2', SHAPELY_VERSIONS)
+def test_contains_xy(areas, shapely2, monkeypatch):
+    use_shapely2(shapely2, monkeypatch)
+    rnd = np.random.RandomState(4)
+    x = rnd.uniform(128, 142, 500)
+    y = rnd.uniform(128, 142, 500)
+    for _, polygon in areas[:5]:
+        expected = [polygon.contains(Point(a, b)) for a, b in zip(x.tolist(), y.tolist())]
+        assert matcher._contains_xy(polygon, x, y).tolist() == expected
+
+
+@pytest.mark.parametrize('shapely2', SHAPELY_VERSIONS)
+def test_batch_area_matcher(areas, shapely2, monkeypatch):
+    use_shapely2(shapely2, monkeypatch)
+    rtree = matcher.RtreeAreaMatcher()
+    rtree.insert_from_iterator(iter(areas))
+    batch = matcher.BatchAreaMatcher(iter(areas))
+
+    rnd = np.random.RandomState(1)
+    x = rnd.uniform(128, 142, 2000)
+    y = rnd.uniform(128, 142, 2000)
+    results = batch.contains_many(x, y)
+    assert len(results) == len(x)
+    assert any(len(r) > 1 for r in results)
+    for a, b, r in zip(x.tolist(), y.tolist(), results):
+        assert r == rtree.contains(a, b)
+
+
+def test_iter_chunks():
+    lines = ['{}\t1\t139.0\t35.0\n'.format(i) for i in range(5)]
+    chunks = list(matcher.iter_chunks(iter(lines), 2))
+    assert chunks == [lines[0:2], lines[2:4], lines[4:5]]
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_match_stream(areas, workers):
+    rtree = matcher.RtreeAreaMatcher()
+    rtree.insert_from_iterator(iter(areas))
+    batch = matcher.BatchAreaMatcher(iter(areas))
+
+    rnd = np.random.RandomState(3)
+    lines = []
+    expected = []
+    for i, (a, b) in enumerate(zip(rnd.uniform(128, 142, 3000).tolist(), rnd.uniform(128, 142, 3000).tolist())):
+        if i % 10 == 0:
+            # 座標のないツイートはスキップする
+            lines.append('{}\t{}\tNone\tNone\tNone\tx\n'.format(i, i % 7))
+            continue
+        lines.append('{}\t{}\t{!r}\t{!r}\tNone\tx\n'.format(i, i % 7, a, b))
+        results = rtree.contains(a, b)
+        if results:
+            expected.append('\t'.join(map(str, [i, i % 7] + results)) + '\n')
+
+    out = io.StringIO()
+    # 小さいchunksizeで、処理中のchunkの数が上限に達しても入力の順に出力されることを確かめる
+    matcher.match_stream(batch, iter(lines), out, chunksize=97, workers=workers)
+    assert out.getvalue() == ''.join(expected)
+    assert matcher.match_lines(rtree, lines) == ''.join(expected)
+
+
+def test_grid_area_matcher(areas, tmpdir):
+    from snlocest.areagrid import AreaGrid
+    batch = matcher.BatchAreaMatcher(iter(areas))
+    source = tmpdir.join('areas.tsv')
+    source.write('dummy')
+    path = str(tmpdir.join('grid.npz'))
+    grid = AreaGrid.load_or_build(path, str(source), batch, resolution=0.1)
+    assert (grid.cells >= 0).any() and (grid.cells <= -2).any()
+    # 2回目は保存した索引を読み込む
+    loaded = AreaGrid.load_or_build(path, str(source), batch, resolution=0.1)
+    assert loaded.source == grid.source
+    assert np.array_equal(loaded.cells, grid.cells)
+
+    rnd = np.random.RandomState(2)
+    x = rnd.uniform(128, 142, 5000)
+    y = rnd.uniform(128, 142, 5000)
+    assert matcher.GridAreaMatcher(loaded, batch).contains_many(x, y) == batch.contains_many(x, y)
@@ -0,0 +1,120 @@
+# coding: utf-8
+
+'''
+CSRの配列を使ったまとめての推定が、1ノードずつの推定と同じ結果になるか
+'''
+
+import random
+import numpy as np
+import pytest
+
+from snlocest.graph import ArrayCSRGraph, CSRGraph, SpMatLikeDOLGraph, gather_rows
+from snlocest.util import load_dataset
+from snlocest.methods import MajorityVote, GeometricMedian, RandomNeighbor, ProbabilityModel
+
+
+@pytest.fixture
+def dataset(tmpdir):
+    rnd = random.Random(0)
+    users = [str(10000 + i) for i in range(300)]
+    areas = [1101, 1102, 13101, 13102, 23201]
+    edges = sorted({(rnd.choice(users), rnd.choice(users)) for _ in range(2000)})
+    edgefile = tmpdir.join('edges.tsv')
+    edgefile.write(''.join('{}\t{}\n'.format(u, v) for u, v in edges))
+    labelfile = tmpdir.join('labels.tsv')
+    labelfile.write(''.join('{}\t{}\n'.format(u, rnd.choice(areas)) for u in users[:200]))
+    return str(edgefile), str(labelfile)
+
+
+def distfunc(a1, a2):
+    return abs(a1 - a2)
+
+
+def predict_all(Graph, edgefile, labelfile):
+    graph, x, y = load_dataset(edgefile, labelfile, Graph)
+    x = np.asarray(x)
+    y = np.asarray(y)
+    train = np.arange(len(x)) % 3 != 0
+    names = graph.vto_nodename(x[~train])
+    results = {}
+    for Method in [MajorityVote, GeometricMedian, RandomNeighbor, ProbabilityModel]:
+        params = {'network': graph}
+        if Method == GeometricMedian or Method == ProbabilityModel:
+            params['distfunc'] = distfunc
+        clf = Method(**params).fit(x[train], y[train])
+        predicted = clf.predict(x[~train])
+        results[Method.__name__] = sorted(zip(names, [int(p) for p in predicted],
+                                              [tuple(r) for r in clf.results]))
+    return results
+
+
+def test_gather_rows():
+    indptr = np.array([0, 2, 2, 5])
+    indices = np.array([1, 2, 0, 1, 2])
+    flat, offsets = gather_rows(indptr, indices, [2, 1, 0])
+    assert flat.tolist() == [0, 1, 2, 1, 2]
+    assert offsets.tolist() == [0, 3, 3, 5]
+
+
+def test_batch_predict(dataset):
+    expected = predict_all(SpMatLikeDOLGraph, *dataset)
+    for Graph in [CSRGraph, ArrayCSRGraph]:
+        actual = predict_all(Graph, *dataset)
+        for name in expected:
+            assert len(expected[name]) == len(actual[name])
+            for e, a in zip(expected[name], actual[name]):
+                # ProbabilityModelのscoreはベクトル化した計算で最下位ビットが異なることがある
+                assert e[:2] == a[:2], (Graph.__name__, name)
+                assert e[2] == pytest.approx(a[2]), (Graph.__name__, name)
+
+
+def test_predict_parallel(dataset):
+    for Graph in [SpMatLikeDOLGraph, ArrayCSRGraph]:
+        graph, x, y = load_dataset(dataset[0], dataset[1], Graph)
+        x = np.asarray(x)
+        y = np.asarray(y)
+        for Method in [MajorityVote, GeometricMedian]:
+            params = {'network': graph}
+            if Method == GeometricMedian:
+                params['distfunc'] = distfunc
+            clf = Method(**params).fit(x, y)
+            expected = clf.predict(x)
+            expected_results = clf.results
+            assert clf.predict_parallel(x, n_jobs=3, chunksize=7) == expected
+            assert clf.results == expected_results
+
+
+def test_loo_predict(dataset):
+    for Graph in [SpMatLikeDOLGraph, ArrayCSRGraph]:
+        graph, x, y = load_dataset(dataset[0], dataset[1], Graph)
+        x = np.asarray(x)
+        y = np.asarray(y)
+        clf = MajorityVote(graph).fit(x, y)
+        predicted = clf.loo_predict(x)
+        results = clf.results
+        # 1つずつ除いて学習し直した結果と一致する
+        for i in range(len(x)):
+            train = np.arange(len(x)) != i
+            loo = MajorityVote(graph).fit(x[train], y[train])
+            assert [predicted[i]] == loo.predict(x[i:i+1]), (Graph.__name__, i)
+            assert [results[i]] == loo.results, (Graph.__name__, i)
+
+
+def test_predict_heldout(dataset):
+    for Graph in [SpMatLikeDOLGraph, ArrayCSRGraph]:
+        graph, x, y = load_dataset(dataset[0], dataset[1], Graph)
+        x = np.asarray(x)
+        y = np.asarray(y)
+        for Method in [MajorityVote, GeometricMedian, ProbabilityModel]:
+            params = {'network': graph}
+            if Method != MajorityVote:
+                params['distfunc'] = distfunc
+            clf = Method(**params).fit(x, y)
+            for k in range(3):
+                test = np.arange(len(x)) % 3 == k
+                expected = Method(**params).fit(x[~test], y[~test])
+                assert clf.predict_heldout(x[test]) == expected.predict(x[test]), (Graph.__name__, Method.__name__)
+                for e, a in zip(expected.results, clf.results):
+                    assert e == pytest.approx(a)
+            # 推定後はすべてのラベルに戻っている
+            assert clf.predict(x) == Method(**params).fit(x, y).predict(x)
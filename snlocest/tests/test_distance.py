@@ -1,19 +1,23 @@
 # coding: utf-8
 
+import pytest
 import snlocest.distance
+from snlocest.areadata import AreaCoordinateData
+from snlocest.distance import build_area_distance_func, build_area_distance_matrix
 
 
 def test_distance():
-    p1 = (142.323144141, 43.4438109658)
-    p2 = (133.69431925, 34.9088580348)
+    # (lat, lon)
+    p1 = (43.4438109658, 142.323144141)
+    p2 = (34.9088580348, 133.69431925)
     assert snlocest.distance.distance == snlocest.distance.vincenty
-    assert snlocest.distance.distance(p1, p2) == 1189576.2558712678
-    assert snlocest.distance.vincenty(p1, p2) == 1189576.2558712678
-    assert snlocest.distance.hubeny(p1, p2) == 1191114.9125639815
+    assert snlocest.distance.distance(p1, p2) == 1204281.0639125751
+    assert snlocest.distance.vincenty(p1, p2) == 1204281.0639125751
+    assert snlocest.distance.hubeny(p1, p2) == 1205732.2217948579
 
 def test_cache():
-    p1 = (142.323144141, 43.4438109658)
-    p2 = (133.69431925, 34.9088580348)
+    p1 = (43.4438109658, 142.323144141)
+    p2 = (34.9088580348, 133.69431925)
 
     snlocest.distance.distance.cache_clear()
     for i in range(10):
@@ -22,3 +26,56 @@ def test_cache():
     info = snlocest.distance.distance.cache_info()
     assert info.hits == 9
     assert info.misses == 1
+
+def test_area_distance_matrix(tmpdir):
+    dbpath = tmpdir.join('area_database.tsv')
+    dbpath.write('1101\t141.354376\t43.062096\t札幌市中央区\n'
+                 '13101\t139.753595\t35.694003\t千代田区\n'
+                 '23201\t137.408818\t34.701704\t豊橋市\n')
+    coord_data = AreaCoordinateData(str(dbpath))
+    cached = build_area_distance_func(coord_data, distfunc=snlocest.distance.hubeny)
+
+    path = str(tmpdir.join('area_distance.npy'))
+    matrix = build_area_distance_matrix(coord_data, path=path, distfunc=snlocest.distance.hubeny)
+    loaded = build_area_distance_matrix(coord_data, path=path, distfunc=snlocest.distance.hubeny)
+    for a1 in coord_data:
+        for a2 in coord_data:
+            assert matrix(a1, a2) == pytest.approx(cached(a1, a2), rel=1e-6)
+            assert loaded(a1, a2) == matrix(a1, a2)
+    with pytest.raises(KeyError):
+        matrix(1101, 1102)
+
+def test_area_distance_matrix_signature(tmpdir, monkeypatch):
+    dbpath = tmpdir.join('area_database.tsv')
+    dbpath.write('1101\t141.354376\t43.062096\t札幌市中央区\n'
+                 '13101\t139.753595\t35.694003\t千代田区\n'
+                 '23201\t137.408818\t34.701704\t豊橋市\n')
+    coord_data = AreaCoordinateData(str(dbpath))
+    path = str(tmpdir.join('area_distance.npy'))
+
+    # エリアの座標は(lon, lat)。ベクトル化したvincentyはbuild_area_distance_funcと同じ
+    matrix = build_area_distance_matrix(coord_data, path=path)
+    cached = build_area_distance_func(coord_data)
+    for a1 in coord_data:
+        for a2 in coord_data:
+            assert matrix(a1, a2) == pytest.approx(cached(a1, a2), rel=1e-6)
+            (lon1, lat1), (lon2, lat2) = coord_data.get_point(a1), coord_data.get_point(a2)
+            assert cached(a1, a2) == snlocest.distance._meter_vincenty((lat1, lon1), (lat2, lon2))
+    # 札幌市中央区と千代田区は約830km
+    assert matrix(1101, 13101) == pytest.approx(829526.48, rel=1e-6)
+
+    # 距離の種類や座標が変われば計算しなおす
+    hubeny = build_area_distance_matrix(coord_data, path=path, distfunc=snlocest.distance.hubeny)
+    assert hubeny(1101, 13101) != matrix(1101, 13101)
+    # 同じなら保存したものを使う
+    with monkeypatch.context() as m:
+        m.setattr(snlocest.distance.AreaDistanceMatrix, 'compute', None)
+        build_area_distance_matrix(coord_data, path=path, distfunc=snlocest.distance.hubeny)
+    coord_data.db[23201] = (137.0, 35.0, '豊橋市')
+    moved = build_area_distance_matrix(coord_data, path=path, distfunc=snlocest.distance.hubeny)
+    assert moved(1101, 23201) != hubeny(1101, 23201)
+    assert moved(1101, 13101) == hubeny(1101, 13101)
+
+    for a1, a2 in [(1101, 99999), (-1, 1101), (1101, -23201)]:
+        with pytest.raises(KeyError):
+            matrix(a1, a2)
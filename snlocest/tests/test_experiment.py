@@ -2,7 +2,7 @@
 
 from sklearn.model_selection import train_test_split
 
-from snlocest.graph import SpMatLikeDOLGraph
+from snlocest.graph import ArrayCSRGraph
 from snlocest.areadata import AreaCoordinateData
 from snlocest.distance import build_area_distance_func
 from snlocest.util import load_dataset
@@ -14,7 +14,7 @@ LABELFILE = 'testdata/test-dataset/groundtruth/labels.tsv'
 
 
 def test_methods():
-    graph, x, y = load_dataset(EDGEFILE, LABELFILE, SpMatLikeDOLGraph)
+    graph, x, y = load_dataset(EDGEFILE, LABELFILE, ArrayCSRGraph)
     x_train, x_test, y_train, y_test = train_test_split(x, y, random_state=123)
 
     coord_data = AreaCoordinateData()
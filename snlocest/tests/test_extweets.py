@@ -0,0 +1,96 @@
+# coding: utf-8
+
+import codecs
+import gzip
+import io
+import json
+
+import pytest
+
+import snlocest.scripts.extweets as extweets
+
+
+def make_tweet(i, **kwargs):
+    tweet = {'id': 10 ** 17 + i, 'id_str': str(10 ** 17 + i), 'created_at': 'Mon Jan 0{} 00:00:00 +0000 2018'.format(i % 9 + 1),
+             'text': 'ツイート{}'.format(i), 'source': 'client',
+             'user': {'id_str': str(i), 'name': '名前', 'screen_name': 'user{}'.format(i), 'description': None},
+             'coordinates': {'coordinates': [139.70000000000002 + i, 35.1 + i * 1e-7]},
+             'place': {'id': 'place{}'.format(i)}}
+    tweet.update(kwargs)
+    return json.dumps(tweet, ensure_ascii=False)
+
+
+def tweet_lines():
+    '''gzip -dc | cut -f 2 したあとの行'''
+    lines = [make_tweet(i).encode('utf-8') for i in range(5)]
+    lines += [
+        make_tweet(10, coordinates=None, place=None).encode('utf-8'),
+        make_tweet(11, coordinates={'coordinates': [140, 36]}).encode('utf-8'),
+        # フィルタされる
+        make_tweet(12, source='NightFoxDuo').encode('utf-8'),
+        make_tweet(13, user={'id_str': '13', 'name': 'bot', 'screen_name': '', 'description': ''}).encode('utf-8'),
+        make_tweet(14).replace('"user"', '"usr"').encode('utf-8'),
+        # 取り出せない (stderrに出力する)
+        make_tweet(15).replace('"created_at"', '"created"').encode('utf-8'),
+        # UTF-8として不正なバイト
+        make_tweet(16).encode('utf-8').replace('ツイート'.encode('utf-8'), b'\xe3\x83\xff\xe3\x83\x84'),
+        # str.splitlines()で行が分かれる文字
+        make_tweet(17).encode('utf-8').replace('ツイート'.encode('utf-8'), ' '.encode('utf-8')),
+        make_tweet(18).encode('utf-8') + ' '.encode('utf-8') + make_tweet(19).encode('utf-8'),
+        make_tweet(20).encode('utf-8') + b'\r',
+        make_tweet(21).encode('utf-8') + b'\x0c' + make_tweet(22).encode('utf-8'),
+        # orjsonではパースできない
+        make_tweet(23, score=float('nan')).encode('utf-8'),
+        make_tweet(24, big=2 ** 70).encode('utf-8'),
+        make_tweet(25).encode('utf-8') + '　'.encode('utf-8'),
+        b'{"broken": ',
+        b'',
+        make_tweet(26).encode('utf-8'),
+    ]
+    return lines
+
+
+def extract_original(data):
+    '''これまでのextweets.pyと同じく標準入力から読んだときの出力'''
+    infile = codecs.getreader('utf-8')(io.BytesIO(data), errors='ignore')
+    outfile = io.StringIO()
+    for tweet in filter(extweets.tweet_filter, extweets.parse_tweet(infile)):
+        extweets.print_extract(tweet, outfile=outfile)
+    return outfile.getvalue().encode('utf-8')
+
+
+@pytest.mark.parametrize('use_orjson', [True, False])
+def test_extract_stream(use_orjson, monkeypatch):
+    if use_orjson and extweets.orjson is None:
+        pytest.skip('orjson is not installed')
+    if not use_orjson:
+        monkeypatch.setattr(extweets, 'orjson', None)
+    data = b'\n'.join(tweet_lines())
+    expected = extract_original(data)
+    assert expected.count(b'\n') == 17
+
+    out = io.BytesIO()
+    extweets.extract_stream(io.BytesIO(data), out)
+    assert out.getvalue() == expected
+
+    # 小さいブロックで読んでも同じ
+    lines = [l for block in extweets.iter_blocks(io.BytesIO(data), blocksize=7) for l in block]
+    assert extweets.extract_lines(lines) == expected
+
+
+def test_extract_files(tmpdir):
+    lines = tweet_lines()
+    pairs = []
+    expected = []
+    for k in range(3):
+        inpath = str(tmpdir.join('json_{}.txt.gz'.format(k)))
+        with gzip.open(inpath, 'wb') as fp:
+            # 1列目はcut -f 2で除かれる
+            fp.write(b''.join(b'2018-01-01\t' + l + b'\n' for l in lines[k:]))
+        pairs.append((inpath, str(tmpdir.join('out_{}.tsv.gz'.format(k)))))
+        expected.append(extract_original(b'\n'.join(lines[k:]) + b'\n'))
+
+    extweets.extract_files(pairs, workers=2)
+    for (_, outpath), e in zip(pairs, expected):
+        with gzip.open(outpath, 'rb') as fp:
+            assert fp.read() == e
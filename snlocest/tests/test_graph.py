@@ -2,7 +2,7 @@
 
 import numpy as np
 import pytest
-from snlocest.graph import CSRGraph, DictOfListGraph, SpMatLikeDOLGraph
+from snlocest.graph import CSRGraph, DictOfListGraph, SpMatLikeDOLGraph, Int64CSRGraph, ArrayCSRGraph
 
 TEST_EDGEFILE = 'testdata/test-dataset/networks/f_follower.tsv'
 #TEST_EDGEFILE = 'testdata/test-dataset/networks/f_mutual.tsv'
@@ -94,3 +94,197 @@ def test_graph_size():
     for i in range(62676854):
         g.add_edge(str(i), str(i+1))
     assert g.num_nodes == 62676855
+
+def test_Int64CSRGraph(tmpdir):
+    edgefile = tmpdir.join('edges.tsv')
+    edgefile.write('300\t100\n100\t300\n100\t200\n200\t400\n5000000000\t100\n')
+    labelfile = tmpdir.join('labels.tsv')
+    labelfile.write('100\t13101\n700\t1101\n5000000000\t23201\n')
+
+    g1 = CSRGraph().load_edgelist(str(edgefile)).load_labellist(str(labelfile))
+    g2 = Int64CSRGraph().load_edgelist(str(edgefile)).load_labellist(str(labelfile))
+    assert g2.nodes.dtype == np.int64
+    assert sorted(int(n) for n in g1.nodes) == g2.nodes.tolist()
+    assert g1.num_nodes == g2.num_nodes
+    assert g1.num_edges == g2.num_edges
+    for u in g1.nodes:
+        assert sorted(int(n) for n in g1.neighbors(u)) == sorted(g2.neighbors(int(u)).tolist())
+        i = g2.to_nodeidx(u)
+        assert g2.to_nodename(i) == int(u)
+        assert sorted(g2.vto_nodename(g2.getrow(i)).tolist()) == sorted(g2.neighbors(u).tolist())
+    assert g2.to_nodeidx(700) == g2.nodes.tolist().index(700)
+    with pytest.raises(KeyError):
+        g2.to_nodeidx(999)
+
+def test_save_open(tmpdir):
+    edgefile = tmpdir.join('edges.tsv')
+    edgefile.write('300\t100\n100\t300\n100\t200\n200\t400\n5000000000\t100\n')
+    labelfile = tmpdir.join('labels.tsv')
+    labelfile.write('100\t13101\n700\t1101\n5000000000\t23201\n')
+
+    for Graph in [CSRGraph, Int64CSRGraph]:
+        path = str(tmpdir.join(Graph.__name__))
+        g1 = Graph().load_edgelist(str(edgefile)).load_labellist(str(labelfile)).save(path)
+        g2 = CSRGraph.open(path)
+        assert type(g2) == Graph
+        assert list(g1.nodes) == list(g2.nodes)
+        assert list(g1.labeled_nodes) == list(g2.labeled_nodes)
+        assert list(g1.labels) == list(g2.labels)
+        assert g1.num_edges == g2.num_edges
+        assert g1.shape == g2.shape
+        for u in g1.nodes:
+            assert list(g1.neighbors(u)) == list(g2.neighbors(u))
+            assert list(g1.getrow(g1.to_nodeidx(u))) == list(g2.getrow(g2.to_nodeidx(u)))
+
+def test_CSRGraph_neighbors_many(tmpdir):
+    edgefile = tmpdir.join('edges.tsv')
+    edgefile.write('300\t100\n100\t300\n100\t200\n200\t400\n5000000000\t100\n')
+    for Graph in [CSRGraph, Int64CSRGraph]:
+        g = Graph().load_edgelist(str(edgefile))
+        rows = list(range(g.num_nodes))[::-1]
+        flat, offsets = g.neighbors_many(rows)
+        assert len(offsets) == len(rows) + 1
+        for k, i in enumerate(rows):
+            assert flat[offsets[k]:offsets[k+1]].tolist() == g.getrow(i).tolist()
+            u = g.to_nodename(i)
+            assert g.neighbor_indices(u).tolist() == g.getrow(i).tolist()
+            assert list(g.neighbors(u)) == list(g.vto_nodename(g.getrow(i)))
+        with pytest.raises(IndexError):
+            g.neighbors('999')
+
+def test_ArrayCSRGraph(tmpdir):
+    edgefile = tmpdir.join('edges.tsv')
+    edgefile.write('300\t100\n100\t300\n100\t200\n200\t400\n5000000000\t100\n100\t200\n')
+    labelfile = tmpdir.join('labels.tsv')
+    labelfile.write('100\t13101\n700\t1101\n5000000000\t23201\n')
+
+    g1 = SpMatLikeDOLGraph().load_edgelist(str(edgefile)).load_labellist(str(labelfile))
+    g2 = ArrayCSRGraph().load_edgelist(str(edgefile)).load_labellist(str(labelfile))
+    assert g2.getrow(0).dtype == np.int32
+    assert sorted(g1.nodes) == sorted(g2.nodes)
+    assert CSRGraph().load_edgelist(str(edgefile)).num_edges == g2.num_edges
+    assert g2.shape == (len(g1.nodes), len(g1.nodes))
+    assert list(g1.labels) == list(g2.labels)
+    for u in g1.nodes:
+        n1 = g1.vto_nodename(g1.getrow(g1.to_nodeidx(u)))
+        n2 = g2.vto_nodename(g2.getrow(g2.to_nodeidx(u)))
+        assert list(n1) == list(n2)
+        assert g2.to_nodename(g2.to_nodeidx(u)) == u
+    rows = g2.vto_nodeidx(g2.labeled_nodes)
+    flat, offsets = g2.neighbors_many(rows)
+    for k, i in enumerate(rows):
+        assert flat[offsets[k]:offsets[k+1]].tolist() == g2.getrow(i).tolist()
+
+def test_follow_networks(tmpdir):
+    import argparse
+    from collections import Counter
+    import snlocest.scripts.buildnetworks as buildnetworks
+    from snlocest.graph import FOLLOW_NETWORKS
+
+    rnd = np.random.RandomState(0)
+    users = [3, 15, 100, 101, 999, 5000000000, 5000000001, 7]
+    # MasterFollowEdgelistはsort -uしたもの (自己ループもありうる)
+    edges = sorted({(users[i], users[j]) for i, j in rnd.choice(len(users), (40, 2)).tolist()} | {(15, 15)})
+    edgefile = tmpdir.join('master.tsv')
+    edgefile.write(''.join('{}\t{}\n'.format(u, v) for u, v in edges))
+    labelfile = tmpdir.join('labels.tsv')
+    labelfile.write('100\t13101\n700\t1101\n5000000000\t23201\n')
+
+    # これまでのawk, sort, uniqで作っていたエッジリスト
+    both = Counter([(u, v) for u, v in edges] + [(v, u) for u, v in edges])
+    expected = {
+        'mutual': sorted(e for e, c in both.items() if c >= 2),
+        'linked': sorted(both),
+        'follower': [(v, u) for u, v in edges],
+        'followee': edges,
+    }
+    args = argparse.Namespace(edgefile=str(edgefile), labelfile=str(labelfile),
+                              **{n: str(tmpdir.join(n + '.graph')) for n in FOLLOW_NETWORKS})
+    buildnetworks.main(args)
+    for name in FOLLOW_NETWORKS:
+        tsv = tmpdir.join(name + '.tsv')
+        tsv.write(''.join('{}\t{}\n'.format(u, v) for u, v in expected[name]))
+        g1 = Int64CSRGraph().load_edgelist(str(tsv)).load_labellist(str(labelfile))
+        g2 = CSRGraph.open(getattr(args, name))
+        assert type(g2) == Int64CSRGraph
+        for attr in ['nodes', 'labeled_nodes', 'labels', 'indptr', 'indices']:
+            assert np.asarray(getattr(g1, attr)).tolist() == np.asarray(getattr(g2, attr)).tolist(), (name, attr)
+        assert g1._adjmat.data.tolist() == g2._adjmat.data.tolist()
+
+def test_load_dataset_labelfile(tmpdir):
+    from snlocest.util import load_dataset
+    edgefile = tmpdir.join('edges.tsv')
+    edgefile.write('300\t100\n100\t300\n100\t200\n200\t400\n5000000000\t100\n')
+    labelfile = tmpdir.join('labels.tsv')
+    labelfile.write('100\t13101\n700\t1101\n5000000000\t23201\n')
+    other = tmpdir.join('labels_other.tsv')
+    other.write('300\t27100\n200\t1101\n')
+
+    path = str(tmpdir.join('graph'))
+    Int64CSRGraph().load_edgelist(str(edgefile)).load_labellist(str(labelfile)).save(path)
+    # 保存したラベルと違う正解データを渡せば、そのラベルを使う
+    graph, x, y = load_dataset(path, str(other), None)
+    assert graph.vto_nodename(x).tolist() == [300, 200]
+    assert list(y) == [27100, 1101]
+    graph, x, y = load_dataset(path, None, None)
+    assert list(y) == [13101, 1101, 23201]
+
+def test_load_dataset_graphclass(tmpdir):
+    from snlocest.util import load_dataset
+    edgefile = tmpdir.join('edges.tsv')
+    edgefile.write('300\t100\n100\t200\n')
+    labelfile = tmpdir.join('labels.tsv')
+    labelfile.write('100\t13101\n')
+    graph, x, y = load_dataset(str(edgefile), str(labelfile))
+    assert isinstance(graph, ArrayCSRGraph)
+
+    path = str(tmpdir.join('graph'))
+    Int64CSRGraph().load_edgelist(str(edgefile)).save(path)
+    for Graph in (None, CSRGraph, Int64CSRGraph):
+        graph, x, y = load_dataset(path, str(labelfile), Graph)
+        assert isinstance(graph, Int64CSRGraph)
+    # 変換したグラフは指定したクラスで読み込めないので、黙って無視せずにエラーにする
+    for Graph in (ArrayCSRGraph, DictOfListGraph):
+        with pytest.raises(ValueError):
+            load_dataset(path, str(labelfile), Graph)
+
+def _is_memmapped(a):
+    # csr_matrixはnp.memmapをndarrayのviewにするので、baseをたどって調べる
+    while a is not None:
+        if isinstance(a, np.memmap):
+            return True
+        a = a.base
+    return False
+
+def test_load_dataset_keeps_memmap(tmpdir):
+    from snlocest.util import load_dataset
+    edgefile = tmpdir.join('edges.tsv')
+    edgefile.write('300\t100\n100\t300\n100\t200\n200\t400\n')
+    labelfile = tmpdir.join('labels.tsv')
+    labelfile.write('100\t13101\n300\t1101\n')
+    # 700はグラフにないラベル付きノード
+    other = tmpdir.join('labels_other.tsv')
+    other.write('200\t27100\n700\t1101\n')
+    for Graph in (CSRGraph, Int64CSRGraph):
+        path = str(tmpdir.join(Graph.__name__))
+        Graph().load_edgelist(str(edgefile)).load_labellist(str(labelfile)).save(path)
+        for labels, n_nodes in ((labelfile, 4), (other, 5)):
+            graph, x, y = load_dataset(path, str(labels), None)
+            # ラベルを読み直しても隣接行列の配列をコピーしない
+            assert _is_memmapped(graph._adjmat.indices)
+            assert _is_memmapped(graph._adjmat.data)
+            assert graph.shape == (n_nodes, n_nodes)
+            assert graph.num_edges == 4
+            assert [str(n) for n in graph.vto_nodename(x)] == [line.split('\t')[0] for line in labels.readlines()]
+            neighbors = {'100': ['200', '300'], '200': ['400']}
+            assert sorted(str(n) for n in graph.neighbors(graph.vto_nodename(x)[0])) == neighbors[str(graph.vto_nodename(x)[0])]
+            assert len(graph.getrow(x[-1])) == (0 if labels is other else 1)
+
+def test_int_adj_matrix_duplicates(tmpdir):
+    from snlocest.graph import load_int_adj_matrix
+    # 重複したエッジが多くても重みがあふれない
+    edgefile = tmpdir.join('edges.tsv')
+    edgefile.write('1\t2\n' * 300 + '2\t1\n')
+    adj, nodes = load_int_adj_matrix(str(edgefile))
+    assert adj.tocsr()[0, 1] == 300
+    assert Int64CSRGraph().load_edgelist(str(edgefile)).num_edges == 301
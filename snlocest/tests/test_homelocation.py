@@ -0,0 +1,89 @@
+# coding: utf-8
+
+import argparse
+import io
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from snlocest.areacount import COUNT_DTYPE, save_counts
+from snlocest.homelocation import (majority_frame, iter_majority_sorted, majority_chunked, home_table, home_table_sorted,
+                                   save_home_table, load_home_table, homelocation_filename)
+import snlocest.scripts.decidehomelocation as decidehomelocation
+import snlocest.scripts.materialize_homelocation as materialize_homelocation
+
+
+@pytest.fixture
+def aggregated():
+    '''agg_count.pyの出力 (user_id, count, area_id) の行。最多のエリアが複数あるユーザもいる'''
+    rnd = np.random.RandomState(0)
+    rows = []
+    for user in np.unique(rnd.randint(1, 10 ** 12, 300)).tolist():
+        areas = rnd.choice([1101, 13101, 13102, 27100, 40130], rnd.randint(1, 5), replace=False)
+        for area in areas.tolist():
+            rows.append((user, int(rnd.randint(1, 4)), area))
+    expected = {}
+    per_user = defaultdict(list)
+    for user, count, area in rows:
+        per_user[user].append((count, area))
+    for user, values in per_user.items():
+        count, area = max(values, key=lambda v: (v[0], -v[1]))
+        expected[user] = (area, count, sum(c for c, _ in values))
+    assert any(sum(1 for c, _ in v if c == max(v)[0]) > 1 for v in per_user.values())
+    return rows, expected
+
+
+def test_majority(aggregated, tmpdir):
+    rows, expected = aggregated
+    df = pd.DataFrame(rows, columns=['user_id', 'count', 'area_id'])
+    result = majority_frame(df)
+    assert {u: (a, c, t) for u, a, c, t in result[['area_id', 'count', 'total']].itertuples()} == expected
+
+    lines = ['{}\t{}\t{}\n'.format(*row) for row in sorted(rows, key=lambda r: str(r[0]))]
+    assert {int(u): (int(a), c, t) for u, a, c, t in iter_majority_sorted(lines)} == expected
+
+    # ソートされていない入力を小さいchunkで読む
+    rnd = np.random.RandomState(1)
+    shuffled = np.array(rows, dtype=np.int64)[rnd.permutation(len(rows))]
+    chunks = [(c[:, 0], c[:, 2], c[:, 1]) for c in np.array_split(shuffled, 17)]
+    users, areas, counts, totals = majority_chunked(chunks)
+    assert list(users) == sorted(expected)
+    assert {u: (a, c, t) for u, a, c, t in zip(users.tolist(), areas.tolist(), counts.tolist(), totals.tolist())} == expected
+
+    # agg_count.py --npy の出力
+    counts = np.zeros(len(rows), dtype=COUNT_DTYPE)
+    counts['user_id'], counts['count'], counts['area_id'] = shuffled[:, 0], shuffled[:, 1], shuffled[:, 2]
+    path = str(tmpdir.join('agg.npy'))
+    save_counts(path, counts)
+    args = argparse.Namespace(min_majoritynum=2, min_totalnum=3)
+    out = io.StringIO()
+    decidehomelocation.process_chunked(decidehomelocation.iter_chunks(path, 50), args, out)
+    stream_out = io.StringIO()
+    decidehomelocation.process_stream(lines, args, stream_out)
+    filtered = {u for u, (a, c, t) in expected.items() if c >= 2 and t >= 3}
+    assert sorted(out.getvalue().splitlines()) == sorted(stream_out.getvalue().splitlines())
+    assert {int(l.split('\t')[0]) for l in out.getvalue().splitlines()} == filtered
+
+
+def test_materialize_thresholds(aggregated, tmpdir):
+    rows, _ = aggregated
+    lines = ['{}\t{}\t{}\n'.format(*row) for row in sorted(rows, key=lambda r: str(r[0]))]
+    table = home_table_sorted(lines, chunksize=7)
+    path = str(tmpdir.join('table.npy'))
+    save_home_table(path, table)
+    chunks = [(c[:, 0], c[:, 2], c[:, 1]) for c in np.array_split(np.array(rows, dtype=np.int64), 5)]
+    assert np.array_equal(np.sort(table), home_table(*majority_chunked(chunks)))
+
+    # すべての組み合わせを1度に出力したものが、しきい値ごとにdecidehomelocation.pyで出力したものと同じ
+    args = argparse.Namespace(table=path, min_majoritynum=[1, 2, 3], min_totalnum=[1, 4],
+                              output_dir=str(tmpdir), prefix='2016-01-01-2016-02-01')
+    paths = materialize_homelocation.main(args)
+    assert len(paths) == 6
+    for m in args.min_majoritynum:
+        for t in args.min_totalnum:
+            out = io.StringIO()
+            decidehomelocation.process_stream(lines, argparse.Namespace(min_majoritynum=m, min_totalnum=t), out)
+            assert tmpdir.join(homelocation_filename(args.prefix, m, t)).read() == out.getvalue()
+    assert len(load_home_table(path)) == len(table)
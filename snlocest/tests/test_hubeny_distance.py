@@ -0,0 +1,34 @@
+# coding: utf-8
+
+import math
+import numpy as np
+from snlocest.hubeny_distance import hubeny_distance, hubeny_distance_radian
+from snlocest.hubeny_distance import hubeny_distance_array, hubeny_distance_pairwise
+
+
+C1 = [(36.10056, 140.09111), (43.062096, 141.354376), (26.212401, 127.680932)]
+C2 = [(35.65500, 139.74472), (34.701704, 137.408818)]
+
+
+def test_hubeny_distance_array():
+    lat1, lon1 = np.radians(np.array(C1)).T
+    lat2, lon2 = np.radians(np.array(C2[:1] * len(C1))).T
+    dists = hubeny_distance_array(lat1, lon1, lat2, lon2)
+    assert dists.shape == (len(C1),)
+    for i, d in enumerate(dists):
+        expected = hubeny_distance_radian(lat1[i], lon1[i], lat2[i], lon2[i])
+        assert math.isclose(d, expected, rel_tol=1e-12)
+
+def test_hubeny_distance_broadcast():
+    lat1, lon1 = np.radians(C1[0])
+    lat2, lon2 = np.radians(np.array(C2)).T
+    dists = hubeny_distance_array(lat1, lon1, lat2, lon2)
+    assert np.allclose(dists, [hubeny_distance(C1[0], c) for c in C2], rtol=1e-12)
+
+def test_hubeny_distance_pairwise():
+    dists = hubeny_distance_pairwise(C1, C2)
+    assert dists.shape == (len(C1), len(C2))
+    for i, c1 in enumerate(C1):
+        for j, c2 in enumerate(C2):
+            assert math.isclose(dists[i, j], hubeny_distance(c1, c2), rel_tol=1e-12)
+    assert np.allclose(np.diag(hubeny_distance_pairwise(C1, C1)), 0)
@@ -0,0 +1,103 @@
+# coding: utf-8
+
+import io
+
+import numpy as np
+
+from snlocest.idfilter import IdFilter, IdSet, load_ids, filter_lines
+
+
+def make_edges(seed, n=2000):
+    rnd = np.random.RandomState(seed)
+    users = [1, 12, 123, 9999, 10 ** 17 + 5, 1234567890123456789]
+    lines = []
+    for i in range(n):
+        src, dst = rnd.choice(len(users), 2)
+        extra = '\t{}'.format(i) if i % 3 == 0 else ''
+        lines.append('{}\t{}{}\n'.format(users[src], users[dst], extra))
+    return users, lines
+
+
+def expected_lines(lines, conditions):
+    '''conditions: (ids, column, include) のリスト (idsは文字列の集合)'''
+    result = []
+    for line in lines:
+        cols = line.rstrip('\n').split('\t')
+        if not cols[0]:
+            continue
+        if all((c < len(cols) and cols[c] in ids) == include for ids, c, include in conditions):
+            result.append(line.rstrip('\n') + '\n')
+    return ''.join(result)
+
+
+def run_filter(lines, filters, blocksize):
+    out = io.BytesIO()
+    filter_lines(io.BytesIO(''.join(lines).encode()), out, filters, blocksize=blocksize)
+    return out.getvalue().decode()
+
+
+def test_filter_lines():
+    users, lines = make_edges(0)
+    seed = {str(u) for u in users[:4]}
+    unknown = {str(users[1]), str(users[5])}
+    seed_ids = load_ids(io.BytesIO(''.join('{}\tname\n'.format(u) for u in seed).encode()))
+    unknown_ids = load_ids(io.BytesIO(''.join('{}\n'.format(u) for u in unknown).encode()))
+    assert seed_ids.array is not None and len(seed_ids) == 4
+
+    cases = [
+        ([IdFilter(unknown_ids, 0, False)], [(unknown, 0, False)]),
+        ([IdFilter(seed_ids, 1, True)], [(seed, 1, True)]),
+        # unknownの除外とseedの抽出を1度に
+        ([IdFilter(unknown_ids, 0, False), IdFilter(seed_ids, 0, True)], [(unknown, 0, False), (seed, 0, True)]),
+        # 両端 (seedfilter.py)
+        ([IdFilter(seed_ids, 0, True), IdFilter(seed_ids, 1, True)], [(seed, 0, True), (seed, 1, True)]),
+        ([IdFilter(IdSet([]), 0, True)], [(set(), 0, True)]),
+    ]
+    # 最後の行は改行で終わらない
+    lines[-1] = lines[-1].rstrip('\n')
+    for filters, conditions in cases:
+        expected = expected_lines(lines, conditions)
+        assert len(expected) < len(''.join(lines))
+        for blocksize in [64, 1000, 1 << 20]:
+            assert run_filter(lines, filters, blocksize) == expected
+
+
+def test_filter_lines_fallback():
+    # 数字でないIDや空行、CRLF、列の足りない行は1行ずつ調べる
+    lines = ['user_id\tfriend\n', '1\t2\n', '\n', '2\r\n', 'abc\t1\n', '3\t1\n', '01\t1\n']
+    ids = IdSet([b'1', b'2', b'abc'])
+    assert run_filter(lines, [IdFilter(ids, 0, True)], 1 << 20) == '1\t2\n2\nabc\t1\n'
+    assert run_filter(lines, [IdFilter(ids, 1, False)], 5) == 'user_id\tfriend\n2\n'
+    # 先頭に0のあるIDは整数にせず、文字列のまま調べる
+    zero = IdSet([b'01'])
+    assert zero.array is None
+    assert run_filter(lines, [IdFilter(zero, 0, True)], 1 << 20) == '01\t1\n'
+
+
+def test_filter_lines_one_column():
+    # タブのない1列だけの入力 (IDリスト)
+    ids = IdSet([b'1', b'3'])
+    assert run_filter(['1\n', '2\n', '3\n'], [IdFilter(ids, 0, True)], 1 << 20) == '1\n3\n'
+    assert run_filter(['1\n', '2\n', '3'], [IdFilter(ids, 0, False)], 4) == '2\n'
+    # 2列目を調べるときは、列のない行は含まれないものとする
+    assert run_filter(['1\n', '3\n'], [IdFilter(ids, 1, False)], 1 << 20) == '1\n3\n'
+
+
+def test_filter_lines_leading_zero():
+    # 先頭に0のあるIDは、まとめて調べるときも文字列のまま比べる (01 と 1 は別のID)
+    ids = IdSet([b'1', b'0'])
+    lines = ['01\t5\n', '1\t5\n', '0\t5\n', '001\t1\n']
+    for blocksize in [4, 1 << 20]:
+        assert run_filter(lines, [IdFilter(ids, 0, True)], blocksize) == '1\t5\n0\t5\n'
+        assert run_filter(lines, [IdFilter(ids, 1, True)], blocksize) == '001\t1\n'
+
+
+def test_filter_lines_crlf():
+    # CRLFの行は、まとめて調べるときも1行ずつ調べるときと同じく\rを除いて書き出す
+    users, lines = make_edges(1, n=300)
+    ids = IdSet([str(u).encode() for u in users[:3]])
+    crlf = [line.replace('\n', '\r\n') for line in lines] + ['\r\n']
+    for column in [0, 1]:
+        expected = expected_lines(lines, [({str(u) for u in users[:3]}, column, True)])
+        for blocksize in [64, 1 << 20]:
+            assert run_filter(crlf, [IdFilter(ids, column, True)], blocksize) == expected
@@ -0,0 +1,78 @@
+# coding: utf-8
+
+'''
+グラフのクラスごとの読み込み時間、getrowの速さ、メモリ使用量を調べる
+
+ピークのメモリ使用量は、クラスごとにforkした子プロセスのru_maxrssの増分で測る。
+
+    python -m snlocest.tests.test_speed_graph [edgefile] [labelfile]
+'''
+
+import os
+import sys
+import time
+import pickle
+import resource
+import numpy as np
+import pytest
+
+from snlocest.graph import ArrayCSRGraph, CSRGraph, SpMatLikeDOLGraph
+
+TEST_EDGEFILE = 'testdata/test-dataset/networks/f_follower.tsv'
+TEST_LABELFILE = 'testdata/test-dataset/groundtruth/labels.tsv'
+GRAPHS = [SpMatLikeDOLGraph, CSRGraph, ArrayCSRGraph]
+
+
+def measure(Graph, edgefile, labelfile, n_getrow=100000):
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t = time.time()
+    graph = Graph().load_edgelist(edgefile).load_labellist(labelfile)
+    load_time = time.time() - t
+
+    rows = np.random.RandomState(0).randint(0, len(graph.nodes), n_getrow).tolist()
+    t = time.time()
+    for i in rows:
+        graph.getrow(i)
+    getrow_time = (time.time() - t) / n_getrow
+
+    maxrss_delta = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - maxrss
+    return {'load': load_time, 'getrow': getrow_time, 'maxrss_kb': maxrss_delta}
+
+
+def measure_in_child(Graph, edgefile, labelfile):
+    '''前の計測のメモリが残らないように、子プロセスで計測する'''
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        with os.fdopen(w, 'wb') as f:
+            pickle.dump(measure(Graph, edgefile, labelfile), f)
+        os._exit(0)
+    os.close(w)
+    with os.fdopen(r, 'rb') as f:
+        result = pickle.load(f)
+    os.waitpid(pid, 0)
+    return result
+
+
+def run(edgefile, labelfile):
+    results = {}
+    for Graph in GRAPHS:
+        result = measure_in_child(Graph, edgefile, labelfile)
+        print('{}\tload: {:.2f} s\tgetrow: {:.2f} us\tmaxrss: {:.1f} MB'.format(
+            Graph.__name__, result['load'], result['getrow'] * 1e6, result['maxrss_kb'] / 1024))
+        results[Graph.__name__] = result
+    return results
+
+
+@pytest.mark.skipif(not os.path.exists(TEST_EDGEFILE), reason='testdata not found')
+def test_speed_graph():
+    results = run(TEST_EDGEFILE, TEST_LABELFILE)
+    assert results['ArrayCSRGraph']['getrow'] < results['SpMatLikeDOLGraph']['getrow']
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        run(sys.argv[1], sys.argv[2])
+    else:
+        run(TEST_EDGEFILE, TEST_LABELFILE)
@@ -0,0 +1,58 @@
+# coding: utf-8
+
+import doctest
+import itertools
+
+import snlocest.tweetfilter as tweetfilter
+from snlocest.tweetfilter import TweetFilter, yogitsune_filter, bot_filter
+
+
+def test_doctest():
+    assert doctest.testmod(tweetfilter).failed == 0
+
+
+def original_filter(tweet):
+    '''これまでのtweet_filter'''
+    try:
+        return all([yogitsune_filter(tweet), bot_filter(tweet)])
+    except KeyError:
+        return False
+
+
+def test_TweetFilter():
+    sources = ['Twitter for iPhone', 'NightFoxDuo', 'nightfoxduo client', 'my Bot', 'BOTTLE', 'bOt']
+    texts = ['こんにちは', 'きつねかわいい！！！です']
+    coordinates = [None, {'coordinates': [139.7, 35.6]}, {'coordinates': [135.772691, 34.967096]},
+                   {'coordinates': ['135.772695', '34.967099']}, {}]
+    names = ['山田', 'ロボット人工無能', 'Bot太郎']
+    descriptions = [None, '', 'よろしく', 'BOTです']
+    screen_names = ['yamada', 'botan', 'taBOT']
+
+    f = TweetFilter()
+    n = 0
+    accepted = 0
+    for source, text, coord, name, desc, sn in itertools.product(
+            sources, texts, coordinates, names, descriptions, screen_names):
+        tweet = {'source': source, 'text': text, 'coordinates': coord,
+                 'user': {'name': name, 'description': desc, 'screen_name': sn}}
+        if coord == {}:
+            del tweet['coordinates']
+        expected = original_filter(tweet)
+        assert f(tweet) == expected
+        assert tweetfilter.tweet_filter(tweet) == expected
+        n += 1
+        accepted += expected
+
+        # キーがないツイート (その前のルールで取り除かれることもある)
+        for key in ['source', 'text', 'user']:
+            missing = dict(tweet)
+            del missing[key]
+            assert f.reject_reason(missing) is not None
+            assert tweetfilter.tweet_filter(missing) == original_filter(missing) == False
+
+    # 取り除いた理由ごとの数 (__call__で数えたもの)
+    assert 0 < accepted < n
+    assert sum(f.counts.values()) == n - accepted
+    assert f.reject_reason({'source': 'Twitter', 'text': ''}) == tweetfilter.REJECT_MISSING_KEY
+    assert set(f.counts) == {tweetfilter.REJECT_NIGHTFOXDUO, tweetfilter.REJECT_KITSUNE,
+                             tweetfilter.REJECT_COORDINATES, tweetfilter.REJECT_BOT}
@@ -8,7 +8,7 @@ import os
 import os.path
 from subprocess import run
 import luigi
-from snlocest.tools.socialnetwork import Edgelist, HomeLocation
+from snlocest.tools.socialnetwork import Edgelist, HomeLocation, CompiledNetwork
 
 
 
@@ -19,9 +19,14 @@ class LeaveOneOutPrediction(luigi.Task):
     edgetype = luigi.ChoiceParameter(choices=['linked', 'mutual', 'followee', 'follower'])
     method = luigi.Parameter()
     extra = luigi.BoolParameter(default=False)
+    compiled = luigi.BoolParameter(default=False) # Trueなら.npyに変換したグラフを使う
 
     def requires(self):
-        return {'edgelist': Edgelist(name=self.name, edgetype=self.edgetype), 'truth': HomeLocation(name=self.name)}
+        if self.compiled:
+            edgelist = CompiledNetwork(name=self.name, edgetype=self.edgetype)
+        else:
+            edgelist = Edgelist(name=self.name, edgetype=self.edgetype)
+        return {'edgelist': edgelist, 'truth': HomeLocation(name=self.name)}
 
     def output(self):
         return luigi.LocalTarget(os.path.join('data/experiments/loocv/predicted', self.name, self.method, 'f_{}.tsv'.format(self.edgetype)))
@@ -35,16 +40,51 @@ class LeaveOneOutPrediction(luigi.Task):
             run(cmd.format(self.method, extra_cmd, temp_output_path, **self.input()), shell=True, check=True)
 
 
+class LeaveOneOutPredictionAll(luigi.Task):
+    '''1つのエッジの種類について、すべての手法のLeave-one-outを1プロセスで実行する (snlocest.scripts.batchcv)
+
+    出力はLeaveOneOutPredictionと同じ。
+    '''
+    name = luigi.Parameter() # データセット名
+    edgetype = luigi.ChoiceParameter(choices=['linked', 'mutual', 'followee', 'follower'])
+    methods = luigi.TupleParameter(default=('mv', 'gm', 'pm', 'rn'))
+    extra = luigi.BoolParameter(default=False)
+    compiled = luigi.BoolParameter(default=False) # Trueなら.npyに変換したグラフを使う
+    n_jobs = luigi.IntParameter(default=1, significant=False)
+
+    def requires(self):
+        if self.compiled:
+            edgelist = CompiledNetwork(name=self.name, edgetype=self.edgetype)
+        else:
+            edgelist = Edgelist(name=self.name, edgetype=self.edgetype)
+        return {'edgelist': edgelist, 'truth': HomeLocation(name=self.name)}
+
+    def output(self):
+        return [LeaveOneOutPrediction(name=self.name, edgetype=self.edgetype, method=method).output()
+                for method in self.methods]
+
+    def run(self):
+        from snlocest.scripts import batchcv
+        import snlocest.util as util
+        # compiledならCompiledNetworkで保存したクラス、そうでなければArrayCSRGraphで読み込む
+        graph, x, y = util.load_dataset(self.input()['edgelist'].path, self.input()['truth'].path)
+        methods = batchcv.build_methods(graph, self.methods)
+        paths = {method: target.path for method, target in zip(self.methods, self.output())}
+        batchcv.loo(graph, x, y, methods, lambda method: paths[method],
+                    n_jobs=self.n_jobs, extra_info=self.extra)
+
+
 class LeaveOneOutEvaluation(luigi.Task):
     name = luigi.Parameter()
     edgetypes = luigi.TupleParameter(default=('linked', 'mutual', 'followee', 'follower'))
     methods = luigi.TupleParameter(default=('mv', 'gm', 'pm', 'rn'))
+    compiled = luigi.BoolParameter(default=False)
 
     def requires(self):
         yield HomeLocation(name=self.name)
         for edgetype in self.edgetypes:
-            for method in self.methods:
-                yield LeaveOneOutPrediction(name=self.name, edgetype=edgetype, method=method)
+            # エッジの種類ごとにグラフを1回だけ読み込んで、すべての手法を推定する
+            yield LeaveOneOutPredictionAll(name=self.name, edgetype=edgetype, methods=self.methods, compiled=self.compiled)
 
     def output(self):
         output_path = os.path.join('data/experiments/loocv/evaluation', '{}.tsv'.format(self.name))
@@ -54,8 +94,9 @@ class LeaveOneOutEvaluation(luigi.Task):
         truth = self.input()[0]
         cmd = 'python -m snlocest.scripts.evaluate_prf {} {} >> {}'
         with self.output().temporary_path() as temp_output_path:
-            for result in self.input()[1:]:
-                run(cmd.format(truth.path, result.path, temp_output_path), shell=True, check=True)
+            for results in self.input()[1:]:
+                for result in results:
+                    run(cmd.format(truth.path, result.path, temp_output_path), shell=True, check=True)
 
 
 # ---- K-fold cross-validation -----
@@ -69,9 +110,14 @@ class KFoldPredictionOne(luigi.Task):
     n_splits = luigi.IntParameter()
     stem = luigi.Parameter(default='result')
     #ext
+    compiled = luigi.BoolParameter(default=False) # Trueなら.npyに変換したグラフを使う
 
     def requires(self):
-        return {'edgelist': Edgelist(name=self.name, edgetype=self.edgetype), 'truth': HomeLocation(name=self.name)}
+        if self.compiled:
+            edgelist = CompiledNetwork(name=self.name, edgetype=self.edgetype)
+        else:
+            edgelist = Edgelist(name=self.name, edgetype=self.edgetype)
+        return {'edgelist': edgelist, 'truth': HomeLocation(name=self.name)}
 
     def output(self):
         return luigi.LocalTarget(os.path.join('data/experiments/kfoldcv/predicted', self.name, self.method, self.edgetype, '{}_{}.tsv'.format(self.stem, self.ith)))
@@ -90,22 +136,61 @@ class KFoldPredictionOne(luigi.Task):
                             output=temp_output_path), shell=True, check=True)
 
 
+class KFoldPredictionAll(luigi.Task):
+    '''1つのエッジの種類について、すべての手法、すべての分割の推定を1プロセスで実行する (snlocest.scripts.batchcv)
+
+    グラフは1回だけ読み込み、各手法はすべてのラベルで1回だけ学習する。
+    出力はKFoldPredictionOneと同じ。
+    '''
+    name = luigi.Parameter() # データセット名
+    edgetype = luigi.ChoiceParameter(choices=['linked', 'mutual', 'followee', 'follower'])
+    methods = luigi.TupleParameter(default=('mv', 'gm', 'pm', 'rn'))
+    random_state = luigi.IntParameter()
+    n_splits = luigi.IntParameter()
+    stem = luigi.Parameter(default='result')
+    compiled = luigi.BoolParameter(default=False) # Trueなら.npyに変換したグラフを使う
+    n_jobs = luigi.IntParameter(default=1, significant=False)
+
+    def requires(self):
+        if self.compiled:
+            edgelist = CompiledNetwork(name=self.name, edgetype=self.edgetype)
+        else:
+            edgelist = Edgelist(name=self.name, edgetype=self.edgetype)
+        return {'edgelist': edgelist, 'truth': HomeLocation(name=self.name)}
+
+    def _prediction(self, method, ith):
+        return KFoldPredictionOne(name=self.name, edgetype=self.edgetype, method=method, ith=ith,
+                                  random_state=self.random_state, n_splits=self.n_splits, stem=self.stem)
+
+    def output(self):
+        return [self._prediction(method, i).output() for method in self.methods for i in range(self.n_splits)]
+
+    def run(self):
+        from snlocest.scripts import batchcv
+        import snlocest.util as util
+        # compiledならCompiledNetworkで保存したクラス、そうでなければArrayCSRGraphで読み込む
+        graph, x, y = util.load_dataset(self.input()['edgelist'].path, self.input()['truth'].path)
+        methods = batchcv.build_methods(graph, self.methods)
+        batchcv.kfold(graph, x, y, methods, lambda method, i: self._prediction(method, i).output().path,
+                      n_splits=self.n_splits, random_state=self.random_state, n_jobs=self.n_jobs)
+
+
 class KFoldEvaluation(luigi.Task):
     name = luigi.Parameter()
     edgetypes = luigi.TupleParameter(default=('linked', 'mutual', 'followee', 'follower'))
     methods = luigi.TupleParameter(default=('mv', 'gm', 'pm', 'rn'))
     random_state = luigi.IntParameter(default=50)
     n_splits = luigi.IntParameter(default=10)
+    compiled = luigi.BoolParameter(default=False)
 
     def requires(self):
         yield HomeLocation(name=self.name)
         for edgetype in self.edgetypes:
-            for method in self.methods:
-                for i in range(self.n_splits):
-                    yield KFoldPredictionOne(
-                        name=self.name, 
-                        edgetype=edgetype, method=method, ith=i,
-                        random_state=self.random_state, n_splits=self.n_splits)
+            # エッジの種類ごとにグラフを1回だけ読み込んで、すべての手法、すべての分割を推定する
+            yield KFoldPredictionAll(
+                name=self.name, edgetype=edgetype, methods=self.methods,
+                random_state=self.random_state, n_splits=self.n_splits,
+                compiled=self.compiled)
 
     def output(self):
         output_path = os.path.join('data/experiments/kfoldcv/evaluation', '{}.tsv'.format(self.name))
@@ -115,7 +200,7 @@ class KFoldEvaluation(luigi.Task):
         truth = self.input()[0]
         cmd = 'python -m snlocest.scripts.evaluate_prf --random-state {random_state} {truth} {result_dir} >> {output}'
 
-        result_paths = [result.path for result in self.input()[1:]]
+        result_paths = [result.path for results in self.input()[1:] for result in results]
         dirs = {os.path.dirname(path) for path in result_paths}
         with self.output().temporary_path() as temp_output_path:
             for result_dir in dirs:
@@ -1,11 +1,17 @@
 # coding: utf-8
 
+import datetime
 import glob
+import gzip
 import os.path
 from subprocess import run
 
 import luigi
+import luigi.date_interval
 from snlocest.tools.areadb import PreprocessAreaDataTask
+from snlocest.areacount import read_area_matches, count_pairs, save_counts, merge_count_files, decompose_date_range
+from snlocest.homelocation import (home_table_sorted, save_home_table, load_home_table, threshold_mask,
+                                   write_home_table, homelocation_filename, materialize_thresholds)
 
 
 # これらはdefault configに書きたい
@@ -71,9 +77,11 @@ class AreaMatchTask(luigi.Task):
     Args:
         date (datetime): date of geo-tagged tweets
         output_dir (string, optional): (default='data/geotweets/area')
+        workers (int, optional): The number of processes of areamatcher (default=1)
     '''
     date = luigi.DateParameter(description='date of geotweet')
     output_dir = luigi.Parameter(default=os.path.join(PREPROCESS_GEOTWEETS_DIR, 'area'))
+    workers = luigi.IntParameter(default=1, significant=False)
 
     def requires(self):
         return [ExtractMetaDataFromGeoTweetsTask(date=self.date), PreprocessAreaDataTask()]
@@ -84,7 +92,7 @@ class AreaMatchTask(luigi.Task):
 
     def run(self):
         with self.output().temporary_path() as temp_output_path:
-            run('gzip -dc {} | python -m snlocest.scripts.areamatcher --gxml {} | gzip > {}'.format(self.input()[0].path, self.input()[1].path, temp_output_path), shell=True, check=True)
+            run('gzip -dc {} | python -m snlocest.scripts.areamatcher --gxml {} --workers {} | gzip > {}'.format(self.input()[0].path, self.input()[1].path, self.workers, temp_output_path), shell=True, check=True)
 
 
 class RangeAreaMatchTask(luigi.WrapperTask):
@@ -103,6 +111,7 @@ class CountArea(luigi.Task):
     '''Task: Count the number of appearances of the area for each user
 
     ユーザごとにエリアIDの出現数を数える
+    出力は(user_id, area_id, count)の配列の.npy (snlocest.areacount)
 
     Args:
         date (datetime): The date of the processing
@@ -115,18 +124,68 @@ class CountArea(luigi.Task):
         return AreaMatchTask(date=self.date)
 
     def output(self):
-        return luigi.LocalTarget(os.path.join(self.output_dir, self.date.strftime('%Y-%m'), self.date.strftime('%Y-%m-%d.tsv')))
+        return luigi.LocalTarget(os.path.join(self.output_dir, self.date.strftime('%Y-%m'), self.date.strftime('%Y-%m-%d.npy')))
 
     def run(self):
-        #TODO 今はprepare_countarea.pyを実行しているけど、その内容をここに展開して良い
         with self.output().temporary_path() as temp_output_path:
-            run('gzip -dc {} | python -m snlocest.scripts.prepare_countarea > {}'.format(self.input().path, temp_output_path), shell=True, check=True)
+            with gzip.open(self.input().path, 'rb') as fp:
+                users, areas = read_area_matches(fp)
+            save_counts(temp_output_path, count_pairs(users, areas))
+
+
+class MonthlyCountArea(luigi.Task):
+    '''Task: Roll up the daily counts of the area into a month
+
+    月ごとにCountAreaの出力をまとめる (出力は同じ形式の.npy)
+    一度作れば、その月を含む範囲の集計ではこの月の日ごとのファイルは読まない
+
+    Args:
+        month (datetime): The month of the processing
+        output_dir (string, optional): default='data/geotweets/countarea/monthly'
+    '''
+    month = luigi.MonthParameter()
+    output_dir = luigi.Parameter(default=os.path.join(PREPROCESS_GEOTWEETS_DIR, 'countarea', 'monthly'))
+
+    def requires(self):
+        return [CountArea(date=date) for date in luigi.date_interval.Month(self.month.year, self.month.month)]
+
+    def output(self):
+        return luigi.LocalTarget(os.path.join(self.output_dir, self.month.strftime('%Y-%m.npy')))
+
+    def run(self):
+        with self.output().temporary_path() as temp_output_path:
+            save_counts(temp_output_path, merge_count_files([i.path for i in self.input()]))
+
+
+class YearlyCountArea(luigi.Task):
+    '''Task: Roll up the monthly counts of the area into a year
+
+    年ごとにMonthlyCountAreaの出力をまとめる
+
+    Args:
+        year (datetime): The year of the processing
+        output_dir (string, optional): default='data/geotweets/countarea/yearly'
+    '''
+    year = luigi.YearParameter()
+    output_dir = luigi.Parameter(default=os.path.join(PREPROCESS_GEOTWEETS_DIR, 'countarea', 'yearly'))
+
+    def requires(self):
+        return [MonthlyCountArea(month=datetime.date(self.year.year, m, 1)) for m in range(1, 13)]
+
+    def output(self):
+        return luigi.LocalTarget(os.path.join(self.output_dir, self.year.strftime('%Y.npy')))
+
+    def run(self):
+        with self.output().temporary_path() as temp_output_path:
+            save_counts(temp_output_path, merge_count_files([i.path for i in self.input()]))
 
 
 class AggregateCountArea(luigi.Task):
     '''Task: Aggregate the count for each file
 
     ファイルごとに数えたエリアを合計する
+    範囲は年・月・日の単位に分け (areacount.decompose_date_range)、YearlyCountArea, MonthlyCountArea,
+    CountAreaの出力をagg_count.pyでユーザIDの範囲ごとにマージする
 
     Args:
         date_range (datetime-datetime):
@@ -138,7 +197,10 @@ class AggregateCountArea(luigi.Task):
     output_prefix = luigi.Parameter(default='aggarea')
 
     def requires(self):
-        return [CountArea(date=date) for date in self.date_range]
+        tasks = {'year': lambda date: YearlyCountArea(year=date),
+                 'month': lambda date: MonthlyCountArea(month=date),
+                 'day': lambda date: CountArea(date=date)}
+        return [tasks[unit](date) for unit, date in decompose_date_range(self.date_range.date_a, self.date_range.date_b)]
 
     def output(self):
         path = os.path.join(self.output_dir, '{}-{}.tsv'.format(self.output_prefix, self.date_range))
@@ -150,6 +212,32 @@ class AggregateCountArea(luigi.Task):
             run('python -m snlocest.scripts.agg_count {} | LC_ALL=C sort > {}'.format(input_files, temp_output_path), shell=True, check=True)
 
 
+class HomeLocationTable(luigi.Task):
+    '''Task: Compute the majority area, its count and the total count for each user
+
+    ユーザごとの最多のエリア、そのツイート数、総ツイート数の表 (.npy, snlocest.homelocation)
+    しきい値で絞り込む前の表なので、しきい値ごとの居住地はこの表から作る
+
+    Args:
+        date_range (datetime-datetime):
+        output_dir (string, optional): output directory
+    '''
+    date_range = luigi.DateIntervalParameter()
+    output_dir = luigi.Parameter(default=os.path.join(PREPROCESS_GEOTWEETS_DIR, 'homelocation', 'table'))
+
+    def requires(self):
+        return AggregateCountArea(date_range=self.date_range)
+
+    def output(self):
+        return luigi.LocalTarget(os.path.join(self.output_dir, '{}.npy'.format(self.date_range)))
+
+    def run(self):
+        # AggregateCountAreaの出力はユーザごとにソートされているので、一定のメモリで順に読む
+        with self.output().temporary_path() as temp_output_path:
+            with open(self.input().path) as fp:
+                save_home_table(temp_output_path, home_table_sorted(fp))
+
+
 class SelectMajorityHomeLocation(luigi.Task):
     '''Task: Select the home loation by majority voting
 
@@ -166,16 +254,52 @@ class SelectMajorityHomeLocation(luigi.Task):
     output_dir = luigi.Parameter(default=os.path.join(PREPROCESS_GEOTWEETS_DIR, 'homelocation', 'majority'))
 
     def requires(self):
-        return AggregateCountArea(date_range=self.date_range)
+        return HomeLocationTable(date_range=self.date_range)
 
     def output(self):
-        path = os.path.join(self.output_dir, '{}_MinMajorityNum-{}_MinTotalNum-{}.tsv'.format(self.date_range, self.min_majoritynum, self.min_totalnum))
+        path = os.path.join(self.output_dir, homelocation_filename(self.date_range, self.min_majoritynum, self.min_totalnum))
         return luigi.LocalTarget(path)
 
     def run(self):
-        cmd = 'cat {} | python -m snlocest.scripts.decidehomelocation --min-majoritynum {} --min-totalnum {} > {}'
-        with self.output().temporary_path() as temp_output_path:
-            run(cmd.format(self.input().path, self.min_majoritynum, self.min_totalnum, temp_output_path), shell=True, check=True)
+        table = load_home_table(self.input().path)
+        with self.output().open('w') as fp:
+            write_home_table(table, fp, mask=threshold_mask(table, self.min_majoritynum, self.min_totalnum))
+
+
+class SelectMajorityHomeLocationGrid(luigi.Task):
+    '''Task: Select the home locations for all combinations of the thresholds at once
+
+    min_majoritynumsとmin_totalnumsのすべての組み合わせの居住地を、1度読んだ表からまとめて出力する
+    出力はしきい値ごとのSelectMajorityHomeLocationの出力と同じ
+
+    Args:
+        date_range (datetime-datetime):
+        min_majoritynums (list of int, optional): default=[1]
+        min_totalnums (list of int, optional): default=[1]
+        output_dir (string, optional): output directory
+    '''
+    date_range = luigi.DateIntervalParameter()
+    min_majoritynums = luigi.ListParameter(default=[1])
+    min_totalnums = luigi.ListParameter(default=[1])
+    output_dir = luigi.Parameter(default=os.path.join(PREPROCESS_GEOTWEETS_DIR, 'homelocation', 'majority'))
+
+    def thresholds(self):
+        return [(m, t) for m in self.min_majoritynums for t in self.min_totalnums]
+
+    def requires(self):
+        return HomeLocationTable(date_range=self.date_range)
+
+    def output(self):
+        return [luigi.LocalTarget(os.path.join(self.output_dir, homelocation_filename(self.date_range, m, t)))
+                for m, t in self.thresholds()]
+
+    def run(self):
+        table = load_home_table(self.input().path, mmap=False)
+        outfiles = [target.open('w') for target in self.output()]
+        # 全部書き終わってからcloseして、出力をそろって置き換える
+        materialize_thresholds(table, self.thresholds(), outfiles)
+        for outfile in outfiles:
+            outfile.close()
 
 
 class TestTask(luigi.Task):
@@ -6,8 +6,10 @@
 
 import os.path
 import glob
+from contextlib import ExitStack
 from subprocess import run
 import luigi
+from snlocest.graph import FOLLOW_NETWORKS
 
 
 NETWORK_DIR = 'data/socnetwork'
@@ -118,7 +120,8 @@ class RemainedHomeLocation(luigi.Task):
         return luigi.LocalTarget(os.path.join('data/datasets', self.name, 'groundtruth', os.path.basename(self.input()['userlist'].path)))
 
     def run(self):
-        cmd = 'cat {userlist.path} | python -m snlocest.scripts.edgefilter -e {unknown.path} | python -m snlocest.scripts.edgefilter -i {seed.path} > {}'
+        # unknownの除外とseedの抽出を1度に行う
+        cmd = 'python -m snlocest.scripts.edgefilter {userlist.path} {unknown.path} -e --and-include {seed.path} > {}'
         with self.output().temporary_path() as temp_output_path:
             run(cmd.format(temp_output_path, **self.input()), shell=True, check=True)
 
@@ -245,6 +248,31 @@ class FollowSocialNetworks(luigi.WrapperTask):
         return [N(month=self.month, name=self.name) for N in networks]
 
 
+class FollowSocialGraphs(luigi.Task):
+    '''MasterFollowEdgelistを1度だけ読み込んで、4種類のネットワークをCSRGraphの.npyファイルのディレクトリにする
+
+    FollowSocialNetworksのエッジリストをCompiledNetwork (--int-ids) で変換したものと同じ場所に同じもの
+    (正解データのラベルも含む) を作る。
+    外部ソートはせず、隣接行列の演算で作る (scripts/buildnetworks.py)。
+    '''
+    month = luigi.MonthParameter()
+    name = luigi.Parameter()
+
+    def requires(self):
+        return {'edgelist': MasterFollowEdgelist(month=self.month, name=self.name), 'truth': HomeLocation(name=self.name)}
+
+    def output(self):
+        return {n: luigi.LocalTarget(os.path.join('data/datasets', self.name, 'networks', 'f_{}.graph'.format(n)))
+                for n in FOLLOW_NETWORKS}
+
+    def run(self):
+        with ExitStack() as stack:
+            paths = {n: stack.enter_context(target.temporary_path()) for n, target in self.output().items()}
+            options = ' '.join('--{} {}'.format(n, path) for n, path in sorted(paths.items()))
+            cmd = 'python -m snlocest.scripts.buildnetworks {edgelist.path} {} --labelfile {truth.path}'
+            run(cmd.format(options, **self.input()), shell=True, check=True)
+
+
 # ------- external dataset ----
 
 class Edgelist(luigi.ExternalTask):
@@ -265,6 +293,29 @@ class HomeLocation(luigi.ExternalTask):
         return luigi.LocalTarget(files[0])
 
 
+class CompiledNetwork(luigi.Task):
+    '''Edgelistとその正解データをCSRGraphの.npyファイルのディレクトリに変換する
+
+    変換したディレクトリはEdgelistの代わりにloocv.py, kfoldcv.pyに渡せる。
+    ノードIDはint64として保存する（ノードIDが数値でなければ--str-ids）。
+    '''
+    name = luigi.Parameter()
+    edgetype = luigi.Parameter()
+    str_ids = luigi.BoolParameter(default=False)
+
+    def requires(self):
+        return {'edgelist': Edgelist(name=self.name, edgetype=self.edgetype), 'truth': HomeLocation(name=self.name)}
+
+    def output(self):
+        return luigi.LocalTarget(os.path.join('data/datasets', self.name, 'networks', 'f_{}.graph'.format(self.edgetype)))
+
+    def run(self):
+        cmd = 'python -m snlocest.scripts.compilegraph {edgelist.path} {} --labelfile {truth.path} {}'
+        ids = '--str-ids' if self.str_ids else '--int-ids'
+        with self.output().temporary_path() as temp_output_path:
+            run(cmd.format(temp_output_path, ids, **self.input()), shell=True, check=True)
+
+
 # ------- closed network ----
 
 class ClosedNetwork(luigi.Task):
@@ -19,21 +19,128 @@ DEIM Forum 2015 G8-1
 Implementation:
 （1） Twitterクライアント名に「nightfoxduo（大文字と小文字を区別しない）」を含む
 
+tweet_filter()はTweetFilterで(1),(2),(3),(4)をまとめて判定する。
+yogitsune_filter()とbot_filter()は各ルールをそのまま実装したもの。
 '''
 
 import math
+from collections import Counter
 
 
+# 取り除く理由
+REJECT_NIGHTFOXDUO = 'nightfoxduo' # (1)
+REJECT_KITSUNE = 'kitsune' # (2)
+REJECT_COORDINATES = 'coordinates' # (3)
+REJECT_BOT = 'bot' # (4)
+REJECT_MISSING_KEY = 'missing_key' # 必要なキーがない
+
+BOT_WORDS = ('BOT', 'Bot', 'bot', '人工無能')
+
+
+def make_contains_any(words):
+    '''文字列がwordsのどれかを含むかを判定する関数を作る
+
+    >>> f = make_contains_any(['BOT', '人工無能'])
+    >>> f('あいうBOTえお'), f('bot')
+    (True, False)
+    '''
+    words = tuple(words)
+    return lambda s: any(w in s for w in words)
+
+
+class TweetFilter():
+    '''(1),(2),(3),(4)のルールをまとめて判定するツイートフィルタ
+
+    yogitsune_filter()とbot_filter()の両方を満たすときだけツイートを残す (キーがなければ取り除く)。
+    ルールは(1),(3),(2),(4)の順に判定し、取り除くと決まった時点で残りのルールは判定しない。
+    (4)はユーザ名、プロフィール、アカウント名をつなげた文字列について各単語を1回ずつ探す。
+    Twitterクライアント名は種類が少ないので、(1)と(4)のクライアント名の判定結果をキャッシュする。
+
+    CPythonでは、単語の数が少なければ正規表現で単語をまとめて探すより、strのinで1つずつ探すほうが速いので、
+    単語はmake_contains_any()で判定する。
+
+    >>> f = TweetFilter()
+    >>> user = {'name': 'あいう', 'description': None, 'screen_name': 'abc'}
+    >>> f.reject_reason({'source': 'Twitter', 'text': '', 'user': user}) is None
+    True
+    >>> f.reject_reason({'source': 'NightfoxDuo', 'text': '', 'user': user})
+    'nightfoxduo'
+    >>> f.reject_reason({'source': 'Twitter', 'text': '', 'user': dict(user, screen_name='botan')})
+    'bot'
+    >>> f.reject_reason({'source': 'Twitter', 'text': ''})
+    'missing_key'
+    >>> [f(t) for t in [{'source': 'Twitter', 'text': '', 'user': user}, {'source': 'Bot', 'text': '', 'user': user}]]
+    [True, False]
+    >>> f.counts
+    Counter({'bot': 1})
+    '''
+    def __init__(self, bot_words=BOT_WORDS, client='nightfoxduo', text='きつねかわいい！！！',
+                 coordinates=(135.772691, 34.967096), max_cache_size=100000):
+        self.bot_words = tuple(bot_words)
+        self._has_bot_word = make_contains_any(self.bot_words)
+        self.client = client.lower()
+        self.text = text
+        self.coordinates = coordinates
+        self.max_cache_size = max_cache_size
+        # 取り除いたツイートの理由ごとの数 (__call__で数える)
+        self.counts = Counter()
+        # クライアント名 -> (1)に当てはまるか, (4)の単語を含むか
+        self._source_cache = {}
+
+    def __call__(self, tweet):
+        '''filter関数に使う。tweetを取り除きたいときFalseを返し、理由ごとの数を数える'''
+        reason = self.reject_reason(tweet)
+        if reason is None:
+            return True
+        self.counts[reason] += 1
+        return False
+
+    def _check_source(self, source):
+        result = self._source_cache.get(source)
+        if result is None:
+            result = (self.client in source.lower(), self._has_bot_word(source))
+            if len(self._source_cache) >= self.max_cache_size:
+                self._source_cache.clear()
+            self._source_cache[source] = result
+        return result
+
+    def reject_reason(self, tweet):
+        '''tweetを取り除く理由 (REJECT_*) を返す。取り除かないときはNoneを返す'''
+        try:
+            # (1)
+            client_rule, source_has_bot_word = self._check_source(tweet['source'])
+            if client_rule:
+                return REJECT_NIGHTFOXDUO
+            # (3)
+            coordinates = tweet.get('coordinates')
+            if coordinates:
+                coox, cooy = coordinates['coordinates']
+                # 緯度経度の大きさでは、math.isclose(a, b, abs_tol=1e-5) は abs(a - b) <= 1e-5 と同じ
+                if (abs(float(cooy) - self.coordinates[1]) <= 1e-5
+                        and abs(float(coox) - self.coordinates[0]) <= 1e-5):
+                    return REJECT_COORDINATES
+            # (2)
+            if self.text in tweet['text']:
+                return REJECT_KITSUNE
+            # (4)
+            user = tweet['user']
+            if (source_has_bot_word
+                    or self._has_bot_word(user['name'] + '\n' + (user['description'] or '') + '\n' + user['screen_name'])):
+                return REJECT_BOT
+        except KeyError:
+            return REJECT_MISSING_KEY
+        return None
+
+
+_tweet_filter = TweetFilter()
+
 def tweet_filter(tweet):
     '''
     tweetをフィルタする。
     Returns:
         tweetを取り除きたいときFalseを返す
     '''
-    try:
-        return all([yogitsune_filter(tweet), bot_filter(tweet)])
-    except KeyError as e:
-        return False
+    return _tweet_filter.reject_reason(tweet) is None
 
 def yogitsune_filter(tweet):
     '''
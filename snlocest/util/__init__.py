@@ -1,6 +1,7 @@
 # coding: utf-8
 
 import sys
+import os.path
 import pandas as pd
 
 
@@ -22,11 +23,32 @@ def load_labellist(filename_or_buffer, delimiter='\t'):
     labels = mat[:, 1]
     return nodes.astype(str), labels
 
-def load_dataset(edgefile, labelfile, graphclass):
-    '''sklearnで使えるgraph, x, yを返す'''
-    graph = graphclass()
-    graph.load_edgelist(edgefile)
-    graph.load_labellist(labelfile)
+def load_dataset(edgefile, labelfile, graphclass=None):
+    '''sklearnで使えるgraph, x, yを返す
+
+    edgefileがディレクトリなら、CSRGraph.save()で保存したグラフをメモリマップして読み込む。
+    グラフのクラスは保存したもの (CSRGraphかInt64CSRGraph) になるので、
+    graphclassを指定するなら読み込んだグラフのクラス (かその親クラス) でないといけない (違えばValueError)。
+    ラベルはlabelfileがあればlabelfileから読み込み
+    (保存されたラベルとは別の正解データでも評価できるように)、labelfileがNoneなら保存されたラベルを使う。
+    edgefileがエッジリストなら、graphclass (NoneならArrayCSRGraph) で読み込む。
+    '''
+    if os.path.isdir(edgefile):
+        from snlocest.graph import CSRGraph
+        graph = CSRGraph.open(edgefile)
+        if graphclass is not None and not isinstance(graph, graphclass):
+            raise ValueError('{} is a compiled {}; it cannot be loaded as {}'.format(
+                edgefile, type(graph).__name__, graphclass.__name__))
+        if labelfile is not None:
+            graph.load_labellist(labelfile)
+        elif not len(graph.labeled_nodes):
+            raise ValueError('{} has no saved labels; labelfile is required'.format(edgefile))
+    else:
+        if graphclass is None:
+            from snlocest.graph import ArrayCSRGraph as graphclass
+        graph = graphclass()
+        graph.load_edgelist(edgefile)
+        graph.load_labellist(labelfile)
     nodes = graph.labeled_nodes
     labels = graph.labels
     x = graph.vto_nodeidx(nodes)
@@ -1,11 +1,12 @@
 # coding: utf-8
 
 '''
-推定手法のコマンドラインからの指定
+推定手法、グラフのクラスのコマンドラインからの指定
 '''
 
 import argparse
 from snlocest.methods import MajorityVote, GeometricMedian, ProbabilityModel, RandomNeighbor, NearestNeighbor
+from snlocest.graph import ArrayCSRGraph, CSRGraph, Int64CSRGraph, SpMatLikeDOLGraph
 
 
 METHOD_MAP = {
@@ -21,3 +22,17 @@ def snlocest_method(string):
         return METHOD_MAP[string]
     except KeyError:
         raise argparse.ArgumentTypeError('Implemented method names are [{}]'.format(', '.join(METHOD_MAP.keys())))
+
+
+GRAPH_MAP = {
+    'array': ArrayCSRGraph,
+    'csr': CSRGraph,
+    'int': Int64CSRGraph,
+    'dol': SpMatLikeDOLGraph,
+}
+
+def snlocest_graph(string):
+    try:
+        return GRAPH_MAP[string]
+    except KeyError:
+        raise argparse.ArgumentTypeError('Implemented graph names are [{}]'.format(', '.join(GRAPH_MAP.keys())))
@@ -0,0 +1,33 @@
+# coding: utf-8
+
+'''
+バイト列をNumPyの配列の演算でまとめてパースする (snlocest.areacount, snlocest.idfilter)
+'''
+
+import numpy as np
+
+
+def parse_int_spans(buf, starts, ends):
+    '''バイト列bufの区間 [starts, ends) の10進数の整数をまとめてパースする。数字以外があればNoneを返す
+
+    Args:
+        buf: np.ndarray (uint8) バイト列
+        starts, ends: np.ndarray 各区間の先頭と末尾 (末尾は含まない) の位置
+    Returns:
+        int64の配列。空の区間、20桁以上の区間、int64の範囲を超える値があってもNone
+    '''
+    lengths = ends - starts
+    if len(lengths) and (lengths.min() <= 0 or lengths.max() > 19):
+        return None
+    values = np.zeros(len(starts), dtype=np.int64)
+    for j in range(int(lengths.max()) if len(lengths) else 0):
+        # 下からj桁目
+        valid = lengths > j
+        digits = buf[np.where(valid, ends - 1 - j, 0)].astype(np.int64) - ord('0')
+        if ((digits < 0) | (digits > 9))[valid].any():
+            return None
+        values += np.where(valid, digits, 0) * 10 ** j
+    # 19桁でint64の範囲を超えるとあふれて負になる
+    if (values < 0).any():
+        return None
+    return values
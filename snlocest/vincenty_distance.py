@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+'''
+Vincentyの公式 (逆解法) で、地球上での距離をまとめて計算する。
+
+geopy.distance.vincentyと同じ楕円体 (WGS-84)・同じ収束条件で、
+すべての組の距離を配列の演算で計算する。
+'''
+
+import numpy as np
+
+# WGS-84 (geopy.distance.ELLIPSOIDS['WGS-84'] と同じ値) [m]
+MAJOR = 6378137.0
+MINOR = 6356752.3142
+F = 1 / 298.257223563
+
+
+def vincenty_distance_array(lat1, lon1, lat2, lon2, iterations=20):
+    '''
+    引数の配列をbroadcastして、要素ごとの地球上での距離を計算して返す [m]
+    Args:
+        lat1: 緯度 y1 の配列 [radian]
+        lon1: 経度 x1 の配列 [radian]
+        lat2: 緯度 y2 の配列 [radian]
+        lon2: 経度 x2 の配列 [radian]
+        iterations: 最大の反復回数 (収束しない組があればValueError)
+    Returns:
+        距離の配列
+    '''
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(*[np.asarray(a, dtype=np.float64) for a in (lat1, lon1, lat2, lon2)])
+    delta_lng = lon2 - lon1
+    reduced1 = np.arctan((1 - F) * np.tan(lat1))
+    reduced2 = np.arctan((1 - F) * np.tan(lat2))
+    sin_u1, cos_u1 = np.sin(reduced1), np.cos(reduced1)
+    sin_u2, cos_u2 = np.sin(reduced2), np.cos(reduced2)
+
+    lambda_lng = delta_lng.copy()
+    done = np.zeros(delta_lng.shape, dtype=bool)
+    shape = delta_lng.shape
+    sin_sigma, cos_sigma, sigma = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+    cos_sq_alpha, cos2_sigma_m = np.zeros(shape), np.zeros(shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(iterations):
+            active = ~done
+            sin_l, cos_l = np.sin(lambda_lng), np.cos(lambda_lng)
+            s_sigma = np.sqrt((cos_u2 * sin_l) ** 2 + (cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_l) ** 2)
+            c_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_l
+            sig = np.arctan2(s_sigma, c_sigma)
+            # 同じ点 (s_sigma == 0) は距離0なので、値は使わない
+            sin_alpha = np.where(s_sigma == 0, 0, cos_u1 * cos_u2 * sin_l / s_sigma)
+            c_sq_alpha = 1 - sin_alpha ** 2
+            # 赤道上 (c_sq_alpha == 0) ではcos2_sigma_m = 0
+            c2_sigma_m = np.where(c_sq_alpha != 0, c_sigma - 2 * sin_u1 * sin_u2 / c_sq_alpha, 0.0)
+            C = F / 16. * c_sq_alpha * (4 + F * (4 - 3 * c_sq_alpha))
+            new_lambda = delta_lng + (1 - C) * F * sin_alpha * (
+                sig + C * s_sigma * (c2_sigma_m + C * c_sigma * (-1 + 2 * c2_sigma_m ** 2)))
+
+            # 収束していない組だけを更新する
+            for state, value in ((sin_sigma, s_sigma), (cos_sigma, c_sigma), (sigma, sig),
+                                 (cos_sq_alpha, c_sq_alpha), (cos2_sigma_m, c2_sigma_m)):
+                state[active] = value[active]
+            converged = (np.abs(new_lambda - lambda_lng) <= 10e-12) | (s_sigma == 0)
+            lambda_lng = np.where(active, new_lambda, lambda_lng)
+            done |= active & converged
+            if done.all():
+                break
+    if not done.all():
+        raise ValueError('Vincenty formula failed to converge!')
+
+    u_sq = cos_sq_alpha * (MAJOR ** 2 - MINOR ** 2) / MINOR ** 2
+    A = 1 + u_sq / 16384. * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    B = u_sq / 1024. * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = B * sin_sigma * (cos2_sigma_m + B / 4. * (
+        cos_sigma * (-1 + 2 * cos2_sigma_m ** 2)
+        - B / 6. * cos2_sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos2_sigma_m ** 2)))
+    return np.where(sin_sigma == 0, 0.0, MINOR * A * (sigma - delta_sigma))
+
+
+def vincenty_distance_pairwise(c1, c2, blocksize=256):
+    '''
+    2つの座標の集合のすべての組の距離を計算して返す [m]
+    Args:
+        c1: M個の coordinate (lat, lon) の配列 (M x 2) [degree]
+        c2: N個の coordinate (lat, lon) の配列 (N x 2) [degree]
+        blocksize: 1度に計算するc1の行数 (途中の配列の大きさを抑える)
+    Returns:
+        c1[i]とc2[j]の距離を(i, j)要素とする M x N の行列
+    '''
+    c1 = np.asarray(c1, dtype=np.float64).reshape(-1, 2)
+    c2 = np.asarray(c2, dtype=np.float64).reshape(-1, 2)
+    # geopy.Pointと同じく、緯度が範囲外ならエラーにする
+    if (np.abs(c1[:, 0]) > 90).any() or (np.abs(c2[:, 0]) > 90).any():
+        raise ValueError('Latitude must be in the [-90; 90] range.')
+    c1 = np.radians(c1)
+    c2 = np.radians(c2)
+    result = np.empty((len(c1), len(c2)), dtype=np.float64)
+    for i in range(0, len(c1), blocksize):
+        block = c1[i:i + blocksize]
+        result[i:i + blocksize] = vincenty_distance_array(block[:, 0, np.newaxis], block[:, 1, np.newaxis],
+                                                          c2[np.newaxis, :, 0], c2[np.newaxis, :, 1])
+    return result